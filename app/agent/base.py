@@ -7,6 +7,8 @@ from pydantic import BaseModel, Field, model_validator
 from app.llm import LLM
 from app.logger import logger
 from app.schema import AgentState, Memory, Message
+from app.tracing import get_tracer
+from app.usage import TokenUsage, track_usage
 
 
 class BaseAgent(BaseModel, ABC):
@@ -38,6 +40,15 @@ class BaseAgent(BaseModel, ABC):
     # Execution control
     max_steps: int = Field(default=10, description="Maximum steps before termination")
     current_step: int = Field(default=0, description="Current step in execution")
+    token_budget: Optional[int] = Field(
+        None, description="Maximum LLM tokens a run may use before it is ended"
+    )
+    cost_budget: Optional[float] = Field(
+        None, description="Maximum LLM cost a run may incur before it is ended"
+    )
+    usage: TokenUsage = Field(
+        default_factory=TokenUsage, description="LLM usage of the current or last run"
+    )
 
     duplicate_threshold: int = 2
 
@@ -52,6 +63,8 @@ class BaseAgent(BaseModel, ABC):
             self.llm = LLM(config_name=self.name.lower())
         if not isinstance(self.memory, Memory):
             self.memory = Memory()
+        if self.memory.max_tokens is None:
+            self.memory.max_tokens = self.llm.max_input_tokens
         return self
 
     @asynccontextmanager
@@ -129,25 +142,63 @@ class BaseAgent(BaseModel, ABC):
             self.update_memory("user", request)
 
         results: List[str] = []
-        async with self.state_context(AgentState.RUNNING):
-            while (
-                self.current_step < self.max_steps and self.state != AgentState.FINISHED
-            ):
-                self.current_step += 1
-                logger.info(f"Executing step {self.current_step}/{self.max_steps}")
-                step_result = await self.step()
-
-                # Check for stuck state
-                if self.is_stuck():
-                    self.handle_stuck_state()
-
-                results.append(f"Step {self.current_step}: {step_result}")
-
-            if self.current_step >= self.max_steps:
-                results.append(f"Terminated: Reached max steps ({self.max_steps})")
+        tracer = get_tracer()
+        with tracer.span(
+            "agent.run", kind="run", agent=self.name
+        ) as run_span, track_usage() as usage:
+            self.usage = usage
+            async with self.state_context(AgentState.RUNNING):
+                while (
+                    self.current_step < self.max_steps
+                    and self.state != AgentState.FINISHED
+                    and not self.exhausted_budget()
+                ):
+                    self.current_step += 1
+                    logger.info(f"Executing step {self.current_step}/{self.max_steps}")
+                    with tracer.span(
+                        "agent.step",
+                        kind="step",
+                        agent=self.name,
+                        step=self.current_step,
+                    ):
+                        step_result = await self.step()
+
+                    # Check for stuck state
+                    if self.is_stuck():
+                        self.handle_stuck_state()
+
+                    results.append(f"Step {self.current_step}: {step_result}")
+
+                if self.current_step >= self.max_steps:
+                    results.append(f"Terminated: Reached max steps ({self.max_steps})")
+                elif self.state != AgentState.FINISHED and (
+                    exhausted := self.exhausted_budget()
+                ):
+                    logger.warning(f"{self.name} stopped early: {exhausted}")
+                    results.append(f"Terminated: {exhausted}")
+
+            logger.info(f"{self.name} run usage: {usage.summary()}")
+            run_span.set_attributes(
+                steps=self.current_step,
+                total_tokens=usage.total_tokens,
+                cost=usage.cost,
+            )
 
         return "\n".join(results) if results else "No steps executed"
 
+    def exhausted_budget(self) -> Optional[str]:
+        """Describe the token or cost budget the current run has used up, if any"""
+        if (
+            self.token_budget is not None
+            and self.usage.total_tokens >= self.token_budget
+        ):
+            return (
+                f"Reached token budget ({self.usage.total_tokens}/{self.token_budget})"
+            )
+        if self.cost_budget is not None and self.usage.cost >= self.cost_budget:
+            return f"Reached cost budget ({self.usage.cost:.4f}/{self.cost_budget})"
+        return None
+
     @abstractmethod
     async def step(self) -> str:
         """Execute a single step in the agent's workflow.
@@ -189,3 +240,4 @@ class BaseAgent(BaseModel, ABC):
     def messages(self, value: List[Message]):
         """Set the list of messages in the agent's memory."""
         self.memory.messages = value
+        self.memory.compact()
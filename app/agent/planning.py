@@ -38,6 +38,8 @@ class PlanningAgent(ToolCallAgent):
     current_step_index: Optional[int] = None
 
     max_steps: int = 20
+    # think() prefixes the next step prompt with the current plan status
+    predictable_requests: bool = False
 
     @model_validator(mode="after")
     def initialize_plan_and_verify_tools(self) -> "PlanningAgent":
@@ -1,10 +1,11 @@
-from typing import List
+from typing import List, Optional
 
 from pydantic import Field
 
 from app.agent.toolcall import ToolCallAgent
 from app.prompt.swe import NEXT_STEP_TEMPLATE, SYSTEM_PROMPT
-from app.tool import Bash, StrReplaceEditor, Terminate, ToolCollection
+from app.tool import Bash, CodeSearch, StrReplaceEditor, Terminate, ToolCollection
+from app.tool.bash import get_session_pool
 
 
 class SWEAgent(ToolCallAgent):
@@ -16,12 +17,16 @@ class SWEAgent(ToolCallAgent):
     system_prompt: str = SYSTEM_PROMPT
     next_step_prompt: str = NEXT_STEP_TEMPLATE
 
-    available_tools: ToolCollection = ToolCollection(
-        Bash(), StrReplaceEditor(), Terminate()
+    available_tools: ToolCollection = Field(
+        default_factory=lambda: ToolCollection(
+            Bash(), StrReplaceEditor(), CodeSearch(), Terminate()
+        )
     )
     special_tool_names: List[str] = Field(default_factory=lambda: [Terminate().name])
 
     max_steps: int = 30
+    # think() fills the working directory into the next step prompt
+    predictable_requests: bool = False
 
     bash: Bash = Field(default_factory=Bash)
     working_dir: str = "."
@@ -35,3 +40,8 @@ class SWEAgent(ToolCallAgent):
         )
 
         return await super().think()
+
+    async def run(self, request: Optional[str] = None) -> str:
+        """Run the agent with a bash session of its own from the session pool"""
+        async with get_session_pool().session():
+            return await super().run(request)
@@ -1,5 +1,7 @@
+import asyncio
 import json
-from typing import Any, List, Literal
+from contextlib import nullcontext
+from typing import Any, Dict, List, Literal, Optional
 
 from pydantic import Field
 
@@ -30,6 +32,17 @@ class ToolCallAgent(ReActAgent):
 
     tool_calls: List[ToolCall] = Field(default_factory=list)
 
+    # Stream tool calls so the chosen tools can be warmed up before the completion ends
+    stream_tool_calls: bool = False
+    warmup_tasks: Dict[str, asyncio.Task] = Field(default_factory=dict)
+
+    # Whether the first request of a run follows from memory and prompts alone,
+    # so `speculate` can predict it; off for agents whose think() rewrites them
+    predictable_requests: bool = True
+
+    # Run independent tool calls of one step concurrently when greater than 1
+    max_concurrent_tools: int = 1
+
     max_steps: int = 30
 
     async def think(self) -> bool:
@@ -39,6 +52,7 @@ class ToolCallAgent(ReActAgent):
             self.messages += [user_msg]
 
         # Get response with tool options
+        self.warmup_tasks.clear()
         response = await self.llm.ask_tool(
             messages=self.messages,
             system_msgs=[Message.system_message(self.system_prompt)]
@@ -46,6 +60,8 @@ class ToolCallAgent(ReActAgent):
             else None,
             tools=self.available_tools.to_params(),
             tool_choice=self.tool_choices,
+            stream=self.stream_tool_calls,
+            on_partial=self._on_partial_response if self.stream_tool_calls else None,
         )
         self.tool_calls = response.tool_calls
 
@@ -98,6 +114,69 @@ class ToolCallAgent(ReActAgent):
             )
             return False
 
+    def speculate(self, request: str) -> Optional[str]:
+        """Start the first LLM call of `run(request)` ahead of time.
+
+        Returns the request key of the speculation, to be released with
+        `llm.discard_speculation` if the run never happens, or None if the agent
+        cannot run right now.
+        """
+        if (
+            not self.predictable_requests
+            or self.state != AgentState.IDLE
+            or self.current_step >= self.max_steps
+        ):
+            return None
+        messages = self.messages + [Message.user_message(request)]
+        if self.next_step_prompt:
+            messages.append(Message.user_message(self.next_step_prompt))
+        return self.llm.speculate_tool_call(
+            messages=messages,
+            system_msgs=[Message.system_message(self.system_prompt)]
+            if self.system_prompt
+            else None,
+            tools=self.available_tools.to_params(),
+            tool_choice=self.tool_choices,
+        )
+
+    def _on_partial_response(self, partial: Message) -> None:
+        """Warm up tools as soon as their names appear in the streamed response"""
+        for call in partial.tool_calls or []:
+            name = call.function.name
+            if name in self.warmup_tasks or name not in self.available_tools.tool_map:
+                continue
+            logger.info(f"🧰 {self.name} is preparing tool '{name}'")
+            task = asyncio.create_task(self.available_tools.get_tool(name).prepare())
+            task.add_done_callback(self._log_prepare_failure)
+            self.warmup_tasks[name] = task
+
+    async def _await_warmup(self, name: str) -> None:
+        """Let a running warm-up of the tool finish before the tool is executed"""
+        task = self.warmup_tasks.get(name)
+        if task is not None and not task.done():
+            await asyncio.wait([task])
+
+    async def _cancel_warmups(self) -> None:
+        """Cancel warm-ups still running for tools the step did not execute"""
+        pending = [task for task in self.warmup_tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self.warmup_tasks.clear()
+
+    @staticmethod
+    def _log_prepare_failure(task: asyncio.Task) -> None:
+        """Report warm-up failures; the tool will retry setup when executed"""
+        if not task.cancelled() and task.exception():
+            logger.warning(f"⚠️ Tool warm-up failed: {task.exception()}")
+
+    async def step(self) -> str:
+        """Think and act, then cancel leftover tool warm-ups"""
+        try:
+            return await super().step()
+        finally:
+            await self._cancel_warmups()
+
     async def act(self) -> str:
         """Execute tool calls and handle their results"""
         if not self.tool_calls:
@@ -107,9 +186,15 @@ class ToolCallAgent(ReActAgent):
             # Return last message content if no tool calls
             return self.messages[-1].content or "No content or commands to execute"
 
+        outputs = None
+        if self.max_concurrent_tools > 1 and len(self.tool_calls) > 1:
+            outputs = await self._execute_tools_concurrently(self.tool_calls)
+
         results = []
-        for command in self.tool_calls:
-            result = await self.execute_tool(command)
+        for i, command in enumerate(self.tool_calls):
+            result = (
+                outputs[i] if outputs is not None else await self.execute_tool(command)
+            )
             logger.info(
                 f"🎯 Tool '{command.function.name}' completed its mission! Result: {result}"
             )
@@ -123,6 +208,41 @@ class ToolCallAgent(ReActAgent):
 
         return "\n\n".join(results)
 
+    async def _execute_tools_concurrently(self, commands: List[ToolCall]) -> List[str]:
+        """Execute tool calls concurrently, returning results in call order.
+
+        Calls to tools that are not `parallel_safe` are serialised per tool, and
+        special tools (e.g. `terminate`) run only after all other calls finish.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_tools)
+        tool_locks: Dict[str, asyncio.Lock] = {}
+
+        async def run(command: ToolCall) -> str:
+            tool = self.available_tools.get_tool(command.function.name)
+            lock = (
+                tool_locks.setdefault(tool.name, asyncio.Lock())
+                if tool and not tool.parallel_safe
+                else nullcontext()
+            )
+            async with lock:
+                async with semaphore:
+                    return await self.execute_tool(command)
+
+        outputs: List[str] = [""] * len(commands)
+        regular = [
+            i
+            for i, command in enumerate(commands)
+            if not self._is_special_tool(command.function.name)
+        ]
+        for i, output in zip(
+            regular, await asyncio.gather(*(run(commands[i]) for i in regular))
+        ):
+            outputs[i] = output
+        for i, command in enumerate(commands):
+            if i not in regular:
+                outputs[i] = await self.execute_tool(command)
+        return outputs
+
     async def execute_tool(self, command: ToolCall) -> str:
         """Execute a single tool call with robust error handling"""
         if not command or not command.function or not command.function.name:
@@ -137,6 +257,7 @@ class ToolCallAgent(ReActAgent):
             args = json.loads(command.function.arguments or "{}")
 
             # Execute the tool
+            await self._await_warmup(name)
             logger.info(f"🔧 Activating tool: '{name}'...")
             result = await self.available_tools.execute(name=name, tool_input=args)
 
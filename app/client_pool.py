@@ -0,0 +1,117 @@
+import asyncio
+import importlib.util
+import threading
+import weakref
+from typing import Dict, Set, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from app.config import LLMSettings
+from app.logger import logger
+
+
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_ClientKey = Tuple[str, str, int, int, float, bool]
+
+
+class ClientPool:
+    """Hands out AsyncOpenAI clients backed by one tuned HTTP pool per event loop.
+
+    httpx connections are bound to the event loop that opened them, so a single
+    process-wide client breaks once a second loop (e.g. another `asyncio.run` in a
+    web worker thread) uses it. Clients are therefore kept per loop and per LLM
+    endpoint, reused by every request made on that loop, and closed with
+    `aclose_loop` when the loop is done.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._closing: Set[asyncio.Task] = set()
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[_ClientKey, AsyncOpenAI]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    @staticmethod
+    def _key(settings: LLMSettings) -> _ClientKey:
+        return (
+            settings.api_key,
+            settings.base_url,
+            settings.max_connections,
+            settings.max_keepalive_connections,
+            settings.keepalive_expiry,
+            settings.http2,
+        )
+
+    @staticmethod
+    def _create_client(settings: LLMSettings) -> AsyncOpenAI:
+        if settings.http2 and not _HTTP2_AVAILABLE:
+            logger.warning(
+                "HTTP/2 is enabled but the h2 package is not installed; using HTTP/1.1"
+            )
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=settings.max_connections,
+                max_keepalive_connections=settings.max_keepalive_connections,
+                keepalive_expiry=settings.keepalive_expiry,
+            ),
+            http2=settings.http2 and _HTTP2_AVAILABLE,
+        )
+        # Retries are handled by LLM so they go through the shared rate limiter
+        return AsyncOpenAI(
+            api_key=settings.api_key,
+            base_url=settings.base_url,
+            http_client=http_client,
+            max_retries=0,
+        )
+
+    def get(self, settings: LLMSettings) -> AsyncOpenAI:
+        """Return the client for settings on the running event loop."""
+        loop = asyncio.get_running_loop()
+        key = self._key(settings)
+        with self._lock:
+            self._discard_closed_loops()
+            clients = self._clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                client = clients[key] = self._create_client(settings)
+            return client
+
+    async def aclose_loop(self) -> None:
+        """Close every client opened on the running event loop."""
+        with self._lock:
+            clients = self._clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"Failed to close LLM client: {e}")
+
+    def _discard_closed_loops(self) -> None:
+        """Close the clients of loops that were closed without `aclose_loop`.
+
+        Their connections can no longer be shut down cleanly, so the clients are
+        closed on the running loop and the sockets are released when the stale
+        transports are collected.
+        """
+        for loop in [loop for loop in self._clients if loop.is_closed()]:
+            clients = self._clients.pop(loop)
+            logger.warning(
+                "Event loop closed without client_pool.aclose_loop(); "
+                f"closing {len(clients)} LLM client(s) late"
+            )
+            for client in clients.values():
+                task = asyncio.ensure_future(self._close_stale(client))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close_stale(client: AsyncOpenAI) -> None:
+        try:
+            await client.close()
+        except Exception as e:
+            logger.debug(f"LLM client from a closed event loop did not close: {e}")
+
+
+client_pool = ClientPool()
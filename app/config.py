@@ -1,7 +1,7 @@
 import threading
 import tomllib
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
 
 from pydantic import BaseModel, Field
 
@@ -21,10 +21,95 @@ class LLMSettings(BaseModel):
     api_key: str = Field(..., description="API key")
     max_tokens: int = Field(4096, description="Maximum number of tokens per request")
     temperature: float = Field(1.0, description="Sampling temperature")
+    max_input_tokens: Optional[int] = Field(
+        None, description="Token budget for the conversation history sent per request"
+    )
+    max_connections: int = Field(
+        100, description="Maximum number of concurrent HTTP connections per pool"
+    )
+    max_keepalive_connections: int = Field(
+        20, description="Maximum number of idle connections kept alive per pool"
+    )
+    keepalive_expiry: float = Field(
+        30.0, description="Seconds an idle connection is kept alive"
+    )
+    http2: bool = Field(
+        False, description="Use HTTP/2; requires the h2 package (httpx[http2])"
+    )
+    requests_per_minute: Optional[int] = Field(
+        None, description="Client-side limit on requests per minute to this model"
+    )
+    tokens_per_minute: Optional[int] = Field(
+        None, description="Client-side limit on tokens per minute to this model"
+    )
+    input_cost_per_1k: float = Field(
+        0.0, description="Price of 1000 prompt tokens, used for cost accounting"
+    )
+    output_cost_per_1k: float = Field(
+        0.0, description="Price of 1000 completion tokens, used for cost accounting"
+    )
+
+
+class CacheSettings(BaseModel):
+    enabled: bool = Field(False, description="Whether to cache LLM responses")
+    only_deterministic: bool = Field(
+        True, description="Only cache requests sent with temperature 0"
+    )
+    max_memory_entries: int = Field(
+        256, description="Maximum number of responses kept in memory"
+    )
+    ttl: Optional[float] = Field(
+        None, description="Default time-to-live of an entry in seconds"
+    )
+    db_path: Optional[str] = Field(
+        None,
+        description="SQLite file for the on-disk tier, relative to the project root",
+    )
+    max_disk_bytes: int = Field(
+        256 * 1024 * 1024, description="Maximum size of the on-disk tier in bytes"
+    )
+
+
+class ServerSettings(BaseModel):
+    max_concurrent_runs: int = Field(
+        4, description="Maximum number of agent runs executing at once"
+    )
+    max_queue_size: int = Field(
+        32, description="Maximum number of runs waiting for a slot"
+    )
+    request_ttl: float = Field(
+        3600.0, description="Seconds a finished request's logs and result are kept"
+    )
+    max_request_log_chars: int = Field(
+        1024 * 1024, description="Maximum log characters kept per request"
+    )
+    max_store_chars: int = Field(
+        64 * 1024 * 1024,
+        description="Maximum characters kept by the request store in total",
+    )
+    store_db_path: Optional[str] = Field(
+        None,
+        description="SQLite file that persists finished requests, relative to the project root",
+    )
+
+
+class TracingSettings(BaseModel):
+    enabled: bool = Field(False, description="Whether to record tracing spans")
+    jsonl_path: Optional[str] = Field(
+        "logs/traces.jsonl",
+        description="File that receives finished spans as JSON lines, relative to the project root",
+    )
+    opentelemetry: bool = Field(
+        False, description="Also send spans to the global OpenTelemetry tracer"
+    )
+    service_name: str = Field("openmanus", description="OpenTelemetry tracer name")
 
 
 class AppConfig(BaseModel):
     llm: Dict[str, LLMSettings]
+    cache: CacheSettings = Field(default_factory=CacheSettings)
+    server: ServerSettings = Field(default_factory=ServerSettings)
+    tracing: TracingSettings = Field(default_factory=TracingSettings)
 
 
 class Config:
@@ -76,6 +161,15 @@ class Config:
             "api_key": base_llm.get("api_key"),
             "max_tokens": base_llm.get("max_tokens", 4096),
             "temperature": base_llm.get("temperature", 1.0),
+            "max_input_tokens": base_llm.get("max_input_tokens"),
+            "max_connections": base_llm.get("max_connections", 100),
+            "max_keepalive_connections": base_llm.get("max_keepalive_connections", 20),
+            "keepalive_expiry": base_llm.get("keepalive_expiry", 30.0),
+            "http2": base_llm.get("http2", False),
+            "requests_per_minute": base_llm.get("requests_per_minute"),
+            "tokens_per_minute": base_llm.get("tokens_per_minute"),
+            "input_cost_per_1k": base_llm.get("input_cost_per_1k", 0.0),
+            "output_cost_per_1k": base_llm.get("output_cost_per_1k", 0.0),
         }
 
         config_dict = {
@@ -85,7 +179,10 @@ class Config:
                     name: {**default_settings, **override_config}
                     for name, override_config in llm_overrides.items()
                 },
-            }
+            },
+            "cache": raw_config.get("cache", {}),
+            "server": raw_config.get("server", {}),
+            "tracing": raw_config.get("tracing", {}),
         }
 
         self._config = AppConfig(**config_dict)
@@ -94,5 +191,17 @@ class Config:
     def llm(self) -> Dict[str, LLMSettings]:
         return self._config.llm
 
+    @property
+    def cache(self) -> CacheSettings:
+        return self._config.cache
+
+    @property
+    def server(self) -> ServerSettings:
+        return self._config.server
+
+    @property
+    def tracing(self) -> TracingSettings:
+        return self._config.tracing
+
 
 config = Config()
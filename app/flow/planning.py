@@ -1,10 +1,13 @@
+import asyncio
 import json
+import re
 import time
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 from pydantic import Field
 
 from app.agent.base import BaseAgent
+from app.agent.toolcall import ToolCallAgent
 from app.flow.base import BaseFlow
 from app.llm import LLM
 from app.logger import logger
@@ -12,6 +15,10 @@ from app.schema import AgentState, Message
 from app.tool import PlanningTool
 
 
+# Step type tag in a step's text, e.g. [SEARCH] or [CODE]
+_STEP_TYPE_PATTERN = re.compile(r"\[([A-Z_]+)\]")
+
+
 class PlanningFlow(BaseFlow):
     """A flow that manages planning and execution of tasks using agents."""
 
@@ -20,6 +27,10 @@ class PlanningFlow(BaseFlow):
     executor_keys: List[str] = Field(default_factory=list)
     active_plan_id: str = Field(default_factory=lambda: f"plan_{int(time.time())}")
     current_step_index: Optional[int] = None
+    # Start the next step's first LLM call while the current step is running
+    speculative_prefetch: bool = False
+    # Run up to this many steps whose dependencies are completed at the same time
+    max_parallel_steps: int = 1
 
     def __init__(
         self, agents: Union[BaseAgent, List[BaseAgent], Dict[str, BaseAgent]], **data
@@ -78,31 +89,207 @@ class PlanningFlow(BaseFlow):
                     )
                     return f"Failed to create plan for: {input_text}"
 
-            result = ""
-            while True:
-                # Get current step to execute
-                self.current_step_index, step_info = await self._get_current_step_info()
+            if self.speculative_prefetch and not self._can_speculate():
+                logger.warning(
+                    "speculative_prefetch has no effect: steps are only prefetched for "
+                    "an idle tool-call agent with predictable requests while another "
+                    "agent runs the current step"
+                )
 
-                # Exit if no more steps or plan completed
-                if self.current_step_index is None:
-                    result += await self._finalize_plan()
-                    break
+            if self.max_parallel_steps > 1:
+                return await self._execute_parallel()
 
-                # Execute current step with appropriate agent
-                step_type = step_info.get("type") if step_info else None
-                executor = self.get_executor(step_type)
-                step_result = await self._execute_step(executor, step_info)
-                result += step_result + "\n"
-
-                # Check if agent wants to terminate
-                if hasattr(executor, "state") and executor.state == AgentState.FINISHED:
-                    break
+            result = ""
+            speculation = None
+            try:
+                while True:
+                    # Get current step to execute
+                    (
+                        self.current_step_index,
+                        step_info,
+                    ) = await self._get_current_step_info()
+
+                    # Drop the prefetched call if a different step came up
+                    if speculation and speculation[0] != self.current_step_index:
+                        self._discard_speculation(speculation)
+                        speculation = None
+
+                    # Exit if no more steps or plan completed
+                    if self.current_step_index is None:
+                        result += await self._finalize_plan()
+                        break
+
+                    # Execute current step with appropriate agent
+                    step_type = step_info.get("type") if step_info else None
+                    executor = self.get_executor(step_type)
+                    next_speculation = (
+                        self._speculate_next_step(executor)
+                        if self.speculative_prefetch
+                        else None
+                    )
+                    step_result = await self._execute_step(executor, step_info)
+                    result += step_result + "\n"
+
+                    # The executor has claimed the prefetched call if it matched
+                    self._discard_speculation(speculation)
+                    speculation = next_speculation
+
+                    # Check if agent wants to terminate
+                    if (
+                        hasattr(executor, "state")
+                        and executor.state == AgentState.FINISHED
+                    ):
+                        break
+            finally:
+                self._discard_speculation(speculation)
 
             return result
         except Exception as e:
             logger.error(f"Error in PlanningFlow: {str(e)}")
             return f"Execution failed: {str(e)}"
 
+    async def _execute_parallel(self) -> str:
+        """
+        Run the plan as a dependency graph, executing every step whose
+        dependencies are completed on its own idle executor, at most
+        `max_parallel_steps` at a time. Each step is attempted once; steps that
+        depend on a failed step are left unfinished.
+        """
+        result = ""
+        attempted = set()
+        running: Dict[asyncio.Task, Tuple[int, BaseAgent]] = {}
+        try:
+            while True:
+                busy = {id(executor) for _, executor in running.values()}
+                for step_index, step_info in self._ready_steps(attempted):
+                    if len(running) >= self.max_parallel_steps:
+                        break
+                    executor = self._idle_executor(step_info.get("type"), busy)
+                    if executor is None:
+                        continue
+
+                    attempted.add(step_index)
+                    busy.add(id(executor))
+                    await self._mark_step_in_progress(step_index)
+                    logger.info(f"Starting step {step_index} with {executor.name}")
+                    task = asyncio.create_task(
+                        self._execute_step(executor, step_info, step_index)
+                    )
+                    running[task] = (step_index, executor)
+
+                if not running:
+                    break
+
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    running.pop(task)
+                    result += task.result() + "\n"
+        finally:
+            pending = list(running)
+            for task in pending:
+                task.cancel()
+            # Let the cancelled steps finish cleaning up before the plan is finalized
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        return result + await self._finalize_plan()
+
+    def _ready_steps(self, attempted: set) -> List[Tuple[int, dict]]:
+        """List the steps not attempted yet whose dependencies are all completed."""
+        plan_data = self.planning_tool.plans.get(self.active_plan_id)
+        if not plan_data:
+            return []
+
+        steps = plan_data.get("steps", [])
+        step_statuses = plan_data.get("step_statuses", [])
+        ready = []
+        for i in self.planning_tool.pending_steps(self.active_plan_id):
+            if i in attempted:
+                continue
+            dependencies = PlanningTool.step_dependencies(plan_data, i)
+            if all(
+                j < len(step_statuses) and step_statuses[j] == "completed"
+                for j in dependencies
+            ):
+                ready.append((i, self._parse_step(steps[i])))
+        return ready
+
+    def _idle_executor(
+        self, step_type: Optional[str], busy: set
+    ) -> Optional[BaseAgent]:
+        """
+        Pick an executor that is not running a step (busy holds their ids).
+        Steps typed for a specific agent wait for that agent.
+        """
+        if step_type and step_type in self.agents:
+            candidates = [self.agents[step_type]]
+        else:
+            candidates = [
+                self.agents[key] for key in self.executor_keys if key in self.agents
+            ] or [self.primary_agent]
+
+        for executor in candidates:
+            if id(executor) not in busy:
+                return executor
+        return None
+
+    def _speculate_next_step(
+        self, executor: BaseAgent
+    ) -> Optional[Tuple[int, LLM, str]]:
+        """
+        Start the first LLM call of the step expected to follow the current one.
+
+        The prediction assumes the current step completes without changing the
+        plan. The call is only made for steps handled by another idle tool-call
+        agent, whose memory the current step cannot change; if the real request
+        differs in any way it is not used. Returns (step index, llm, request key).
+        """
+        plan_data = self.planning_tool.plans.get(self.active_plan_id)
+        if not plan_data or self.current_step_index is None:
+            return None
+
+        next_index = self.planning_tool.next_step(
+            self.active_plan_id, skip=[self.current_step_index]
+        )
+        if next_index is None:
+            return None
+
+        step_info = self._parse_step(plan_data["steps"][next_index])
+        next_executor = self.get_executor(step_info.get("type"))
+        if next_executor is executor or not isinstance(next_executor, ToolCallAgent):
+            return None
+
+        plan_status = self.planning_tool.format_plan(
+            self.active_plan_id,
+            status_overrides={
+                self.current_step_index: "completed",
+                next_index: "in_progress",
+            },
+        )
+        key = next_executor.speculate(
+            self._step_prompt(plan_status, next_index, step_info["text"])
+        )
+        if key is None:
+            return None
+        logger.info(f"Prefetching first LLM call of step {next_index}")
+        return next_index, next_executor.llm, key
+
+    def _can_speculate(self) -> bool:
+        """Whether any step could be prefetched, which takes a second agent."""
+        agents = {id(agent): agent for agent in self.agents.values()}
+        return len(agents) > 1 and any(
+            isinstance(agent, ToolCallAgent) and agent.predictable_requests
+            for agent in agents.values()
+        )
+
+    @staticmethod
+    def _discard_speculation(speculation: Optional[Tuple[int, LLM, str]]) -> None:
+        """Release a prefetched step call that was not used."""
+        if speculation:
+            _, llm, key = speculation
+            llm.discard_speculation(key)
+
     async def _create_initial_plan(self, request: str) -> None:
         """Create an initial plan based on the request using the flow's LLM and PlanningTool."""
         logger.info(f"Creating initial plan with ID: {self.active_plan_id}")
@@ -173,89 +360,103 @@ class PlanningFlow(BaseFlow):
             return None, None
 
         try:
-            # Direct access to plan data from planning tool storage
+            # Find first non-completed step using the plan's pending-step index
+            i = self.planning_tool.next_step(self.active_plan_id)
+            if i is None:
+                return None, None  # No active step found
+
+            # Extract step type/category if available
             plan_data = self.planning_tool.plans[self.active_plan_id]
-            steps = plan_data.get("steps", [])
-            step_statuses = plan_data.get("step_statuses", [])
+            step_info = self._parse_step(plan_data["steps"][i])
+
+            # Mark current step as in_progress
+            await self._mark_step_in_progress(i)
 
-            # Find first non-completed step
-            for i, step in enumerate(steps):
-                if i >= len(step_statuses):
-                    status = "not_started"
-                else:
-                    status = step_statuses[i]
-
-                if status in ["not_started", "in_progress"]:
-                    # Extract step type/category if available
-                    step_info = {"text": step}
-
-                    # Try to extract step type from the text (e.g., [SEARCH] or [CODE])
-                    import re
-
-                    type_match = re.search(r"\[([A-Z_]+)\]", step)
-                    if type_match:
-                        step_info["type"] = type_match.group(1).lower()
-
-                    # Mark current step as in_progress
-                    try:
-                        await self.planning_tool.execute(
-                            command="mark_step",
-                            plan_id=self.active_plan_id,
-                            step_index=i,
-                            step_status="in_progress",
-                        )
-                    except Exception as e:
-                        logger.warning(f"Error marking step as in_progress: {e}")
-                        # Update step status directly if needed
-                        if i < len(step_statuses):
-                            step_statuses[i] = "in_progress"
-                        else:
-                            while len(step_statuses) < i:
-                                step_statuses.append("not_started")
-                            step_statuses.append("in_progress")
-
-                        plan_data["step_statuses"] = step_statuses
-
-                    return i, step_info
-
-            return None, None  # No active step found
+            return i, step_info
 
         except Exception as e:
             logger.warning(f"Error finding current step index: {e}")
             return None, None
 
-    async def _execute_step(self, executor: BaseAgent, step_info: dict) -> str:
-        """Execute the current step with the specified agent using agent.run()."""
-        # Prepare context for the agent with current plan status
-        plan_status = await self._get_plan_text()
-        step_text = step_info.get("text", f"Step {self.current_step_index}")
-
-        # Create a prompt for the agent to execute the current step
-        step_prompt = f"""
+    async def _mark_step_in_progress(self, step_index: int) -> None:
+        """Mark a step as in_progress."""
+        try:
+            await self.planning_tool.execute(
+                command="mark_step",
+                plan_id=self.active_plan_id,
+                step_index=step_index,
+                step_status="in_progress",
+            )
+        except Exception as e:
+            logger.warning(f"Error marking step as in_progress: {e}")
+            # Update step status directly if needed
+            plan_data = self.planning_tool.plans[self.active_plan_id]
+            step_statuses = plan_data.get("step_statuses", [])
+            if step_index < len(step_statuses):
+                step_statuses[step_index] = "in_progress"
+            else:
+                while len(step_statuses) < step_index:
+                    step_statuses.append("not_started")
+                step_statuses.append("in_progress")
+
+            plan_data["step_statuses"] = step_statuses
+            self.planning_tool.refresh_plan(self.active_plan_id)
+
+    @staticmethod
+    def _parse_step(step: str) -> dict:
+        """Build the step info for a step, including its type if tagged."""
+        step_info = {"text": step}
+
+        # Try to extract step type from the text (e.g., [SEARCH] or [CODE])
+        type_match = _STEP_TYPE_PATTERN.search(step)
+        if type_match:
+            step_info["type"] = type_match.group(1).lower()
+        return step_info
+
+    @staticmethod
+    def _step_prompt(plan_status: str, step_index: int, step_text: str) -> str:
+        """Create the prompt asking an agent to execute a step."""
+        return f"""
         CURRENT PLAN STATUS:
         {plan_status}
 
         YOUR CURRENT TASK:
-        You are now working on step {self.current_step_index}: "{step_text}"
+        You are now working on step {step_index}: "{step_text}"
 
         Please execute this step using the appropriate tools. When you're done, provide a summary of what you accomplished.
         """
 
+    async def _execute_step(
+        self, executor: BaseAgent, step_info: dict, step_index: Optional[int] = None
+    ) -> str:
+        """Execute the current step (or step_index) with the specified agent using agent.run()."""
+        if step_index is None:
+            step_index = self.current_step_index
+
+        # Prepare context for the agent with current plan status
+        plan_status = await self._get_plan_text()
+        step_text = step_info.get("text", f"Step {step_index}")
+
+        # Create a prompt for the agent to execute the current step
+        step_prompt = self._step_prompt(plan_status, step_index, step_text)
+
         # Use agent.run() to execute the step
         try:
             step_result = await executor.run(step_prompt)
 
             # Mark the step as completed after successful execution
-            await self._mark_step_completed()
+            await self._mark_step_completed(step_index)
 
             return step_result
         except Exception as e:
-            logger.error(f"Error executing step {self.current_step_index}: {e}")
-            return f"Error executing step {self.current_step_index}: {str(e)}"
-
-    async def _mark_step_completed(self) -> None:
-        """Mark the current step as completed."""
-        if self.current_step_index is None:
+            logger.error(f"Error executing step {step_index}: {e}")
+            return f"Error executing step {step_index}: {str(e)}"
+
+    async def _mark_step_completed(self, step_index: Optional[int] = None) -> None:
+        """Mark the current step (or step_index) as completed."""
+        if step_index is None:
+            step_index = self.current_step_index
+        if step_index is None:
             return
 
         try:
@@ -263,11 +464,11 @@ class PlanningFlow(BaseFlow):
             await self.planning_tool.execute(
                 command="mark_step",
                 plan_id=self.active_plan_id,
-                step_index=self.current_step_index,
+                step_index=step_index,
                 step_status="completed",
             )
             logger.info(
-                f"Marked step {self.current_step_index} as completed in plan {self.active_plan_id}"
+                f"Marked step {step_index} as completed in plan {self.active_plan_id}"
             )
         except Exception as e:
             logger.warning(f"Failed to update plan status: {e}")
@@ -277,12 +478,13 @@ class PlanningFlow(BaseFlow):
                 step_statuses = plan_data.get("step_statuses", [])
 
                 # Ensure the step_statuses list is long enough
-                while len(step_statuses) <= self.current_step_index:
+                while len(step_statuses) <= step_index:
                     step_statuses.append("not_started")
 
                 # Update the status
-                step_statuses[self.current_step_index] = "completed"
+                step_statuses[step_index] = "completed"
                 plan_data["step_statuses"] = step_statuses
+                self.planning_tool.refresh_plan(self.active_plan_id)
 
     async def _get_plan_text(self) -> str:
         """Get the current plan as formatted text."""
@@ -301,61 +503,8 @@ class PlanningFlow(BaseFlow):
             if self.active_plan_id not in self.planning_tool.plans:
                 return f"Error: Plan with ID {self.active_plan_id} not found"
 
-            plan_data = self.planning_tool.plans[self.active_plan_id]
-            title = plan_data.get("title", "Untitled Plan")
-            steps = plan_data.get("steps", [])
-            step_statuses = plan_data.get("step_statuses", [])
-            step_notes = plan_data.get("step_notes", [])
-
-            # Ensure step_statuses and step_notes match the number of steps
-            while len(step_statuses) < len(steps):
-                step_statuses.append("not_started")
-            while len(step_notes) < len(steps):
-                step_notes.append("")
-
-            # Count steps by status
-            status_counts = {
-                "completed": 0,
-                "in_progress": 0,
-                "blocked": 0,
-                "not_started": 0,
-            }
-
-            for status in step_statuses:
-                if status in status_counts:
-                    status_counts[status] += 1
-
-            completed = status_counts["completed"]
-            total = len(steps)
-            progress = (completed / total) * 100 if total > 0 else 0
-
-            plan_text = f"Plan: {title} (ID: {self.active_plan_id})\n"
-            plan_text += "=" * len(plan_text) + "\n\n"
-
-            plan_text += (
-                f"Progress: {completed}/{total} steps completed ({progress:.1f}%)\n"
-            )
-            plan_text += f"Status: {status_counts['completed']} completed, {status_counts['in_progress']} in progress, "
-            plan_text += f"{status_counts['blocked']} blocked, {status_counts['not_started']} not started\n\n"
-            plan_text += "Steps:\n"
-
-            for i, (step, status, notes) in enumerate(
-                zip(steps, step_statuses, step_notes)
-            ):
-                if status == "completed":
-                    status_mark = "[✓]"
-                elif status == "in_progress":
-                    status_mark = "[→]"
-                elif status == "blocked":
-                    status_mark = "[!]"
-                else:  # not_started
-                    status_mark = "[ ]"
-
-                plan_text += f"{i}. {status_mark} {step}\n"
-                if notes:
-                    plan_text += f"   Notes: {notes}\n"
-
-            return plan_text
+            # The index keeps counts and rendered step lines up to date
+            return self.planning_tool.format_plan(self.active_plan_id)
         except Exception as e:
             logger.error(f"Error generating plan text from storage: {e}")
             return f"Error: Unable to retrieve plan with ID {self.active_plan_id}"
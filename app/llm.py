@@ -1,4 +1,17 @@
-from typing import Dict, List, Literal, Optional, Union
+import asyncio
+import json
+from contextvars import ContextVar
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Union,
+)
 
 from openai import (
     APIError,
@@ -7,11 +20,20 @@ from openai import (
     OpenAIError,
     RateLimitError,
 )
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from tenacity import retry, retry_if_exception, stop_after_attempt
 
+from app.cache import ResponseCache, get_response_cache
+from app.client_pool import client_pool
 from app.config import LLMSettings, config
 from app.logger import logger  # Assuming a logger is set up in your app
-from app.schema import Message
+from app.rate_limit import RateLimiter, get_rate_limiter, is_transient, wait_for_retry
+from app.schema import Function, Message, ToolCall, count_tokens
+from app.tracing import count_retry, current_span, traced
+from app.usage import TokenUsage, current_usage, track_usage
+
+
+# Set inside speculative requests so they do not claim themselves
+_speculating: ContextVar[bool] = ContextVar("speculating", default=False)
 
 
 class LLM:
@@ -29,15 +51,160 @@ class LLM:
     def __init__(
         self, config_name: str = "default", llm_config: Optional[LLMSettings] = None
     ):
-        if not hasattr(self, "client"):  # Only initialize if not already initialized
+        if not hasattr(self, "settings"):  # Only initialize if not already initialized
             llm_config = llm_config or config.llm
             llm_config = llm_config.get(config_name, llm_config["default"])
+            self.settings = llm_config
             self.model = llm_config.model
             self.max_tokens = llm_config.max_tokens
             self.temperature = llm_config.temperature
-            self.client = AsyncOpenAI(
-                api_key=llm_config.api_key, base_url=llm_config.base_url
+            self.max_input_tokens = llm_config.max_input_tokens
+            self.cache: Optional[ResponseCache] = get_response_cache()
+            self.rate_limiter: RateLimiter = get_rate_limiter(llm_config)
+            # Cumulative usage of every request made through this instance
+            self.usage = TokenUsage()
+            # Tool requests started ahead of time, keyed by their request key
+            self._speculative: Dict[str, asyncio.Task] = {}
+            self.speculation_hits = 0
+            self.speculation_misses = 0
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """The pooled client bound to the running event loop."""
+        return client_pool.get(self.settings)
+
+    def _request_key(self, temperature: float, **request) -> str:
+        """Return a key identifying the completion a request would produce."""
+        return ResponseCache.make_key(
+            model=self.model,
+            max_tokens=self.max_tokens,
+            temperature=temperature,
+            **request,
+        )
+
+    def _cache_key(self, temperature: float, **request) -> Optional[str]:
+        """Return the cache key for a request, or None if it must not be cached."""
+        if self.cache is None:
+            return None
+        if config.cache.only_deterministic and temperature != 0:
+            return None
+        return self._request_key(temperature, **request)
+
+    def speculate_tool_call(
+        self,
+        messages: List[Union[dict, Message]],
+        system_msgs: Optional[List[Union[dict, Message]]] = None,
+        tools: Optional[List[dict]] = None,
+        tool_choice: Literal["none", "auto", "required"] = "auto",
+        temperature: Optional[float] = None,
+        **kwargs,
+    ) -> str:
+        """
+        Start an `ask_tool` request before anyone has asked for it.
+
+        A later `ask_tool` call for the same request takes over the pending
+        response instead of sending its own. Speculations that are not claimed
+        must be released with `discard_speculation`.
+
+        Returns:
+            str: The request key identifying the speculation
+        """
+        if system_msgs:
+            messages = self.format_messages(system_msgs) + self.format_messages(
+                messages
+            )
+        else:
+            messages = self.format_messages(messages)
+        key = self._request_key(
+            temperature or self.temperature,
+            messages=messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            **kwargs,
+        )
+        if key not in self._speculative:
+            task = asyncio.create_task(
+                self._speculative_ask_tool(
+                    messages=messages,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                    temperature=temperature,
+                    **kwargs,
+                )
+            )
+            task.add_done_callback(self._log_speculation_failure)
+            self._speculative[key] = task
+        return key
+
+    def discard_speculation(self, key: str) -> None:
+        """Cancel a speculative request unless it has already been claimed."""
+        task = self._speculative.pop(key, None)
+        if task is None:
+            return
+        self.speculation_misses += 1
+        if not task.done():
+            task.cancel()
+            logger.info(
+                f"Cancelled unused speculative LLM request ({self._speculation_stats()})"
+            )
+            return
+        if task.cancelled() or task.exception():
+            return
+        # The completion was paid for, so charge it to the run that discarded it
+        _, usage = task.result()
+        ledger = current_usage()
+        if ledger is not None:
+            ledger.add(usage.prompt_tokens, usage.completion_tokens, usage.cost)
+        logger.info(
+            f"Discarded unused speculative LLM request, {usage.total_tokens} tokens "
+            f"wasted ({self._speculation_stats()})"
+        )
+
+    def _speculation_stats(self) -> str:
+        return (
+            f"{self.speculation_hits} speculative requests used, "
+            f"{self.speculation_misses} wasted"
+        )
+
+    async def _speculative_ask_tool(self, **request) -> Tuple[Any, TokenUsage]:
+        """Run a speculative `ask_tool` request, keeping its usage apart until a
+        run claims the response."""
+        _speculating.set(True)
+        with track_usage(nested=False) as usage:
+            return await self.ask_tool(**request), usage
+
+    @staticmethod
+    def _log_speculation_failure(task: asyncio.Task) -> None:
+        """Retrieve the error of a failed speculation; its claimant will retry."""
+        if not task.cancelled() and task.exception():
+            logger.debug(f"Speculative LLM request failed: {task.exception()}")
+
+    async def _claim_speculation(self, key: str):
+        """Return the response of a matching speculative request, if it succeeded."""
+        task = self._speculative.pop(key, None)
+        if task is None:
+            return None
+        try:
+            message, usage = await task
+        except Exception:
+            self.speculation_misses += 1
+            return None
+        self.speculation_hits += 1
+        logger.info(
+            f"Serving LLM tool response from speculative request ({self._speculation_stats()})"
+        )
+        ledger = current_usage()
+        if ledger is not None:
+            ledger.add(
+                usage.prompt_tokens,
+                usage.completion_tokens,
+                usage.cost,
+                cached=bool(usage.cached_requests),
             )
+        span = current_span()
+        if span is not None:
+            span.set_attribute("speculative_hit", True)
+        return message
 
     @staticmethod
     def format_messages(messages: List[Union[dict, Message]]) -> List[dict]:
@@ -65,31 +232,92 @@ class LLM:
         formatted_messages = []
 
         for message in messages:
-            if isinstance(message, dict):
+            if isinstance(message, Message):
+                # Message objects are validated on creation and cache their dict form
+                formatted = message.to_dict()
+            elif isinstance(message, dict):
                 # If message is already a dict, ensure it has required fields
                 if "role" not in message:
                     raise ValueError("Message dict must contain 'role' field")
-                formatted_messages.append(message)
-            elif isinstance(message, Message):
-                # If message is a Message object, convert it to dict
-                formatted_messages.append(message.to_dict())
+                if message["role"] not in ["system", "user", "assistant", "tool"]:
+                    raise ValueError(f"Invalid role: {message['role']}")
+                formatted = message
             else:
                 raise TypeError(f"Unsupported message type: {type(message)}")
 
-        # Validate all messages have required fields
-        for msg in formatted_messages:
-            if msg["role"] not in ["system", "user", "assistant", "tool"]:
-                raise ValueError(f"Invalid role: {msg['role']}")
-            if "content" not in msg and "tool_calls" not in msg:
+            if "content" not in formatted and "tool_calls" not in formatted:
                 raise ValueError(
                     "Message must contain either 'content' or 'tool_calls'"
                 )
+            formatted_messages.append(formatted)
 
         return formatted_messages
 
+    async def _create_completion(self, **params):
+        """Send a chat completion request through the shared rate limiter."""
+        estimated_tokens = 0
+        if self.rate_limiter.meters_tokens:
+            estimated_tokens = count_tokens(
+                json.dumps(params["messages"], ensure_ascii=False)
+            )
+        await self.rate_limiter.acquire(estimated_tokens)
+        try:
+            raw = await self.client.chat.completions.with_raw_response.create(**params)
+        except RateLimitError as e:
+            self.rate_limiter.observe_rate_limit(e)
+            raise
+        self.rate_limiter.observe_headers(raw.headers)
+        response = raw.parse()
+        usage = getattr(response, "usage", None)
+        if estimated_tokens and usage is not None:
+            self.rate_limiter.settle(estimated_tokens, usage.total_tokens)
+        return response
+
+    @staticmethod
+    def _response_tokens(
+        usage, messages: List[dict], completion: str = ""
+    ) -> Tuple[int, int, bool]:
+        """Return prompt and completion tokens of a response and whether they were
+        estimated because the API reported no usage (e.g. when streaming)."""
+        if usage is not None:
+            return usage.prompt_tokens, usage.completion_tokens, False
+        prompt_tokens = count_tokens(json.dumps(messages, ensure_ascii=False))
+        return prompt_tokens, count_tokens(completion), True
+
+    def _record_response(
+        self,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached: bool = False,
+        **attributes,
+    ) -> None:
+        """Account a response's usage and attach its details to the active span."""
+        cost = (
+            prompt_tokens * self.settings.input_cost_per_1k
+            + completion_tokens * self.settings.output_cost_per_1k
+        ) / 1000
+        for ledger in (self.usage, current_usage()):
+            if ledger is not None:
+                ledger.add(prompt_tokens, completion_tokens, cost, cached=cached)
+
+        span = current_span()
+        if span is not None:
+            span.set_attributes(
+                model=self.model,
+                cache_hit=cached,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                cost=cost,
+                **attributes,
+            )
+
+    @traced("llm.ask", kind="llm")
     @retry(
-        wait=wait_random_exponential(min=1, max=60),
+        wait=wait_for_retry,
         stop=stop_after_attempt(6),
+        retry=retry_if_exception(is_transient),
+        before_sleep=count_retry,
+        reraise=True,
     )
     async def ask(
         self,
@@ -123,9 +351,19 @@ class LLM:
             else:
                 messages = self.format_messages(messages)
 
+            cache_key = self._cache_key(
+                temperature=temperature or self.temperature, messages=messages
+            )
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    logger.debug("Serving LLM response from cache")
+                    self._record_response(cached=True)
+                    return cached
+
             if not stream:
                 # Non-streaming request
-                response = await self.client.chat.completions.create(
+                response = await self._create_completion(
                     model=self.model,
                     messages=messages,
                     max_tokens=self.max_tokens,
@@ -134,10 +372,18 @@ class LLM:
                 )
                 if not response.choices or not response.choices[0].message.content:
                     raise ValueError("Empty or invalid response from LLM")
+                prompt_tokens, completion_tokens, estimated = self._response_tokens(
+                    response.usage, messages, response.choices[0].message.content
+                )
+                self._record_response(
+                    prompt_tokens, completion_tokens, stream=False, estimated=estimated
+                )
+                if cache_key:
+                    self.cache.set(cache_key, response.choices[0].message.content)
                 return response.choices[0].message.content
 
             # Streaming request
-            response = await self.client.chat.completions.create(
+            response = await self._create_completion(
                 model=self.model,
                 messages=messages,
                 max_tokens=self.max_tokens,
@@ -146,7 +392,10 @@ class LLM:
             )
 
             collected_messages = []
+            span = current_span()
             async for chunk in response:
+                if span is not None and not collected_messages:
+                    span.set_attribute("time_to_first_token", span.elapsed())
                 chunk_message = chunk.choices[0].delta.content or ""
                 collected_messages.append(chunk_message)
                 print(chunk_message, end="", flush=True)
@@ -155,6 +404,14 @@ class LLM:
             full_response = "".join(collected_messages).strip()
             if not full_response:
                 raise ValueError("Empty response from streaming LLM")
+            prompt_tokens, completion_tokens, estimated = self._response_tokens(
+                None, messages, full_response
+            )
+            self._record_response(
+                prompt_tokens, completion_tokens, stream=True, estimated=estimated
+            )
+            if cache_key:
+                self.cache.set(cache_key, full_response)
             return full_response
 
         except ValueError as ve:
@@ -167,9 +424,13 @@ class LLM:
             logger.error(f"Unexpected error in ask: {e}")
             raise
 
+    @traced("llm.ask_tool", kind="llm")
     @retry(
-        wait=wait_random_exponential(min=1, max=60),
+        wait=wait_for_retry,
         stop=stop_after_attempt(6),
+        retry=retry_if_exception(is_transient),
+        before_sleep=count_retry,
+        reraise=True,
     )
     async def ask_tool(
         self,
@@ -179,6 +440,8 @@ class LLM:
         tools: Optional[List[dict]] = None,
         tool_choice: Literal["none", "auto", "required"] = "auto",
         temperature: Optional[float] = None,
+        stream: bool = False,
+        on_partial: Optional[Callable[[Message], None]] = None,
         **kwargs,
     ):
         """
@@ -191,10 +454,14 @@ class LLM:
             tools: List of tools to use
             tool_choice: Tool choice strategy
             temperature: Sampling temperature for the response
+            stream (bool): Whether to stream the response and assemble tool calls
+                from the deltas
+            on_partial: Optional callback invoked with each partial message while
+                streaming
             **kwargs: Additional completion arguments
 
         Returns:
-            ChatCompletionMessage: The model's response
+            ChatCompletionMessage: The model's response (a `Message` when streaming)
 
         Raises:
             ValueError: If tools, tool_choice, or messages are invalid
@@ -219,24 +486,94 @@ class LLM:
                     if not isinstance(tool, dict) or "type" not in tool:
                         raise ValueError("Each tool must be a dict with 'type' field")
 
-            # Set up the completion request
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
+            if self._speculative and not _speculating.get():
+                message = await self._claim_speculation(
+                    self._request_key(
+                        temperature or self.temperature,
+                        messages=messages,
+                        tools=tools,
+                        tool_choice=tool_choice,
+                        **kwargs,
+                    )
+                )
+                if message is not None:
+                    return message
+
+            cache_key = self._cache_key(
                 temperature=temperature or self.temperature,
-                max_tokens=self.max_tokens,
+                messages=messages,
                 tools=tools,
                 tool_choice=tool_choice,
-                timeout=timeout,
                 **kwargs,
             )
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    logger.debug("Serving LLM tool response from cache")
+                    self._record_response(cached=True)
+                    return Message(**cached)
+
+            if stream:
+                response = None
+                span = current_span()
+                async for response in self.ask_tool_stream(
+                    messages=messages,
+                    timeout=timeout,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                    temperature=temperature,
+                    **kwargs,
+                ):
+                    if (
+                        span is not None
+                        and "time_to_first_token" not in span.attributes
+                    ):
+                        span.set_attribute("time_to_first_token", span.elapsed())
+                    if on_partial:
+                        on_partial(response)
+                message = response
+                usage = None
+            else:
+                # Set up the completion request
+                response = await self._create_completion(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature or self.temperature,
+                    max_tokens=self.max_tokens,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                    timeout=timeout,
+                    **kwargs,
+                )
 
-            # Check if response is valid
-            if not response.choices or not response.choices[0].message:
-                print(response)
-                raise ValueError("Invalid or empty response from LLM")
+                # Check if response is valid
+                if not response.choices or not response.choices[0].message:
+                    print(response)
+                    raise ValueError("Invalid or empty response from LLM")
+                message = response.choices[0].message
+                usage = response.usage
 
-            return response.choices[0].message
+            completion = (message.content or "") + "".join(
+                call.function.arguments for call in message.tool_calls or []
+            )
+            prompt_tokens, completion_tokens, estimated = self._response_tokens(
+                usage, messages, completion
+            )
+            self._record_response(
+                prompt_tokens,
+                completion_tokens,
+                stream=stream,
+                estimated=estimated,
+                tool_calls=len(message.tool_calls or []),
+            )
+            if cache_key:
+                self.cache.set(
+                    cache_key,
+                    Message.from_tool_calls(
+                        content=message.content, tool_calls=message.tool_calls or []
+                    ).model_dump(exclude_none=True),
+                )
+            return message
 
         except ValueError as ve:
             logger.error(f"Validation error in ask_tool: {ve}")
@@ -245,10 +582,128 @@ class LLM:
             if isinstance(oe, AuthenticationError):
                 logger.error("Authentication failed. Check API key.")
             elif isinstance(oe, RateLimitError):
-                logger.error("Rate limit exceeded. Consider increasing retry attempts.")
+                logger.error("Rate limit exceeded.")
             elif isinstance(oe, APIError):
                 logger.error(f"API error: {oe}")
             raise
         except Exception as e:
             logger.error(f"Unexpected error in ask_tool: {e}")
             raise
+
+    async def ask_tool_stream(
+        self,
+        messages: List[Union[dict, Message]],
+        system_msgs: Optional[List[Union[dict, Message]]] = None,
+        timeout: int = 60,
+        tools: Optional[List[dict]] = None,
+        tool_choice: Literal["none", "auto", "required"] = "auto",
+        temperature: Optional[float] = None,
+        **kwargs,
+    ) -> AsyncIterator[Message]:
+        """
+        Stream a tool-enabled completion, rebuilding tool calls from the deltas.
+
+        Each yielded item is an assistant `Message` snapshot holding the content
+        and the (possibly partial) tool calls received so far. Snapshots are only
+        built for the first chunk and whenever a tool call's id or name changes,
+        since a name is usually known after the first few chunks while its
+        arguments are still arriving; the last snapshot, built once the stream
+        ends, is the complete response.
+
+        Args:
+            messages: List of conversation messages
+            system_msgs: Optional system messages to prepend
+            timeout: Request timeout in seconds
+            tools: List of tools to use
+            tool_choice: Tool choice strategy
+            temperature: Sampling temperature for the response
+            **kwargs: Additional completion arguments
+
+        Yields:
+            Message: Snapshot of the assistant response assembled so far
+
+        Raises:
+            ValueError: If tools, tool_choice, or messages are invalid, or the
+                streamed response is empty
+            OpenAIError: If API call fails
+        """
+        if tool_choice not in ["none", "auto", "required"]:
+            raise ValueError(f"Invalid tool_choice: {tool_choice}")
+
+        if system_msgs:
+            system_msgs = self.format_messages(system_msgs)
+            messages = system_msgs + self.format_messages(messages)
+        else:
+            messages = self.format_messages(messages)
+
+        if tools:
+            for tool in tools:
+                if not isinstance(tool, dict) or "type" not in tool:
+                    raise ValueError("Each tool must be a dict with 'type' field")
+
+        response = await self._create_completion(
+            model=self.model,
+            messages=messages,
+            temperature=temperature or self.temperature,
+            max_tokens=self.max_tokens,
+            tools=tools,
+            tool_choice=tool_choice,
+            timeout=timeout,
+            stream=True,
+            **kwargs,
+        )
+
+        content_parts: List[str] = []
+        # Tool calls are keyed by the delta index, their arguments arrive in pieces
+        calls: Dict[int, Dict[str, Union[str, List[str]]]] = {}
+        received = False
+        async for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            # Rebuilding the snapshot costs the whole response so far, so only do
+            # it when a new tool call could be dispatched early
+            changed = not received
+            received = True
+            if delta.content:
+                content_parts.append(delta.content)
+            for call_delta in delta.tool_calls or []:
+                call = calls.setdefault(
+                    call_delta.index, {"id": "", "name": "", "arguments": []}
+                )
+                if call_delta.id and call_delta.id != call["id"]:
+                    call["id"] = call_delta.id
+                    changed = True
+                if call_delta.function:
+                    if call_delta.function.name:
+                        call["name"] += call_delta.function.name
+                        changed = True
+                    if call_delta.function.arguments:
+                        call["arguments"].append(call_delta.function.arguments)
+            if changed:
+                yield self._build_stream_snapshot(content_parts, calls)
+
+        message = self._build_stream_snapshot(content_parts, calls)
+        if not (message.content or message.tool_calls):
+            raise ValueError("Empty response from streaming LLM")
+        yield message
+
+    @staticmethod
+    def _build_stream_snapshot(
+        content_parts: List[str], calls: Dict[int, Dict[str, Union[str, List[str]]]]
+    ) -> Message:
+        """Build an assistant message from the streamed content and tool calls."""
+        tool_calls = [
+            ToolCall(
+                id=call["id"],
+                function=Function(
+                    name=call["name"], arguments="".join(call["arguments"])
+                ),
+            )
+            for _, call in sorted(calls.items())
+        ]
+        return Message(
+            role="assistant",
+            content="".join(content_parts) or None,
+            tool_calls=tool_calls or None,
+        )
@@ -0,0 +1,179 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from typing import Dict, Mapping, Optional, Tuple
+
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    InternalServerError,
+    RateLimitError,
+)
+
+from app.config import LLMSettings
+from app.logger import logger
+
+
+# Status codes worth retrying besides 429 and 5xx
+_RETRYABLE_STATUS = {408, 409}
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse a rate-limit duration such as "20ms", "1.5s" or "6m0s" into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait before retrying, if it said so."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a failed LLM request may succeed when retried."""
+    if isinstance(error, (APIConnectionError, RateLimitError, InternalServerError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in _RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def wait_for_retry(retry_state) -> float:
+    """tenacity wait strategy for LLM requests.
+
+    Rate-limited requests wait in the shared `RateLimiter` queue on their next
+    attempt, so they need no extra delay here; other transient failures back
+    off exponentially with jitter.
+    """
+    outcome = retry_state.outcome
+    if outcome is not None and isinstance(outcome.exception(), RateLimitError):
+        return 0.0
+    return random.uniform(0, min(60.0, 2.0**retry_state.attempt_number))
+
+
+class _Bucket:
+    """A token bucket that may go into debt, so reservations queue in order."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take amount from the bucket and return the delay until it is covered."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+
+class RateLimiter:
+    """Client-side request scheduler for one model endpoint.
+
+    Requests and tokens per minute are metered with token buckets shared by
+    every agent in the process. Each call reserves its share when it arrives,
+    so callers are released in FIFO order as capacity frees up instead of all
+    retrying at once. `Retry-After` and `x-ratelimit-*` response headers pause
+    the whole queue until the server's window resets.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ):
+        self._lock = threading.Lock()
+        self._requests = _Bucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = _Bucket(tokens_per_minute) if tokens_per_minute else None
+        self._blocked_until = 0.0
+        self._consecutive_limits = 0
+
+    @property
+    def meters_tokens(self) -> bool:
+        return self._tokens is not None
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Wait for this caller's turn to send a request estimated at tokens."""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._blocked_until - now)
+            if self._requests is not None:
+                delay = max(delay, self._requests.reserve(1, now))
+            if self._tokens is not None and tokens:
+                delay = max(delay, self._tokens.reserve(tokens, now))
+        if delay > 0:
+            logger.debug(f"Rate limiter delaying LLM request by {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct a token reservation once the real usage is known."""
+        if self._tokens is None:
+            return
+        with self._lock:
+            self._tokens.level -= actual_tokens - estimated_tokens
+
+    def observe_headers(self, headers: Mapping[str, str]) -> None:
+        """Pause the queue when the server reports an exhausted window."""
+        with self._lock:
+            self._consecutive_limits = 0
+            for kind in ("requests", "tokens"):
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if remaining is None or remaining.strip() not in ("0", "0.0"):
+                    continue
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self._block_for(reset)
+
+    def observe_rate_limit(self, error: BaseException) -> None:
+        """Pause the queue after a 429, for as long as the server asked."""
+        with self._lock:
+            self._consecutive_limits += 1
+            delay = retry_after(error)
+            if delay is None:
+                delay = random.uniform(0.5, 1.0) * min(
+                    60.0, 2.0**self._consecutive_limits
+                )
+            self._block_for(delay)
+        logger.warning(f"LLM rate limit hit, pausing requests for {delay:.1f}s")
+
+    def _block_for(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(settings: LLMSettings) -> RateLimiter:
+    """Return the limiter shared by every LLM using the same endpoint and model."""
+    key = (settings.base_url, settings.model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(
+                settings.requests_per_minute, settings.tokens_per_minute
+            )
+        return limiter
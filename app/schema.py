@@ -1,7 +1,34 @@
+import json
+import math
 from enum import Enum
 from typing import Any, List, Literal, Optional, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+
+from app.logger import logger
+
+
+# Fixed per-message overhead of the chat format (role and separators)
+MESSAGE_TOKEN_OVERHEAD = 4
+
+TOOL_OUTPUT_OMITTED_NOTE = "tool output were omitted to fit the context budget"
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens in text, estimating ~4 characters per token without tiktoken."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
 
 
 class AgentState(str, Enum):
@@ -35,6 +62,16 @@ class Message(BaseModel):
     name: Optional[str] = Field(default=None)
     tool_call_id: Optional[str] = Field(default=None)
 
+    # Serialised form and token count, rebuilt only after a field changes
+    _dict_cache: Optional[dict] = PrivateAttr(default=None)
+    _token_count: Optional[int] = PrivateAttr(default=None)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in type(self).model_fields:
+            self._dict_cache = None
+            self._token_count = None
+
     def __add__(self, other) -> List["Message"]:
         """支持 Message + list 或 Message + Message 的操作"""
         if isinstance(other, list):
@@ -57,16 +94,36 @@ class Message(BaseModel):
 
     def to_dict(self) -> dict:
         """Convert message to dictionary format"""
-        message = {"role": self.role}
-        if self.content is not None:
-            message["content"] = self.content
-        if self.tool_calls is not None:
-            message["tool_calls"] = [tool_call.dict() for tool_call in self.tool_calls]
-        if self.name is not None:
-            message["name"] = self.name
-        if self.tool_call_id is not None:
-            message["tool_call_id"] = self.tool_call_id
-        return message
+        if self._dict_cache is None:
+            message = {"role": self.role}
+            if self.content is not None:
+                message["content"] = self.content
+            if self.tool_calls is not None:
+                message["tool_calls"] = [
+                    tool_call.dict() for tool_call in self.tool_calls
+                ]
+            if self.name is not None:
+                message["name"] = self.name
+            if self.tool_call_id is not None:
+                message["tool_call_id"] = self.tool_call_id
+            self._dict_cache = message
+        return dict(self._dict_cache)
+
+    @property
+    def token_count(self) -> int:
+        """Approximate number of prompt tokens this message occupies"""
+        if self._token_count is None:
+            tokens = MESSAGE_TOKEN_OVERHEAD
+            if self.content:
+                tokens += count_tokens(self.content)
+            if self.tool_calls:
+                tokens += count_tokens(
+                    json.dumps([call.dict() for call in self.tool_calls])
+                )
+            if self.name:
+                tokens += count_tokens(self.name)
+            self._token_count = tokens
+        return self._token_count
 
     @classmethod
     def user_message(cls, content: str) -> "Message":
@@ -110,17 +167,121 @@ class Message(BaseModel):
 class Memory(BaseModel):
     messages: List[Message] = Field(default_factory=list)
     max_messages: int = Field(default=100)
+    max_tokens: Optional[int] = Field(
+        default=None, description="Token budget for the messages, None for no limit"
+    )
+    tool_output_keep_chars: int = Field(
+        default=1500, description="Characters kept from tool outputs when compacting"
+    )
+
+    # Running token total over `_counted_messages[:_counted_len]`
+    _counted_messages: Optional[List[Message]] = PrivateAttr(default=None)
+    _counted_len: int = PrivateAttr(default=0)
+    _token_total: int = PrivateAttr(default=0)
 
     def add_message(self, message: Message) -> None:
         """Add a message to memory"""
         self.messages.append(message)
-        # Optional: Implement message limit
-        if len(self.messages) > self.max_messages:
-            self.messages = self.messages[-self.max_messages :]
+        self.compact()
 
     def add_messages(self, messages: List[Message]) -> None:
         """Add multiple messages to memory"""
         self.messages.extend(messages)
+        self.compact()
+
+    def compact(self) -> None:
+        """Enforce the message limit and, if set, the token budget.
+
+        Over budget, older tool outputs are first shortened to their head and
+        tail, then the oldest turns are dropped. System and user messages are
+        pinned (except user messages repeated later on), an assistant message is
+        always kept or dropped together with its tool results, and the latest
+        turn is never touched.
+        """
+        if len(self.messages) > self.max_messages:
+            trimmed = self.messages[-self.max_messages :]
+            # Drop tool results whose assistant tool call was trimmed away
+            while trimmed and trimmed[0].role == "tool":
+                trimmed.pop(0)
+            self.messages = trimmed
+
+        if self.max_tokens is None or self.token_count <= self.max_tokens:
+            return
+
+        turns = self._group_turns()
+        total = self._shorten_tool_outputs(turns[:-1], self.token_count)
+        if total > self.max_tokens:
+            total = self._drop_old_turns(turns, total)
+        self.messages = [msg for turn in turns for msg in turn]
+        if total > self.max_tokens:
+            logger.warning(
+                f"Memory still holds ~{total} tokens after compaction "
+                f"(budget {self.max_tokens}); only pinned messages remain"
+            )
+
+    def _group_turns(self) -> List[List[Message]]:
+        """Group messages so that tool results stay with their assistant message"""
+        turns: List[List[Message]] = []
+        for msg in self.messages:
+            if msg.role == "tool" and turns:
+                turns[-1].append(msg)
+            else:
+                turns.append([msg])
+        return turns
+
+    def _shorten_tool_outputs(self, turns: List[List[Message]], total: int) -> int:
+        """Replace old tool outputs by their head and tail, oldest first"""
+        head = self.tool_output_keep_chars * 2 // 3
+        tail = self.tool_output_keep_chars - head
+        for turn in turns:
+            for i, msg in enumerate(turn):
+                if total <= self.max_tokens:
+                    return total
+                if (
+                    msg.role != "tool"
+                    or not msg.content
+                    or TOOL_OUTPUT_OMITTED_NOTE in msg.content
+                ):
+                    continue
+                omitted = len(msg.content) - self.tool_output_keep_chars
+                if omitted <= 0:
+                    continue
+                summary = Message.tool_message(
+                    content=(
+                        f"{msg.content[:head]}\n... [{omitted} characters of this "
+                        f"{TOOL_OUTPUT_OMITTED_NOTE}] ...\n"
+                        f"{msg.content[-tail:] if tail else ''}"
+                    ),
+                    name=msg.name,
+                    tool_call_id=msg.tool_call_id,
+                )
+                total += summary.token_count - msg.token_count
+                turn[i] = summary
+        return total
+
+    def _drop_old_turns(self, turns: List[List[Message]], total: int) -> int:
+        """Drop the oldest unpinned turns until the budget is met"""
+        latest = turns[-1][0]
+        later_user_contents = {latest.content} if latest.role == "user" else set()
+        droppable = []
+        for index in range(len(turns) - 2, -1, -1):
+            first = turns[index][0]
+            if first.role == "system":
+                continue
+            if first.role == "user":
+                if first.content not in later_user_contents:
+                    later_user_contents.add(first.content)
+                    continue
+            droppable.append(index)
+
+        dropped = set()
+        for index in reversed(droppable):
+            if total <= self.max_tokens:
+                break
+            total -= sum(msg.token_count for msg in turns[index])
+            dropped.add(index)
+        turns[:] = [turn for i, turn in enumerate(turns) if i not in dropped]
+        return total
 
     def clear(self) -> None:
         """Clear all messages"""
@@ -133,3 +294,22 @@ class Memory(BaseModel):
     def to_dict_list(self) -> List[dict]:
         """Convert messages to list of dicts"""
         return [msg.to_dict() for msg in self.messages]
+
+    @property
+    def token_count(self) -> int:
+        """Approximate prompt tokens of all messages.
+
+        Appended messages are added to a running total; the total is rebuilt
+        only when the list is replaced or shrinks (e.g. after trimming).
+        """
+        if (
+            self._counted_messages is not self.messages
+            or len(self.messages) < self._counted_len
+        ):
+            self._counted_messages = self.messages
+            self._counted_len = 0
+            self._token_total = 0
+        for msg in self.messages[self._counted_len :]:
+            self._token_total += msg.token_count
+        self._counted_len = len(self.messages)
+        return self._token_total
@@ -0,0 +1,47 @@
+"""Code execution worker for `PythonExecute`.
+
+Started by `PythonWorkerPool` as a standalone script, so it imports only the
+standard library and never the host program or the `app` package. It receives
+code over the connection whose file descriptor is its first argument and sends
+back one observation per run until the connection closes.
+"""
+import builtins
+import importlib
+import sys
+from io import StringIO
+from multiprocessing.connection import Connection
+
+
+def serve(conn: Connection, preload: list) -> None:
+    """Serve code execution requests sent over conn until the pipe closes."""
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+    while True:
+        try:
+            code = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        output_buffer = StringIO()
+        sys.stdout = output_buffer
+        try:
+            safe_globals = {"__builtins__": dict(vars(builtins))}
+            exec(code, safe_globals, {})
+            result = {"observation": output_buffer.getvalue(), "success": True}
+        except (Exception, SystemExit) as e:
+            result = {"observation": str(e), "success": False}
+        finally:
+            sys.stdout = sys.__stdout__
+
+        try:
+            conn.send(result)
+        except (EOFError, OSError):
+            break
+
+
+if __name__ == "__main__":
+    serve(Connection(int(sys.argv[1])), sys.argv[2:])
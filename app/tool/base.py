@@ -8,6 +8,8 @@ class BaseTool(ABC, BaseModel):
     name: str
     description: str
     parameters: Optional[dict] = None
+    # Whether calls may run concurrently on the same instance
+    parallel_safe: bool = False
 
     class Config:
         arbitrary_types_allowed = True
@@ -20,6 +22,9 @@ class BaseTool(ABC, BaseModel):
     async def execute(self, **kwargs) -> Any:
         """Execute the tool with given parameters."""
 
+    async def prepare(self) -> None:
+        """Warm up resources ahead of execution. No-op by default."""
+
     def to_param(self) -> Dict:
         """Convert tool to function call format."""
         return {
@@ -73,6 +78,8 @@ class ToolResult(BaseModel):
 class CLIResult(ToolResult):
     """A ToolResult that can be rendered as a CLI output."""
 
+    exit_code: Optional[int] = Field(default=None)
+
 
 class ToolFailure(ToolResult):
     """A ToolResult that represents a failure."""
@@ -1,8 +1,16 @@
 import asyncio
 import os
-from typing import Optional
+import shlex
+import shutil
+import signal
+import tempfile
+import weakref
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, List, Optional, Set, Tuple
 
 from app.exceptions import ToolError
+from app.logger import logger
 from app.tool.base import BaseTool, CLIResult, ToolResult
 
 
@@ -13,6 +21,80 @@ _BASH_DESCRIPTION = """Execute a bash command in the terminal.
 """
 
 
+class _OutputCapture:
+    """Bounded capture of one output stream of a command.
+
+    Output is kept in memory while it fits in `head_bytes + tail_bytes`. Beyond
+    that only the head and a rolling tail window stay in memory and the full
+    stream is written to a temporary file in the directory returned by
+    `spill_dir`, so memory stays flat however much a command prints.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        head_bytes: int,
+        tail_bytes: int,
+        progress_bytes: int,
+        spill_dir: Callable[[], str],
+    ):
+        self.name = name
+        self.spill_dir = spill_dir
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.progress_bytes = progress_bytes
+        self.total = 0
+        self.spill_path: Optional[str] = None
+        self._buffer = bytearray()
+        self._tail = bytearray()
+        self._spill_file = None
+
+    def feed(self, data: bytes) -> None:
+        if not data:
+            return
+        previous_total = self.total
+        self.total += len(data)
+        if self.total // self.progress_bytes > previous_total // self.progress_bytes:
+            logger.info(
+                f"bash {self.name}: {self.total // (1024 * 1024)} MB received so far"
+            )
+
+        if self._spill_file is None:
+            self._buffer += data
+            if len(self._buffer) <= self.head_bytes + self.tail_bytes:
+                return
+            # switch to bounded mode: spill everything so far and keep head/tail
+            self._spill_file = tempfile.NamedTemporaryFile(
+                prefix=f"bash_{self.name}_",
+                suffix=".log",
+                dir=self.spill_dir(),
+                delete=False,
+            )
+            self.spill_path = self._spill_file.name
+            self._spill_file.write(self._buffer)
+            self._tail = self._buffer[-self.tail_bytes :]
+            del self._buffer[self.head_bytes :]
+            return
+
+        self._spill_file.write(data)
+        self._tail += data
+        del self._tail[: -self.tail_bytes]
+
+    def finish(self) -> str:
+        """Close the spill file and render the captured output."""
+        if self._spill_file is None:
+            return self._buffer.decode(errors="replace")
+
+        self._spill_file.close()
+        omitted = self.total - len(self._buffer) - len(self._tail)
+        return (
+            f"{self._buffer.decode(errors='replace')}\n"
+            f"<response clipped: {omitted} bytes omitted, the full {self.name} "
+            f"({self.total} bytes) was saved to {self.spill_path}>\n"
+            f"{self._tail.decode(errors='replace')}"
+        )
+
+
 class _BashSession:
     """A session of a bash shell."""
 
@@ -20,23 +102,40 @@ class _BashSession:
     _process: asyncio.subprocess.Process
 
     command: str = "/bin/bash"
-    _output_delay: float = 0.2  # seconds
+    _read_size: int = 64 * 1024  # bytes per read
+    _head_bytes: int = 8 * 1024  # output kept from the start of large outputs
+    _tail_bytes: int = 8 * 1024  # output kept from the end of large outputs
+    _progress_bytes: int = 16 * 1024 * 1024  # log progress every this many bytes
     _timeout: float = 120.0  # seconds
+    _stop_timeout: float = 5.0  # seconds to wait for bash to exit before killing it
     _sentinel: str = "<<exit>>"
 
     def __init__(self):
         self._started = False
         self._timed_out = False
+        self.uses = 0
+        self.cwd = os.getcwd()
+        self.env = dict(os.environ)
+        # Holds the full output of commands that printed too much to keep in memory
+        self._spill_dir: Optional[str] = None
+        self._spill_cleanup: Optional[weakref.finalize] = None
+
+    @property
+    def healthy(self) -> bool:
+        """Whether the shell is running and can accept commands."""
+        return (
+            self._started and not self._timed_out and self._process.returncode is None
+        )
 
     async def start(self):
         if self._started:
             return
 
-        self._process = await asyncio.create_subprocess_shell(
+        # bash leads a process group of its own, which the commands it runs join
+        self._process = await asyncio.create_subprocess_exec(
             self.command,
-            preexec_fn=os.setsid,
-            shell=True,
-            bufsize=0,
+            start_new_session=True,
+            env=self.env,
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
@@ -45,12 +144,81 @@ class _BashSession:
         self._started = True
 
     def stop(self):
-        """Terminate the bash shell."""
+        """Terminate the bash shell and every process it started."""
         if not self._started:
             raise ToolError("Session has not started.")
-        if self._process.returncode is not None:
+        self._signal_group(signal.SIGTERM)
+
+    async def close(self):
+        """Stop the shell and wait for it to exit, killing its process group if
+        it does not exit in time."""
+        if not self._started:
             return
-        self._process.terminate()
+        self._remove_spills()
+        self.stop()
+        for kill in (False, True):
+            if kill:
+                self._signal_group(signal.SIGKILL)
+            try:
+                # Waits until bash has exited and its pipes are closed
+                async with asyncio.timeout(self._stop_timeout):
+                    await self._process.wait()
+                return
+            except asyncio.TimeoutError:
+                pass
+        logger.warning(
+            f"bash session {self._process.pid} did not exit after being killed"
+        )
+
+    def _spill_directory(self) -> str:
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="bash_session_")
+            self._spill_cleanup = weakref.finalize(
+                self, shutil.rmtree, self._spill_dir, True
+            )
+        return self._spill_dir
+
+    def _remove_spills(self) -> None:
+        """Delete the saved outputs of earlier commands."""
+        if self._spill_cleanup is not None:
+            self._spill_cleanup()
+            self._spill_cleanup = None
+            self._spill_dir = None
+
+    def _signal_group(self, sig: int) -> None:
+        # Children may outlive bash and keep its pipes open, so the group is
+        # signalled even once bash itself has exited
+        try:
+            os.killpg(self._process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def restart(self):
+        """Replace the shell process with a fresh one."""
+        await self.close()
+        self._started = False
+        self._timed_out = False
+        await self.start()
+
+    async def reset(self) -> bool:
+        """Replace the shell with a fresh bash in its initial directory and
+        environment, dropping the variables, aliases, functions, options and
+        traps set by earlier commands, killing their background jobs and
+        deleting their saved outputs. Returns False if the shell could not be
+        reset."""
+        env = " ".join(shlex.quote(f"{key}={value}") for key, value in self.env.items())
+        try:
+            # `builtin` bypasses functions that shadow the commands used here
+            result = await self.run(
+                "\\unset -f builtin 2>/dev/null; "
+                "builtin kill $(builtin jobs -p) 2>/dev/null || :; "
+                f"builtin cd {shlex.quote(self.cwd)} && "
+                f"builtin exec /usr/bin/env -i {env} {shlex.quote(self.command)}"
+            )
+        except ToolError:
+            return False
+        self._remove_spills()
+        return isinstance(result, CLIResult) and result.exit_code == 0
 
     async def run(self, command: str):
         """Execute a command in the bash shell."""
@@ -71,46 +239,220 @@ class _BashSession:
         assert self._process.stdout
         assert self._process.stderr
 
-        # send command to the process
+        # send the command, then a sentinel on each stream. Stdout's sentinel carries
+        # the exit code; it is on its own line so it still runs if the command
+        # does not parse or ends with `&`.
         self._process.stdin.write(
-            command.encode() + f"; echo '{self._sentinel}'\n".encode()
+            command.encode()
+            + f"\necho '{self._sentinel}'$?\necho '{self._sentinel}' >&2\n".encode()
         )
         await self._process.stdin.drain()
 
-        # read output from the process, until the sentinel is found
+        # read both streams as chunks arrive, until their sentinels are found
         try:
             async with asyncio.timeout(self._timeout):
-                while True:
-                    await asyncio.sleep(self._output_delay)
-                    # if we read directly from stdout/stderr, it will wait forever for
-                    # EOF. use the StreamReader buffer directly instead.
-                    output = (
-                        self._process.stdout._buffer.decode()
-                    )  # pyright: ignore[reportAttributeAccessIssue]
-                    if self._sentinel in output:
-                        # strip the sentinel and break
-                        output = output[: output.index(self._sentinel)]
-                        break
+                (output, exit_code), (error, _) = await asyncio.gather(
+                    self._read_until_sentinel(self._process.stdout, "stdout"),
+                    self._read_until_sentinel(self._process.stderr, "stderr"),
+                )
         except asyncio.TimeoutError:
             self._timed_out = True
             raise ToolError(
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             ) from None
+        except EOFError:
+            returncode = await self._process.wait()
+            return ToolResult(
+                system="tool must be restarted",
+                error=f"bash has exited with returncode {returncode}",
+            )
 
         if output.endswith("\n"):
             output = output[:-1]
 
-        error = (
-            self._process.stderr._buffer.decode()
-        )  # pyright: ignore[reportAttributeAccessIssue]
         if error.endswith("\n"):
             error = error[:-1]
 
-        # clear the buffers so that the next output can be read correctly
-        self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
-        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
+        return CLIResult(
+            output=output,
+            error=error,
+            exit_code=int(exit_code) if exit_code.isdigit() else None,
+        )
+
+    async def _read_until_sentinel(
+        self, stream: asyncio.StreamReader, name: str
+    ) -> Tuple[str, bytes]:
+        """Read stream until the sentinel line, returning the captured output
+        before it and the rest of the sentinel line.
+
+        Only newly received bytes are searched; everything except a possible
+        partial sentinel is handed to a bounded capture right away.
+        """
+        sentinel = self._sentinel.encode()
+        capture = _OutputCapture(
+            name,
+            self._head_bytes,
+            self._tail_bytes,
+            self._progress_bytes,
+            self._spill_directory,
+        )
+        pending = bytearray()
+        try:
+            while True:
+                chunk = await stream.read(self._read_size)
+                if not chunk:
+                    raise EOFError("bash closed its output")
+                pending += chunk
+
+                index = pending.find(sentinel)
+                if index == -1:
+                    # keep just enough bytes for a sentinel straddling two chunks
+                    keep = len(sentinel) - 1
+                    capture.feed(bytes(pending[:-keep]))
+                    del pending[:-keep]
+                    continue
+                capture.feed(bytes(pending[:index]))
+                del pending[:index]
+                line_end = pending.find(b"\n", len(sentinel))
+                if line_end != -1:
+                    return capture.finish(), bytes(pending[len(sentinel) : line_end])
+        except BaseException:
+            capture.finish()
+            raise
+
+
+# The session leased to the current agent run, if any
+_leased_session: ContextVar[Optional[_BashSession]] = ContextVar(
+    "bash_session", default=None
+)
+
+
+class BashSessionPool:
+    """A pool of pre-spawned bash sessions for one event loop.
+
+    `session()` leases a shell to the calling agent run and makes every `Bash`
+    tool used within it talk to that shell. When the run ends, the shell is
+    replaced by a fresh one in its starting directory and environment and
+    returned, or discarded if it timed out, exited or reached `max_uses`. At most
+    `max_sessions` shells are alive at once and `min_idle` warm spares are kept so
+    a run never waits for bash to start.
+    """
+
+    def __init__(self, max_sessions: int = 8, min_idle: int = 1, max_uses: int = 50):
+        self.max_sessions = max_sessions
+        self.min_idle = min_idle
+        self.max_uses = max_uses
+        self._leases = asyncio.Semaphore(max_sessions)
+        self._idle: List[_BashSession] = []
+        self._leased = 0
+        self._tasks: Set[asyncio.Task] = set()
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[_BashSession]:
+        """Lease a session for the duration of the block."""
+        session = await self.acquire()
+        token = _leased_session.set(session)
+        try:
+            yield session
+        finally:
+            _leased_session.reset(token)
+            await self.release(session)
+
+    async def acquire(self) -> _BashSession:
+        await self._leases.acquire()
+        self._leased += 1
+        try:
+            session = None
+            while self._idle and session is None:
+                candidate = self._idle.pop()
+                if candidate.healthy:
+                    session = candidate
+                else:
+                    await candidate.close()
+            if session is None:
+                session = _BashSession()
+                await session.start()
+        except BaseException:
+            self._leased -= 1
+            self._leases.release()
+            raise
+        self._replenish()
+        return session
+
+    async def release(self, session: _BashSession) -> None:
+        try:
+            session.uses += 1
+            if await self._reset(session) and len(self._idle) < self.min_idle:
+                self._idle.append(session)
+            else:
+                await session.close()
+        finally:
+            self._leased -= 1
+            self._leases.release()
+
+    async def _reset(self, session: _BashSession) -> bool:
+        """Return the session to its initial state; False if it is unusable."""
+        if not session.healthy or session.uses >= self.max_uses:
+            return False
+        return await session.reset()
+
+    async def aclose(self) -> None:
+        """Stop the idle sessions and any spare still starting."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(session.close() for session in idle))
+
+    def _replenish(self) -> None:
+        """Start spare sessions in the background up to `min_idle`."""
+        # Spares still starting count as idle so repeated calls do not overshoot
+        spares = len(self._idle) + len(self._tasks)
+        missing = min(
+            self.min_idle - spares,
+            self.max_sessions - self._leased - spares,
+        )
+        for _ in range(missing):
+            task = asyncio.create_task(self._spawn_spare())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _spawn_spare(self) -> None:
+        session = _BashSession()
+        try:
+            await session.start()
+        except Exception as e:
+            logger.warning(f"Failed to start spare bash session: {e}")
+            return
+        # Released sessions may have refilled the pool while this one started
+        if (
+            len(self._idle) >= self.min_idle
+            or self._leased + len(self._idle) >= self.max_sessions
+        ):
+            await session.close()
+        else:
+            self._idle.append(session)
+
 
-        return CLIResult(output=output, error=error)
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, BashSessionPool]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_session_pool() -> BashSessionPool:
+    """Return the bash session pool of the running event loop."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = BashSessionPool()
+    return pool
+
+
+async def aclose_session_pool() -> None:
+    """Close the bash session pool of the running event loop, if one was created."""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.aclose()
 
 
 class Bash(BaseTool):
@@ -131,12 +473,34 @@ class Bash(BaseTool):
 
     _session: Optional[_BashSession] = None
 
+    async def prepare(self) -> None:
+        """Start the shell session before the first command arrives."""
+        if _leased_session.get() is not None or self._session is not None:
+            return
+        session = _BashSession()
+        await session.start()
+        # Only publish a started session, and keep one execute() may have made meanwhile
+        if self._session is None:
+            self._session = session
+        else:
+            await session.close()
+
     async def execute(
         self, command: str | None = None, restart: bool = False, **kwargs
     ) -> CLIResult:
+        # Inside a pooled agent run, use the shell leased to that run
+        leased = _leased_session.get()
+        if leased is not None:
+            if restart:
+                await leased.restart()
+                return ToolResult(system="tool has been restarted.")
+            if command is not None:
+                return await leased.run(command)
+            raise ToolError("no command provided.")
+
         if restart:
             if self._session:
-                self._session.stop()
+                await self._session.close()
             self._session = _BashSession()
             await self._session.start()
 
@@ -106,6 +106,11 @@ class BrowserUseTool(BaseTool):
             self.dom_service = DomService(await self.context.get_current_page())
         return self.context
 
+    async def prepare(self) -> None:
+        """Start the browser before the first action arrives."""
+        async with self.lock:
+            await self._ensure_browser_initialized()
+
     async def execute(
         self,
         action: str,
@@ -0,0 +1,505 @@
+import asyncio
+import fnmatch
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from app.exceptions import ToolError
+from app.logger import logger
+from app.tool.base import BaseTool, CLIResult
+from app.tool.directory_tree import iter_files
+
+
+# Larger files are left out of the index and never searched
+MAX_FILE_SIZE = 1024 * 1024
+
+# Number of workspace indexes kept in memory
+MAX_CACHED_INDEXES = 4
+
+# Matching lines longer than this are cut short in the results
+MAX_LINE_LENGTH = 300
+
+_INDEX_VERSION = 1
+
+# Inline flags such as (?x) or (?i:...) change how the rest of a pattern reads
+_INLINE_FLAGS = re.compile(r"\(\?[aiLmsux-]+[:)]")
+
+
+def _default_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "openmanus" / "code_search"
+
+
+def _trigrams(data: bytes) -> FrozenSet[bytes]:
+    """Case-folded byte trigrams of data, each distinct line scanned once."""
+    trigrams: Set[bytes] = set()
+    for line in set(data.lower().split(b"\n")):
+        trigrams.update(line[i : i + 3] for i in range(len(line) - 2))
+    return frozenset(trigrams)
+
+
+def _required_literals(pattern: str) -> List[str]:
+    """Runs of literal characters that every match of the regex must contain.
+
+    This is a conservative scan of the pattern: anything it does not fully
+    understand (groups, classes, alternation) ends the current run, so the
+    literals are safe to use as a filter but may not be the longest ones.
+    """
+    if "|" in pattern:
+        return []  # Any branch may match on its own
+    if _INLINE_FLAGS.search(pattern):
+        return []  # Verbose or case-insensitive text is not matched literally
+
+    runs: List[str] = []
+    run: List[str] = []
+    depth = 0
+
+    def flush() -> None:
+        if run:
+            runs.append("".join(run))
+            run.clear()
+
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            escaped = pattern[i + 1 : i + 2]
+            i += 2
+            if escaped and not escaped.isalnum() and depth == 0:
+                run.append(escaped)  # Escaped punctuation matches itself
+            else:
+                flush()  # A class (\d, \w), an anchor (\b) or a back-reference
+            continue
+        if char == "[":
+            flush()
+            # Skip the class; `]` right after `[` or `[^` is a literal
+            i += 1
+            if pattern[i : i + 1] == "^":
+                i += 1
+            if pattern[i : i + 1] == "]":
+                i += 1
+            while i < len(pattern) and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+            i += 1
+            continue
+        if char in "*?{":
+            # The preceding character is optional or repeated a variable number of times
+            if run:
+                run.pop()
+            flush()
+            if char == "{":
+                closing = pattern.find("}", i)
+                i = closing if closing != -1 else len(pattern)
+        elif char == "(":
+            flush()
+            depth += 1
+        elif char == ")":
+            depth = max(0, depth - 1)
+        elif char in ".^$+":
+            flush()
+        elif depth == 0:
+            run.append(char)
+        i += 1
+    flush()
+    return runs
+
+
+class _FileRecord:
+    __slots__ = ("file_id", "mtime_ns", "size", "is_text")
+
+    def __init__(self, file_id: int, mtime_ns: int, size: int, is_text: bool):
+        self.file_id = file_id
+        self.mtime_ns = mtime_ns
+        self.size = size
+        # Binary files are recorded so they are not re-read, but never searched
+        self.is_text = is_text
+
+
+class TrigramIndex:
+    """Inverted index from case-folded byte trigrams to the files under a root.
+
+    A query is first narrowed to the files containing every trigram of the
+    literal text it requires, and only those files are read and matched.
+    `update` brings the index up to date by re-reading just the files whose
+    modification time or size changed since they were indexed, so keeping it
+    current costs a walk of the tree rather than a read of every file.
+
+    The postings live in an SQLite database under `cache_dir` (in memory
+    without one) and each update only writes the rows of the files that
+    changed, so the index persists incrementally and is reused by later runs.
+    Only the path, size and modification time of each file are kept in memory.
+    """
+
+    def __init__(self, root: str, cache_dir: Optional[Path] = None):
+        self.root = root
+        self.lock = threading.Lock()
+        self._files: Dict[str, _FileRecord] = {}
+        self._paths: Dict[int, str] = {}
+        self._db_path: Optional[Path] = None
+        if cache_dir is not None:
+            digest = hashlib.sha256(root.encode("utf-8")).hexdigest()[:32]
+            self._db_path = cache_dir / f"{digest}.db"
+        self._db: Optional[sqlite3.Connection] = None
+        # Changes when another connection commits to the database
+        self._data_version: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def update(self) -> None:
+        """Re-index changed files and forget deleted ones."""
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            data_version = db.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._load_files(db)
+
+            seen = set()
+            for entry in iter_files(self.root):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if stat.st_size > MAX_FILE_SIZE:
+                    continue
+                path = entry.path
+                seen.add(path)
+                record = self._files.get(path)
+                if record and (record.mtime_ns, record.size) == (
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                ):
+                    continue
+                try:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                except OSError:
+                    seen.discard(path)
+                    continue
+                self._remove(db, path)
+                self._add(db, path, stat.st_mtime_ns, stat.st_size, data)
+
+            for path in [path for path in self._files if path not in seen]:
+                self._remove(db, path)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            self._data_version = None  # Reload the file table next time
+            raise
+        self._data_version = data_version
+
+    def candidates(
+        self, literals: Iterable[str], under: Optional[str] = None
+    ) -> List[str]:
+        """Sorted text files (under, or below it, if given) that may contain all literals."""
+        needed: Set[bytes] = set()
+        for literal in literals:
+            needed.update(_trigrams(literal.encode("utf-8")))
+
+        if needed:
+            postings: List[Set[int]] = []
+            for trigram in needed:
+                file_ids = {
+                    row[0]
+                    for row in self._connect().execute(
+                        "SELECT file_id FROM postings WHERE trigram = ?", (trigram,)
+                    )
+                }
+                if not file_ids:
+                    return []
+                postings.append(file_ids)
+            postings.sort(key=len)
+            file_ids = postings[0].intersection(*postings[1:])
+            paths = {self._paths[file_id] for file_id in file_ids}
+        else:
+            paths = {path for path, record in self._files.items() if record.is_text}
+        if under is not None and under != self.root:
+            prefix = under.rstrip(os.sep) + os.sep
+            paths = {path for path in paths if path == under or path.startswith(prefix)}
+        return sorted(paths)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is not None:
+            return self._db
+        if self._db_path is not None:
+            try:
+                self._db_path.parent.mkdir(parents=True, exist_ok=True)
+                self._db = self._open(str(self._db_path))
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(
+                    f"Could not open code search index {self._db_path}, keeping it in memory: {e}"
+                )
+        if self._db is None:
+            self._db = self._open(":memory:")
+        return self._db
+
+    @staticmethod
+    def _open(database: str) -> sqlite3.Connection:
+        db = sqlite3.connect(
+            database, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        try:
+            if db.execute("PRAGMA user_version").fetchone()[0] != _INDEX_VERSION:
+                db.executescript(
+                    f"""
+                    DROP TABLE IF EXISTS postings;
+                    DROP TABLE IF EXISTS files;
+                    CREATE TABLE files (
+                        id INTEGER PRIMARY KEY,
+                        path TEXT NOT NULL UNIQUE,
+                        mtime_ns INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        is_text INTEGER NOT NULL
+                    );
+                    CREATE TABLE postings (
+                        trigram BLOB NOT NULL,
+                        file_id INTEGER NOT NULL,
+                        PRIMARY KEY (trigram, file_id)
+                    ) WITHOUT ROWID;
+                    CREATE INDEX postings_file ON postings (file_id);
+                    PRAGMA user_version = {_INDEX_VERSION};
+                    """
+                )
+        except sqlite3.Error:
+            db.close()
+            raise
+        return db
+
+    def _load_files(self, db: sqlite3.Connection) -> None:
+        self._files.clear()
+        self._paths.clear()
+        for file_id, path, mtime_ns, size, is_text in db.execute(
+            "SELECT id, path, mtime_ns, size, is_text FROM files"
+        ):
+            self._files[path] = _FileRecord(file_id, mtime_ns, size, bool(is_text))
+            self._paths[file_id] = path
+
+    def _add(
+        self, db: sqlite3.Connection, path: str, mtime_ns: int, size: int, data: bytes
+    ) -> None:
+        is_text = b"\0" not in data[:8192]
+        file_id = db.execute(
+            "INSERT INTO files (path, mtime_ns, size, is_text) VALUES (?, ?, ?, ?)",
+            (path, mtime_ns, size, is_text),
+        ).lastrowid
+        if is_text:
+            db.executemany(
+                "INSERT INTO postings (trigram, file_id) VALUES (?, ?)",
+                ((trigram, file_id) for trigram in _trigrams(data)),
+            )
+        self._files[path] = _FileRecord(file_id, mtime_ns, size, is_text)
+        self._paths[file_id] = path
+
+    def _remove(self, db: sqlite3.Connection, path: str) -> None:
+        record = self._files.pop(path, None)
+        if record is None:
+            return
+        del self._paths[record.file_id]
+        db.execute("DELETE FROM postings WHERE file_id = ?", (record.file_id,))
+        db.execute("DELETE FROM files WHERE id = ?", (record.file_id,))
+
+
+_indexes: "OrderedDict[str, TrigramIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(path: str, cache_dir: Optional[Path] = None) -> TrigramIndex:
+    """Return the index covering path, reusing the index of an enclosing
+    directory if one is loaded."""
+    with _indexes_lock:
+        for root, index in _indexes.items():
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                _indexes.move_to_end(root)
+                return index
+        index = _indexes[path] = TrigramIndex(path, cache_dir)
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            # The database connection is closed once the index is collected
+            _indexes.popitem(last=False)
+        return index
+
+
+def _search(
+    index: TrigramIndex,
+    under: str,
+    query: str,
+    regex: bool,
+    ignore_case: bool,
+    include: Optional[str],
+    context_lines: int,
+    max_results: int,
+) -> Tuple[List[str], int, int, bool]:
+    """Search the files under `under` and format the matches.
+
+    Returns the formatted matches, the number of matches and of matching files,
+    and whether matches beyond `max_results` were left out.
+    """
+    flags = re.IGNORECASE if ignore_case else 0
+    try:
+        compiled = re.compile(query if regex else re.escape(query), flags)
+    except re.error as e:
+        raise ToolError(f"Invalid regular expression `{query}`: {e}") from None
+    literals = _required_literals(query) if regex else [query]
+    if ignore_case:
+        # Only ASCII letters are case-folded in the index
+        literals = [literal for literal in literals if literal.isascii()]
+
+    with index.lock:
+        index.update()
+        paths = index.candidates(literals, under)
+
+    output: List[str] = []
+    match_count = file_count = 0
+    truncated = False
+    for path in paths:
+        name = path if "/" in (include or "") else os.path.basename(path)
+        if include and not fnmatch.fnmatch(name, include):
+            continue
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                lines = f.read().split("\n")
+        except OSError:
+            continue
+        if lines[-1] == "":
+            lines.pop()  # The file ends with a newline
+
+        if match_count >= max_results:
+            # Only look for one more match to tell whether the results were cut off
+            if any(compiled.search(line) for line in lines):
+                truncated = True
+                break
+            continue
+        matches = [i for i, line in enumerate(lines) if compiled.search(line)]
+        if not matches:
+            continue
+        if len(matches) > max_results - match_count:
+            truncated = True
+            matches = matches[: max_results - match_count]
+        file_count += 1
+        match_count += len(matches)
+
+        # Merge the context windows of nearby matches, like grep -C
+        windows: List[List[int]] = []
+        for i in matches:
+            window = [max(0, i - context_lines), min(len(lines), i + context_lines + 1)]
+            if windows and window[0] <= windows[-1][1]:
+                windows[-1][1] = window[1]
+            else:
+                windows.append(window)
+        matched = set(matches)
+        for start, end in windows:
+            if output:
+                output.append("--")
+            for i in range(start, end):
+                line = lines[i]
+                if len(line) > MAX_LINE_LENGTH:
+                    line = line[:MAX_LINE_LENGTH] + "..."
+                separator = ":" if i in matched else "-"
+                output.append(f"{path}{separator}{i + 1}{separator}{line}")
+        if truncated:
+            break
+    return output, match_count, file_count, truncated
+
+
+class CodeSearch(BaseTool):
+    """A tool for searching the contents of the files in a directory tree."""
+
+    name: str = "code_search"
+    description: str = """Search the contents of the files under a directory for a literal string or a regular expression, like `grep -rn`, but answered from an index that is kept up to date as files change, so repeated searches of a large repository are fast.
+* Matches are reported one per line as `path:line:text`, surrounded by `path-line-text` context lines, like `grep -C`
+* Regular expressions use Python syntax and are matched against one line at a time
+* Hidden files and directories, files ignored by .gitignore, binary files and files over 1 MB are not searched
+"""
+    parameters: dict = {
+        "type": "object",
+        "properties": {
+            "query": {
+                "description": "The text or regular expression to search for.",
+                "type": "string",
+            },
+            "path": {
+                "description": "Absolute path of the directory (or file) to search in, e.g. `/workspace/repo`.",
+                "type": "string",
+            },
+            "regex": {
+                "description": "Whether `query` is a regular expression. Defaults to false, a literal string.",
+                "type": "boolean",
+            },
+            "ignore_case": {
+                "description": "Whether to match case-insensitively. Defaults to false.",
+                "type": "boolean",
+            },
+            "include": {
+                "description": "Optional glob restricting the files searched, e.g. `*.py`, matched against file names (or full paths if it contains `/`).",
+                "type": "string",
+            },
+            "context_lines": {
+                "description": "Number of lines of context to show around each match. Defaults to 2.",
+                "type": "integer",
+            },
+            "max_results": {
+                "description": "Maximum number of matching lines to return. Defaults to 50.",
+                "type": "integer",
+            },
+        },
+        "required": ["query", "path"],
+    }
+    parallel_safe: bool = True
+
+    cache_dir: Optional[Path] = None
+
+    async def execute(
+        self,
+        query: str,
+        path: str,
+        regex: bool = False,
+        ignore_case: bool = False,
+        include: Optional[str] = None,
+        context_lines: int = 2,
+        max_results: int = 50,
+        **kwargs,
+    ) -> CLIResult:
+        """Search the files under path, updating their index first."""
+        if not query:
+            raise ToolError("Parameter `query` must not be empty.")
+        _path = Path(path)
+        if not _path.is_absolute():
+            raise ToolError(
+                f"The path {path} is not an absolute path, it should start with `/`."
+            )
+        if not _path.exists():
+            raise ToolError(
+                f"The path {path} does not exist. Please provide a valid path."
+            )
+        under = os.path.normpath(path)
+        # A single file is searched through the index of its directory
+        root = under if _path.is_dir() else os.path.dirname(under)
+        context_lines = max(0, context_lines)
+        max_results = max(1, max_results)
+
+        index = get_index(root, self.cache_dir or _default_cache_dir())
+        output, match_count, file_count, truncated = await asyncio.to_thread(
+            _search,
+            index,
+            under,
+            query,
+            regex,
+            ignore_case,
+            include,
+            context_lines,
+            max_results,
+        )
+
+        if not match_count:
+            return CLIResult(output=f"No matches found for `{query}` in {path}.")
+        summary = f"Found {match_count} matching lines in {file_count} files for `{query}` in {path}"
+        if truncated:
+            summary += (
+                f" (stopped at {max_results}, narrow the search if you need more)"
+            )
+        return CLIResult(output=summary + ":\n" + "\n".join(output))
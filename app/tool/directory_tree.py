@@ -0,0 +1,180 @@
+import fnmatch
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+
+# Names skipped in every listing, in addition to hidden entries
+DEFAULT_IGNORED_NAMES = frozenset({"node_modules", "__pycache__"})
+
+# Entries listed per directory before the rest are summarised
+MAX_ENTRIES_PER_DIR = 50
+
+# Number of directory listings kept around between views
+MAX_CACHED_SNAPSHOTS = 32
+
+
+class _IgnoreRule:
+    """One pattern line of a .gitignore file."""
+
+    __slots__ = ("base", "pattern", "negated", "dir_only", "anchored")
+
+    def __init__(self, base: str, line: str):
+        self.base = base
+        self.negated = line.startswith("!")
+        if self.negated:
+            line = line[1:]
+        self.dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        # Patterns containing a slash are relative to the .gitignore directory
+        self.anchored = "/" in line
+        self.pattern = line.lstrip("/")
+
+    def matches(self, path: str, name: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if not self.anchored:
+            return fnmatch.fnmatchcase(name, self.pattern)
+        relative = os.path.relpath(path, self.base)
+        return not relative.startswith("..") and fnmatch.fnmatchcase(
+            relative, self.pattern
+        )
+
+
+def _load_gitignore(directory: str) -> List[_IgnoreRule]:
+    try:
+        with open(os.path.join(directory, ".gitignore"), encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except (OSError, UnicodeDecodeError):
+        return []
+    return [
+        _IgnoreRule(directory, line.strip())
+        for line in lines
+        if line.strip() and not line.startswith("#")
+    ]
+
+
+def _is_ignored(rules: List[_IgnoreRule], path: str, name: str, is_dir: bool) -> bool:
+    """Apply gitignore rules in order; the last matching rule wins."""
+    ignored = False
+    for rule in rules:
+        if rule.negated == ignored and rule.matches(path, name, is_dir):
+            ignored = not rule.negated
+    return ignored
+
+
+def _stamp(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class _Snapshot:
+    """A rendered listing and the modification times it was built from."""
+
+    __slots__ = ("output", "stamps")
+
+    def __init__(self, output: str, stamps: List[Tuple[str, Optional[int]]]):
+        self.output = output
+        self.stamps = stamps
+
+    def is_current(self) -> bool:
+        return all(_stamp(path) == stamp for path, stamp in self.stamps)
+
+
+def _visible_entries(
+    directory: str, rules: List[_IgnoreRule]
+) -> Iterator[Tuple[os.DirEntry, bool]]:
+    """Yield the entries of directory that are not hidden or ignored, sorted by
+    name, each with whether it is a directory."""
+    try:
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return
+
+    for entry in entries:
+        if entry.name.startswith(".") or entry.name in DEFAULT_IGNORED_NAMES:
+            continue
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            is_dir = False
+        if not _is_ignored(rules, entry.path, entry.name, is_dir):
+            yield entry, is_dir
+
+
+def iter_files(root: str) -> Iterator[os.DirEntry]:
+    """Yield every file under root that is not hidden or ignored, at any depth."""
+    pending = [(root, [])]
+    while pending:
+        directory, rules = pending.pop()
+        rules = rules + _load_gitignore(directory)
+        for entry, is_dir in _visible_entries(directory, rules):
+            if is_dir:
+                pending.append((entry.path, rules))
+            elif entry.is_file():
+                yield entry
+
+
+def _walk(root: str, max_depth: int, max_entries: int) -> _Snapshot:
+    lines = [root]
+    stamps: List[Tuple[str, Optional[int]]] = []
+
+    def visit(directory: str, depth: int, rules: List[_IgnoreRule]) -> None:
+        stamps.append((directory, _stamp(directory)))
+        gitignore = os.path.join(directory, ".gitignore")
+        stamps.append((gitignore, _stamp(gitignore)))
+        rules = rules + _load_gitignore(directory)
+
+        shown = 0
+        for entry, is_dir in _visible_entries(directory, rules):
+            if shown == max_entries:
+                lines.append(
+                    f"{directory}/... (more entries not shown, view this directory to see them)"
+                )
+                break
+            shown += 1
+            lines.append(entry.path)
+            if is_dir and depth < max_depth:
+                visit(entry.path, depth + 1, rules)
+
+    visit(root, 1, [])
+    return _Snapshot("\n".join(lines), stamps)
+
+
+_snapshots: "OrderedDict[Tuple[str, int, int], _Snapshot]" = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+
+def list_directory(
+    path: Path, max_depth: int = 2, max_entries: int = MAX_ENTRIES_PER_DIR
+) -> str:
+    """
+    List the files and directories under path up to max_depth levels deep, one
+    path per line like `find`, skipping hidden entries, common dependency and
+    cache directories and anything matched by .gitignore files in the tree.
+
+    Listings are cached and reused while the modification times of every
+    directory and .gitignore file they were built from are unchanged.
+    """
+    root = os.path.normpath(str(path))
+    key = (root, max_depth, max_entries)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(key)
+    if snapshot is not None and snapshot.is_current():
+        with _snapshots_lock:
+            if key in _snapshots:
+                _snapshots.move_to_end(key)
+        return snapshot.output
+
+    snapshot = _walk(root, max_depth, max_entries)
+    with _snapshots_lock:
+        _snapshots[key] = snapshot
+        _snapshots.move_to_end(key)
+        while len(_snapshots) > MAX_CACHED_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    return snapshot.output
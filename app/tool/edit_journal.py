@@ -0,0 +1,197 @@
+import hashlib
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+from app.exceptions import ToolError
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _common_length(a: str, b: str, limit: int, from_end: bool = False) -> int:
+    """Length of the common prefix (or suffix) of a and b, at most limit.
+
+    Binary search over slice comparisons keeps the character scanning in C.
+    """
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if from_end:
+            same = a[len(a) - mid :] == b[len(b) - mid :]
+        else:
+            same = a[:mid] == b[:mid]
+        if same:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class _JournalEntry:
+    """Reverse diff of one edit: replacing `after[start:end]` with the old text
+    turns the edited file back into its previous version. Snapshots have no
+    digest and replace the whole file."""
+
+    __slots__ = ("start", "end", "after_digest", "text", "spill_file", "size")
+
+    def __init__(self, start: int, end: int, after_digest: Optional[str], text: str):
+        self.start = start
+        self.end = end
+        self.after_digest = after_digest
+        self.text: Optional[str] = text
+        self.spill_file: Optional[Path] = None
+        self.size = len(text)
+
+
+class EditJournal:
+    """Bounded undo history of the files edited through one editor.
+
+    Each edit is stored as a reverse diff covering only the changed region
+    (the text between the common prefix and suffix of the two versions),
+    together with a digest of the edited file so an undo is only applied to
+    the content it was recorded against.
+
+    Histories are kept per path in least recently used order. When the diffs
+    held in memory exceed `max_memory_chars`, the oldest ones of the least
+    recently edited paths are spilled to a temporary directory; once that
+    exceeds `max_disk_chars`, they are dropped, which shortens how far back
+    those files can be undone.
+    """
+
+    def __init__(
+        self,
+        max_memory_chars: int = 8 * 1024 * 1024,
+        max_disk_chars: int = 256 * 1024 * 1024,
+        max_entries_per_path: int = 100,
+    ):
+        self.max_memory_chars = max_memory_chars
+        self.max_disk_chars = max_disk_chars
+        self.max_entries_per_path = max_entries_per_path
+        self._histories: "OrderedDict[Path, List[_JournalEntry]]" = OrderedDict()
+        self._memory_chars = 0
+        self._disk_chars = 0
+        self._spill_dir: Optional[Path] = None
+        self._spill_count = 0
+        self._finalizer = None
+
+    def __contains__(self, path: Path) -> bool:
+        return bool(self._histories.get(path))
+
+    def record(self, path: Path, before: str, after: str) -> None:
+        """Remember how to turn `after`, the new content of path, back into `before`."""
+        limit = min(len(before), len(after))
+        prefix = _common_length(before, after, limit)
+        suffix = _common_length(before, after, limit - prefix, from_end=True)
+
+        self._add(
+            path,
+            _JournalEntry(
+                prefix,
+                len(after) - suffix,
+                _digest(after),
+                before[prefix : len(before) - suffix],
+            ),
+        )
+
+    def record_snapshot(self, path: Path, text: str) -> None:
+        """Remember text as a version path can always be restored to, e.g. the
+        content it was created with."""
+        self._add(path, _JournalEntry(0, 0, None, text))
+
+    def _add(self, path: Path, entry: _JournalEntry) -> None:
+        history = self._histories.setdefault(path, [])
+        history.append(entry)
+        self._histories.move_to_end(path)
+        self._memory_chars += entry.size
+
+        while len(history) > self.max_entries_per_path:
+            self._drop(history.pop(0))
+        self._enforce_limits()
+
+    def undo(self, path: Path, current: str) -> str:
+        """Return the content path had before its last recorded edit."""
+        history = self._histories.get(path)
+        if not history:
+            raise ToolError(f"No edit history found for {path}.")
+
+        entry = history[-1]
+        if entry.after_digest is not None and _digest(current) != entry.after_digest:
+            raise ToolError(
+                f"{path} has been modified since its last edit, so the edit cannot be undone."
+            )
+
+        text = self._load(entry)
+        history.pop()
+        if not history:
+            del self._histories[path]
+        self._drop(entry)
+        if entry.after_digest is None:
+            return text
+        return current[: entry.start] + text + current[entry.end :]
+
+    def clear(self) -> None:
+        """Forget every history and remove spilled diffs."""
+        self._histories.clear()
+        self._memory_chars = self._disk_chars = 0
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+            self._spill_dir = None
+
+    def _enforce_limits(self) -> None:
+        """Spill, then drop, the oldest diffs of the least recently used paths."""
+        if self._memory_chars <= self.max_memory_chars:
+            return
+        for history in self._histories.values():
+            for entry in history:
+                if self._memory_chars <= self.max_memory_chars:
+                    break
+                if entry.text is not None:
+                    self._spill(entry)
+
+        if self._disk_chars <= self.max_disk_chars:
+            return
+        for path, history in list(self._histories.items()):
+            while history and self._disk_chars > self.max_disk_chars:
+                if history[0].spill_file is None:
+                    break
+                self._drop(history.pop(0))
+            if not history:
+                del self._histories[path]
+
+    def _spill(self, entry: _JournalEntry) -> None:
+        if self._spill_dir is None:
+            self._spill_dir = Path(tempfile.mkdtemp(prefix="openmanus-undo-"))
+            self._finalizer = weakref.finalize(
+                self, shutil.rmtree, self._spill_dir, True
+            )
+        self._spill_count += 1
+        spill_file = self._spill_dir / f"{self._spill_count}.diff"
+        try:
+            spill_file.write_text(entry.text, encoding="utf-8")
+        except OSError:
+            return  # Keep it in memory rather than lose it
+        entry.spill_file = spill_file
+        entry.text = None
+        self._memory_chars -= entry.size
+        self._disk_chars += entry.size
+
+    def _load(self, entry: _JournalEntry) -> str:
+        if entry.text is not None:
+            return entry.text
+        try:
+            return entry.spill_file.read_text(encoding="utf-8")
+        except OSError as e:
+            raise ToolError(f"Ran into {e} while trying to read the edit history")
+
+    def _drop(self, entry: _JournalEntry) -> None:
+        if entry.spill_file is None:
+            self._memory_chars -= entry.size
+            return
+        self._disk_chars -= entry.size
+        entry.spill_file.unlink(missing_ok=True)
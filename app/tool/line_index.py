@@ -0,0 +1,104 @@
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+# Newlines are counted per block, so locating a line scans at most one block
+BLOCK_SIZE = 64 * 1024
+
+# Number of file indexes kept around between views
+MAX_CACHED_INDEXES = 16
+
+
+class LineIndex:
+    """Sparse line-offset index of a file, read through mmap.
+
+    The index records how many newlines precede each block of `BLOCK_SIZE`
+    bytes, which takes one pass over the file and O(size / BLOCK_SIZE) memory.
+    Finding where a line starts then scans a single block, so reading a range
+    of lines costs time and memory proportional to the range, not the file.
+    Lines are numbered like `text.split("\\n")`, starting at 1.
+    """
+
+    def __init__(self, path: Path, mtime_ns: int, size: int):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self._newlines_before = array("q", [0])
+        if size:
+            with open(path, "rb") as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mm:
+                total = 0
+                for offset in range(0, size, BLOCK_SIZE):
+                    total += mm[offset : offset + BLOCK_SIZE].count(b"\n")
+                    self._newlines_before.append(total)
+        self.line_count = self._newlines_before[-1] + 1
+
+    def _line_start(self, mm: mmap.mmap, line: int) -> int:
+        """Byte offset at which a line (1-based) starts."""
+        if line <= 1:
+            return 0
+        # The line starts after newline number line - 1; find its block
+        newline = line - 1
+        block = bisect_right(self._newlines_before, newline - 1) - 1
+        position = block * BLOCK_SIZE
+        for _ in range(newline - self._newlines_before[block]):
+            position = mm.find(b"\n", position) + 1
+        return position
+
+    def read(
+        self, init_line: int, final_line: int = -1, max_chars: Optional[int] = None
+    ) -> str:
+        """Return lines init_line to final_line (inclusive, -1 for the end)
+        joined by newlines. With max_chars, text far beyond that length is not
+        read, so the result may be cut short (but is longer than max_chars)."""
+        if not self.size:
+            return ""
+        with open(self.path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            start = self._line_start(mm, init_line)
+            if final_line == -1 or final_line >= self.line_count:
+                end = self.size
+            else:
+                end = self._line_start(mm, final_line + 1) - 1
+                if end > start and mm[end - 1] == ord("\r"):
+                    end -= 1  # The line ends with \r\n
+            if max_chars is not None:
+                # A UTF-8 character takes at most 4 bytes
+                end = min(end, start + (max_chars + 2) * 4)
+            text = mm[start:end].decode("utf-8", errors="ignore")
+        return text.replace("\r\n", "\n")
+
+
+_indexes: "OrderedDict[Path, LineIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _file_state(path: Path) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_line_index(path: Path) -> LineIndex:
+    """Return the line index of path, rebuilding it if the file has changed."""
+    mtime_ns, size = _file_state(path)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is not None and (index.mtime_ns, index.size) == (mtime_ns, size):
+            _indexes.move_to_end(path)
+            return index
+
+    index = LineIndex(path, mtime_ns, size)
+    with _indexes_lock:
+        _indexes[path] = index
+        _indexes.move_to_end(path)
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
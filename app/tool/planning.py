@@ -1,5 +1,9 @@
 # tool/planning.py
-from typing import Dict, List, Literal, Optional
+import heapq
+from collections import Counter
+from typing import Collection, Dict, List, Literal, Optional
+
+from pydantic import PrivateAttr
 
 from app.exceptions import ToolError
 from app.tool.base import BaseTool, ToolResult
@@ -10,6 +14,123 @@ A planning tool that allows the agent to create and manage plans for solving com
 The tool provides functionality for creating plans, updating plan steps, and tracking progress.
 """
 
+_PENDING_STATUSES = ("not_started", "in_progress")
+
+_STATUS_SYMBOLS = {
+    "not_started": "[ ]",
+    "in_progress": "[→]",
+    "completed": "[✓]",
+    "blocked": "[!]",
+}
+
+
+def _step_status(plan: Dict, step_index: int) -> str:
+    statuses = plan["step_statuses"]
+    return statuses[step_index] if step_index < len(statuses) else "not_started"
+
+
+def _render_step(plan: Dict, step_index: int, status: Optional[str] = None) -> str:
+    """Render one step of a plan with its status, dependencies and notes."""
+    status = status or _step_status(plan, step_index)
+    output = f"{step_index}. {_STATUS_SYMBOLS.get(status, '[ ]')} {plan['steps'][step_index]}\n"
+    dependencies = plan.get("step_dependencies")
+    if dependencies and step_index < len(dependencies) and dependencies[step_index]:
+        output += f"   Depends on: {', '.join(map(str, dependencies[step_index]))}\n"
+    notes = plan["step_notes"]
+    if step_index < len(notes) and notes[step_index]:
+        output += f"   Notes: {notes[step_index]}\n"
+    return output
+
+
+class _PlanIndex:
+    """Incrementally maintained view of one plan.
+
+    Keeps a min-heap of the steps that still need work, step counts by status
+    and the rendered line of every step. A status change updates only the step
+    it touches, so finding the next step and rendering the plan no longer scan
+    and rebuild every step.
+    """
+
+    def __init__(self, plan: Dict):
+        self.plan = plan
+        self.statuses = [_step_status(plan, i) for i in range(len(plan["steps"]))]
+        self.counts = Counter(self.statuses)
+        # Indices ascend, so the list is already a valid heap
+        self.pending = [
+            i for i, status in enumerate(self.statuses) if status in _PENDING_STATUSES
+        ]
+        self.lines = [_render_step(plan, i) for i in range(len(plan["steps"]))]
+        self._text: Optional[str] = None
+
+    def refresh_step(self, step_index: int) -> None:
+        """Pick up a changed status or note of one step."""
+        status = _step_status(self.plan, step_index)
+        previous = self.statuses[step_index]
+        if status != previous:
+            self.counts[previous] -= 1
+            self.counts[status] += 1
+            self.statuses[step_index] = status
+            if previous not in _PENDING_STATUSES and status in _PENDING_STATUSES:
+                heapq.heappush(self.pending, step_index)
+        self.lines[step_index] = _render_step(self.plan, step_index)
+        self._text = None
+
+    def next_pending(self, skip: Collection[int] = ()) -> Optional[int]:
+        """Return the lowest step that still needs work, ignoring those in skip."""
+        skipped = []
+        try:
+            while self.pending:
+                step_index = self.pending[0]
+                if self.statuses[step_index] not in _PENDING_STATUSES:
+                    heapq.heappop(self.pending)  # Finished since it was queued
+                elif step_index in skip:
+                    skipped.append(heapq.heappop(self.pending))
+                else:
+                    return step_index
+            return None
+        finally:
+            for step_index in skipped:
+                heapq.heappush(self.pending, step_index)
+
+    def pending_steps(self) -> List[int]:
+        return sorted(
+            {i for i in self.pending if self.statuses[i] in _PENDING_STATUSES}
+        )
+
+    def render(self, status_overrides: Optional[Dict[int, str]] = None) -> str:
+        """Render the plan, optionally as if some steps had other statuses."""
+        if not status_overrides and self._text is not None:
+            return self._text
+
+        counts, lines = self.counts, self.lines
+        if status_overrides:
+            counts, lines = counts.copy(), list(lines)
+            for step_index, status in status_overrides.items():
+                counts[self.statuses[step_index]] -= 1
+                counts[status] += 1
+                lines[step_index] = _render_step(self.plan, step_index, status)
+
+        plan = self.plan
+        output = f"Plan: {plan['title']} (ID: {plan['plan_id']})\n"
+        output += "=" * len(output) + "\n\n"
+
+        total_steps = len(lines)
+        completed = counts["completed"]
+        output += f"Progress: {completed}/{total_steps} steps completed "
+        if total_steps > 0:
+            percentage = (completed / total_steps) * 100
+            output += f"({percentage:.1f}%)\n"
+        else:
+            output += "(0%)\n"
+
+        output += f"Status: {completed} completed, {counts['in_progress']} in progress, {counts['blocked']} blocked, {counts['not_started']} not started\n\n"
+        output += "Steps:\n"
+        output += "".join(lines)
+
+        if not status_overrides:
+            self._text = output
+        return output
+
 
 class PlanningTool(BaseTool):
     """
@@ -61,6 +182,11 @@ class PlanningTool(BaseTool):
                 "description": "Additional notes for a step. Optional for mark_step command.",
                 "type": "string",
             },
+            "step_dependencies": {
+                "description": "Indices of the earlier steps each step depends on, one list per step (e.g. [[], [], [0, 1]]). Steps whose dependencies are completed may run in parallel. Optional for create and update commands; without it steps run in order.",
+                "type": "array",
+                "items": {"type": "array", "items": {"type": "integer"}},
+            },
         },
         "required": ["command"],
         "additionalProperties": False,
@@ -68,6 +194,7 @@ class PlanningTool(BaseTool):
 
     plans: dict = {}  # Dictionary to store plans by plan_id
     _current_plan_id: Optional[str] = None  # Track the current active plan
+    _indexes: Dict[str, _PlanIndex] = PrivateAttr(default_factory=dict)
 
     async def execute(
         self,
@@ -83,6 +210,7 @@ class PlanningTool(BaseTool):
             Literal["not_started", "in_progress", "completed", "blocked"]
         ] = None,
         step_notes: Optional[str] = None,
+        step_dependencies: Optional[List[List[int]]] = None,
         **kwargs,
     ):
         """
@@ -96,12 +224,13 @@ class PlanningTool(BaseTool):
         - step_index: Index of the step to update (used with mark_step command)
         - step_status: Status to set for a step (used with mark_step command)
         - step_notes: Additional notes for a step (used with mark_step command)
+        - step_dependencies: Indices of the steps each step depends on (used with create and update commands)
         """
 
         if command == "create":
-            return self._create_plan(plan_id, title, steps)
+            return self._create_plan(plan_id, title, steps, step_dependencies)
         elif command == "update":
-            return self._update_plan(plan_id, title, steps)
+            return self._update_plan(plan_id, title, steps, step_dependencies)
         elif command == "list":
             return self._list_plans()
         elif command == "get":
@@ -118,7 +247,11 @@ class PlanningTool(BaseTool):
             )
 
     def _create_plan(
-        self, plan_id: Optional[str], title: Optional[str], steps: Optional[List[str]]
+        self,
+        plan_id: Optional[str],
+        title: Optional[str],
+        steps: Optional[List[str]],
+        step_dependencies: Optional[List[List[int]]] = None,
     ) -> ToolResult:
         """Create a new plan with the given ID, title, and steps."""
         if not plan_id:
@@ -149,6 +282,10 @@ class PlanningTool(BaseTool):
             "step_statuses": ["not_started"] * len(steps),
             "step_notes": [""] * len(steps),
         }
+        if step_dependencies is not None:
+            plan["step_dependencies"] = self._validate_dependencies(
+                step_dependencies, len(steps), "create"
+            )
 
         self.plans[plan_id] = plan
         self._current_plan_id = plan_id  # Set as active plan
@@ -158,7 +295,11 @@ class PlanningTool(BaseTool):
         )
 
     def _update_plan(
-        self, plan_id: Optional[str], title: Optional[str], steps: Optional[List[str]]
+        self,
+        plan_id: Optional[str],
+        title: Optional[str],
+        steps: Optional[List[str]],
+        step_dependencies: Optional[List[List[int]]] = None,
     ) -> ToolResult:
         """Update an existing plan with new title or steps."""
         if not plan_id:
@@ -184,28 +325,78 @@ class PlanningTool(BaseTool):
             old_steps = plan["steps"]
             old_statuses = plan["step_statuses"]
             old_notes = plan["step_notes"]
+            old_dependencies = plan.get("step_dependencies")
 
             # Create new step statuses and notes
             new_statuses = []
             new_notes = []
+            new_dependencies = []
 
             for i, step in enumerate(steps):
                 # If the step exists at the same position in old steps, preserve status and notes
                 if i < len(old_steps) and step == old_steps[i]:
                     new_statuses.append(old_statuses[i])
                     new_notes.append(old_notes[i])
+                    new_dependencies.append(
+                        old_dependencies[i] if old_dependencies else []
+                    )
                 else:
                     new_statuses.append("not_started")
                     new_notes.append("")
+                    new_dependencies.append([])
 
             plan["steps"] = steps
             plan["step_statuses"] = new_statuses
             plan["step_notes"] = new_notes
+            if old_dependencies is not None:
+                plan["step_dependencies"] = new_dependencies
+
+        if step_dependencies is not None:
+            plan["step_dependencies"] = self._validate_dependencies(
+                step_dependencies, len(plan["steps"]), "update"
+            )
+
+        self.refresh_plan(plan_id)
 
         return ToolResult(
             output=f"Plan updated successfully: {plan_id}\n\n{self._format_plan(plan)}"
         )
 
+    @staticmethod
+    def _validate_dependencies(
+        step_dependencies: List[List[int]], step_count: int, command: str
+    ) -> List[List[int]]:
+        """Check that every step depends only on earlier steps of the plan."""
+        if (
+            not isinstance(step_dependencies, list)
+            or len(step_dependencies) != step_count
+        ):
+            raise ToolError(
+                f"Parameter `step_dependencies` must be a list with one list of step indices per step for command: {command}"
+            )
+
+        for i, dependencies in enumerate(step_dependencies):
+            if not isinstance(dependencies, list) or not all(
+                isinstance(index, int) and 0 <= index < i for index in dependencies
+            ):
+                raise ToolError(
+                    f"Invalid dependencies for step {i}: {dependencies}. A step may only depend on earlier steps."
+                )
+
+        return [sorted(set(dependencies)) for dependencies in step_dependencies]
+
+    @staticmethod
+    def step_dependencies(plan: Dict, step_index: int) -> List[int]:
+        """Return the steps that must be completed before a step can start.
+
+        Plans created without dependencies run in order, so each of their steps
+        depends on the one before it.
+        """
+        dependencies = plan.get("step_dependencies")
+        if dependencies is None:
+            return [step_index - 1] if step_index > 0 else []
+        return dependencies[step_index] if step_index < len(dependencies) else []
+
     def _list_plans(self) -> ToolResult:
         """List all available plans."""
         if not self.plans:
@@ -216,9 +407,7 @@ class PlanningTool(BaseTool):
         output = "Available plans:\n"
         for plan_id, plan in self.plans.items():
             current_marker = " (active)" if plan_id == self._current_plan_id else ""
-            completed = sum(
-                1 for status in plan["step_statuses"] if status == "completed"
-            )
+            completed = self._index(plan_id).counts["completed"]
             total = len(plan["steps"])
             progress = f"{completed}/{total} steps completed"
             output += f"• {plan_id}{current_marker}: {plan['title']} - {progress}\n"
@@ -299,6 +488,8 @@ class PlanningTool(BaseTool):
         if step_notes:
             plan["step_notes"][step_index] = step_notes
 
+        self._index(plan_id).refresh_step(step_index)
+
         return ToolResult(
             output=f"Step {step_index} updated in plan '{plan_id}'.\n\n{self._format_plan(plan)}"
         )
@@ -312,6 +503,7 @@ class PlanningTool(BaseTool):
             raise ToolError(f"No plan found with ID: {plan_id}")
 
         del self.plans[plan_id]
+        self._indexes.pop(plan_id, None)
 
         # If the deleted plan was the active plan, clear the active plan
         if self._current_plan_id == plan_id:
@@ -319,45 +511,39 @@ class PlanningTool(BaseTool):
 
         return ToolResult(output=f"Plan '{plan_id}' has been deleted.")
 
-    def _format_plan(self, plan: Dict) -> str:
-        """Format a plan for display."""
-        output = f"Plan: {plan['title']} (ID: {plan['plan_id']})\n"
-        output += "=" * len(output) + "\n\n"
-
-        # Calculate progress statistics
-        total_steps = len(plan["steps"])
-        completed = sum(1 for status in plan["step_statuses"] if status == "completed")
-        in_progress = sum(
-            1 for status in plan["step_statuses"] if status == "in_progress"
-        )
-        blocked = sum(1 for status in plan["step_statuses"] if status == "blocked")
-        not_started = sum(
-            1 for status in plan["step_statuses"] if status == "not_started"
-        )
+    def _index(self, plan_id: str) -> _PlanIndex:
+        """Return the index of a plan, (re)building it if the plan was replaced."""
+        plan = self.plans[plan_id]
+        index = self._indexes.get(plan_id)
+        if (
+            index is None
+            or index.plan is not plan
+            or len(index.lines) != len(plan["steps"])
+        ):
+            index = self._indexes[plan_id] = _PlanIndex(plan)
+        return index
 
-        output += f"Progress: {completed}/{total_steps} steps completed "
-        if total_steps > 0:
-            percentage = (completed / total_steps) * 100
-            output += f"({percentage:.1f}%)\n"
-        else:
-            output += "(0%)\n"
+    def refresh_plan(self, plan_id: str) -> None:
+        """Rebuild the index of a plan whose data was modified directly."""
+        self._indexes.pop(plan_id, None)
 
-        output += f"Status: {completed} completed, {in_progress} in progress, {blocked} blocked, {not_started} not started\n\n"
-        output += "Steps:\n"
+    def next_step(self, plan_id: str, skip: Collection[int] = ()) -> Optional[int]:
+        """Return the first step of a plan that is not started or in progress."""
+        return self._index(plan_id).next_pending(skip)
 
-        # Add each step with its status and notes
-        for i, (step, status, notes) in enumerate(
-            zip(plan["steps"], plan["step_statuses"], plan["step_notes"])
-        ):
-            status_symbol = {
-                "not_started": "[ ]",
-                "in_progress": "[→]",
-                "completed": "[✓]",
-                "blocked": "[!]",
-            }.get(status, "[ ]")
+    def pending_steps(self, plan_id: str) -> List[int]:
+        """Return the steps of a plan that are not started or in progress."""
+        return self._index(plan_id).pending_steps()
 
-            output += f"{i}. {status_symbol} {step}\n"
-            if notes:
-                output += f"   Notes: {notes}\n"
+    def format_plan(
+        self, plan_id: str, status_overrides: Optional[Dict[int, str]] = None
+    ) -> str:
+        """Format a plan for display, optionally with some statuses replaced."""
+        return self._index(plan_id).render(status_overrides)
 
-        return output
+    def _format_plan(self, plan: Dict) -> str:
+        """Format a plan for display."""
+        plan_id = plan["plan_id"]
+        if self.plans.get(plan_id) is plan:
+            return self._index(plan_id).render()
+        return _PlanIndex(plan).render()
@@ -1,9 +1,246 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
 import threading
-from typing import Dict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from typing import Deque, Dict, List, Optional, Tuple
 
+from app.logger import logger
 from app.tool.base import BaseTool
 
 
+# Imported once when a worker starts so runs do not pay for them
+_PRELOADED_MODULES = (
+    "collections",
+    "datetime",
+    "itertools",
+    "json",
+    "math",
+    "random",
+    "re",
+    "statistics",
+    "string",
+    "time",
+)
+
+
+# Runs the worker script by path, so neither the host's __main__ nor the app
+# package is imported in the worker
+_WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), "_python_worker.py")
+_BOOTSTRAP = "import runpy, sys; runpy.run_path(sys.argv.pop(1), run_name='__main__')"
+
+
+class _PythonWorker:
+    """A pre-started interpreter process that executes code sent over a socket."""
+
+    def __init__(self):
+        parent_sock, child_sock = socket.socketpair()
+        with parent_sock, child_sock:
+            self.process = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-c",
+                    _BOOTSTRAP,
+                    _WORKER_SCRIPT,
+                    str(child_sock.fileno()),
+                    *_PRELOADED_MODULES,
+                ],
+                pass_fds=[child_sock.fileno()],
+                stdin=subprocess.DEVNULL,
+            )
+            self.conn = Connection(parent_sock.detach())
+        self.runs = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self) -> None:
+        if self.alive:
+            self.process.kill()
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+        self.conn.close()
+
+
+class _Slots:
+    """A counting semaphore that coroutines on any event loop can wait on
+    without holding a thread while they wait."""
+
+    def __init__(self, value: int):
+        self._lock = threading.Lock()
+        self._value = value
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter not in self._waiters
+                if not granted:
+                    self._waiters.remove(waiter)
+            # A slot handed over before the cancellation must be passed on; if
+            # the hand-over is still pending, _grant does that instead
+            if granted and waiter[1].done() and not waiter[1].cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(self._grant, future)
+                    return
+                except RuntimeError:
+                    continue  # The waiter's loop has been closed
+            self._value += 1
+
+    def _grant(self, future: asyncio.Future) -> None:
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+
+async def _wait_readable(conn, timeout: float) -> bool:
+    """Wait until conn has data (or is closed) without blocking a thread."""
+    loop = asyncio.get_running_loop()
+    readable = loop.create_future()
+    fd = conn.fileno()
+    loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+    try:
+        async with asyncio.timeout(timeout):
+            await readable
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(fd)
+
+
+class PythonWorkerPool:
+    """A bounded pool of warm Python worker processes.
+
+    Each run gets a worker to itself, so stdout capture never interleaves between
+    concurrent runs. A worker that exceeds its timeout is killed and replaced,
+    and workers are recycled after `max_runs_per_worker` runs. The pool is not
+    tied to an event loop and can be shared by agents running on different
+    loops.
+    """
+
+    def __init__(self, size: int = 4, max_runs_per_worker: int = 50):
+        self.size = size
+        self.max_runs_per_worker = max_runs_per_worker
+
+        self._lock = threading.Lock()
+        self._slots = _Slots(size)
+        self._idle: List[_PythonWorker] = []
+        # Starting a worker blocks, so it runs on threads of the pool's own
+        self._spawner = ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix="python_worker_spawn"
+        )
+
+    async def warm_up(self) -> None:
+        """Start idle workers up to the pool size."""
+        with self._lock:
+            missing = self.size - len(self._idle)
+        workers = await asyncio.gather(*(self._spawn() for _ in range(missing)))
+        with self._lock:
+            self._idle.extend(workers)
+            surplus = self._idle[self.size :]
+            del self._idle[self.size :]
+        for worker in surplus:
+            worker.kill()
+
+    async def run(self, code: str, timeout: float) -> Dict:
+        """Execute code in a worker and return its observation."""
+        await self._slots.acquire()
+        try:
+            worker = self._checkout() or await self._spawn()
+            result = await self._run_in_worker(worker, code, timeout)
+        finally:
+            self._slots.release()
+        return result
+
+    async def _spawn(self) -> _PythonWorker:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._spawner, _PythonWorker
+        )
+
+    def _checkout(self) -> Optional[_PythonWorker]:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive:
+                    return worker
+                worker.kill()
+        return None
+
+    def _checkin(self, worker: _PythonWorker) -> None:
+        if worker.runs >= self.max_runs_per_worker:
+            worker.kill()
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    async def _run_in_worker(
+        self, worker: _PythonWorker, code: str, timeout: float
+    ) -> Dict:
+        try:
+            worker.conn.send(code)
+            ready = await _wait_readable(worker.conn, timeout)
+            if not ready:
+                worker.kill()
+                return {
+                    "observation": f"Execution timeout after {timeout} seconds",
+                    "success": False,
+                }
+            result = worker.conn.recv()
+        except asyncio.CancelledError:
+            worker.kill()
+            raise
+        except (EOFError, OSError) as e:
+            logger.warning(f"Python worker exited unexpectedly: {e}")
+            worker.kill()
+            return {
+                "observation": "Python process exited unexpectedly",
+                "success": False,
+            }
+
+        worker.runs += 1
+        self._checkin(worker)
+        return result
+
+
+_pool: Optional[PythonWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> PythonWorkerPool:
+    """Return the process-wide worker pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PythonWorkerPool()
+    return _pool
+
+
 class PythonExecute(BaseTool):
     """A tool for executing Python code with timeout and safety restrictions."""
 
@@ -19,6 +256,11 @@ class PythonExecute(BaseTool):
         },
         "required": ["code"],
     }
+    parallel_safe: bool = True
+
+    async def prepare(self) -> None:
+        """Start the worker processes before the first run."""
+        await get_worker_pool().warm_up()
 
     async def execute(
         self,
@@ -35,36 +277,4 @@ class PythonExecute(BaseTool):
         Returns:
             Dict: Contains 'output' with execution output or error message and 'success' status.
         """
-        result = {"observation": ""}
-
-        def run_code():
-            try:
-                safe_globals = {"__builtins__": dict(__builtins__)}
-
-                import sys
-                from io import StringIO
-
-                output_buffer = StringIO()
-                sys.stdout = output_buffer
-
-                exec(code, safe_globals, {})
-
-                sys.stdout = sys.__stdout__
-
-                result["observation"] = output_buffer.getvalue()
-
-            except Exception as e:
-                result["observation"] = str(e)
-                result["success"] = False
-
-        thread = threading.Thread(target=run_code)
-        thread.start()
-        thread.join(timeout)
-
-        if thread.is_alive():
-            return {
-                "observation": f"Execution timeout after {timeout} seconds",
-                "success": False,
-            }
-
-        return result
+        return await get_worker_pool().run(code, timeout)
@@ -1,11 +1,17 @@
-from collections import defaultdict
+import os
+import shutil
+import tempfile
 from pathlib import Path
-from typing import Literal, get_args
+from typing import List, Literal, Tuple, get_args
+
+from pydantic import PrivateAttr
 
 from app.exceptions import ToolError
 from app.tool import BaseTool
 from app.tool.base import CLIResult, ToolResult
-from app.tool.run import run
+from app.tool.directory_tree import list_directory
+from app.tool.edit_journal import EditJournal
+from app.tool.line_index import get_line_index
 
 
 Command = Literal[
@@ -13,17 +19,25 @@ Command = Literal[
     "create",
     "str_replace",
     "insert",
+    "batch_edit",
     "undo_edit",
 ]
 SNIPPET_LINES: int = 4
 
 MAX_RESPONSE_LEN: int = 16000
 
+# Files at least this large are viewed through a cached line index instead of being read whole
+LINE_INDEX_MIN_SIZE: int = 1024 * 1024
+
 TRUNCATED_MESSAGE: str = "<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
 
+# mkstemp creates files only their owner can read; created files get the usual mode
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 _STR_REPLACE_EDITOR_DESCRIPTION = """Custom editing tool for viewing, creating and editing files
 * State is persistent across command calls and discussions with the user
-* If `path` is a file, `view` displays the result of applying `cat -n`. If `path` is a directory, `view` lists non-hidden files and directories up to 2 levels deep
+* If `path` is a file, `view` displays the result of applying `cat -n`. If `path` is a directory, `view` lists non-hidden files and directories up to 2 levels deep, skipping .gitignore'd entries and dependency directories such as node_modules, and listing at most 50 entries per directory
 * The `create` command cannot be used if the specified `path` already exists as a file
 * If a `command` generates a long output, it will be truncated and marked with `<response clipped>`
 * The `undo_edit` command will revert the last edit made to the file at `path`
@@ -32,6 +46,10 @@ Notes for using the `str_replace` command:
 * The `old_str` parameter should match EXACTLY one or more consecutive lines from the original file. Be mindful of whitespaces!
 * If the `old_str` parameter is not unique in the file, the replacement will not be performed. Make sure to include enough context in `old_str` to make it unique
 * The `new_str` parameter should contain the edited lines that should replace the `old_str`
+
+Notes for using the `batch_edit` command:
+* `edits` is an ordered list of `str_replace` and `insert` edits to the file at `path`, applied in one pass; each edit sees the file as left by the previous ones
+* Either every edit is applied or, if any of them fails, none is; a single `undo_edit` reverts the whole batch
 """
 
 
@@ -53,8 +71,15 @@ class StrReplaceEditor(BaseTool):
         "type": "object",
         "properties": {
             "command": {
-                "description": "The commands to run. Allowed options are: `view`, `create`, `str_replace`, `insert`, `undo_edit`.",
-                "enum": ["view", "create", "str_replace", "insert", "undo_edit"],
+                "description": "The commands to run. Allowed options are: `view`, `create`, `str_replace`, `insert`, `batch_edit`, `undo_edit`.",
+                "enum": [
+                    "view",
+                    "create",
+                    "str_replace",
+                    "insert",
+                    "batch_edit",
+                    "undo_edit",
+                ],
                 "type": "string",
             },
             "path": {
@@ -82,11 +107,29 @@ class StrReplaceEditor(BaseTool):
                 "items": {"type": "integer"},
                 "type": "array",
             },
+            "edits": {
+                "description": "Required parameter of `batch_edit` command. Ordered list of edits, each an object with `command` (`str_replace` or `insert`) and the parameters of that command: `old_str` and optional `new_str`, or `insert_line` and `new_str`.",
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "command": {
+                            "enum": ["str_replace", "insert"],
+                            "type": "string",
+                        },
+                        "old_str": {"type": "string"},
+                        "new_str": {"type": "string"},
+                        "insert_line": {"type": "integer"},
+                    },
+                    "required": ["command"],
+                },
+            },
         },
         "required": ["command", "path"],
     }
 
-    _file_history: list = defaultdict(list)
+    # Undo history of the edits made through this editor instance
+    _journal: EditJournal = PrivateAttr(default_factory=EditJournal)
 
     async def execute(
         self,
@@ -98,6 +141,7 @@ class StrReplaceEditor(BaseTool):
         old_str: str | None = None,
         new_str: str | None = None,
         insert_line: int | None = None,
+        edits: list[dict] | None = None,
         **kwargs,
     ) -> str:
         _path = Path(path)
@@ -107,8 +151,8 @@ class StrReplaceEditor(BaseTool):
         elif command == "create":
             if file_text is None:
                 raise ToolError("Parameter `file_text` is required for command: create")
-            self.write_file(_path, file_text)
-            self._file_history[_path].append(file_text)
+            self._write_atomic(_path, file_text)
+            self._journal.record_snapshot(_path, file_text)
             result = ToolResult(output=f"File created successfully at: {_path}")
         elif command == "str_replace":
             if old_str is None:
@@ -124,6 +168,10 @@ class StrReplaceEditor(BaseTool):
             if new_str is None:
                 raise ToolError("Parameter `new_str` is required for command: insert")
             result = self.insert(_path, insert_line, new_str)
+        elif command == "batch_edit":
+            if not edits:
+                raise ToolError("Parameter `edits` is required for command: batch_edit")
+            result = self.batch_edit(_path, edits)
         elif command == "undo_edit":
             result = self.undo_edit(_path)
         else:
@@ -166,22 +214,34 @@ class StrReplaceEditor(BaseTool):
                     "The `view_range` parameter is not allowed when `path` points to a directory."
                 )
 
-            _, stdout, stderr = await run(
-                rf"find {path} -maxdepth 2 -not -path '*/\.*'"
+            listing = list_directory(path, max_depth=2)
+            return CLIResult(
+                output=f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden and ignored items:\n{listing}\n"
             )
-            if not stderr:
-                stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{stdout}\n"
-            return CLIResult(output=stdout, error=stderr)
 
-        file_content = self.read_file(path)
+        line_index = None
+        try:
+            if path.stat().st_size >= LINE_INDEX_MIN_SIZE:
+                line_index = get_line_index(path)
+        except Exception as e:
+            raise ToolError(f"Ran into {e} while trying to read {path}") from None
+
+        if line_index is None:
+            file_content = self.read_file(path)
+        elif not view_range:
+            file_content = line_index.read(1, -1, max_chars=MAX_RESPONSE_LEN)
+
         init_line = 1
         if view_range:
             if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
                 raise ToolError(
                     "Invalid `view_range`. It should be a list of two integers."
                 )
-            file_lines = file_content.split("\n")
-            n_lines_file = len(file_lines)
+            if line_index is None:
+                file_lines = file_content.split("\n")
+                n_lines_file = len(file_lines)
+            else:
+                n_lines_file = line_index.line_count
             init_line, final_line = view_range
             if init_line < 1 or init_line > n_lines_file:
                 raise ToolError(
@@ -196,7 +256,12 @@ class StrReplaceEditor(BaseTool):
                     f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be larger or equal than its first `{init_line}`"
                 )
 
-            if final_line == -1:
+            if line_index is not None:
+                # Only the requested window of the file is read
+                file_content = line_index.read(
+                    init_line, final_line, max_chars=MAX_RESPONSE_LEN
+                )
+            elif final_line == -1:
                 file_content = "\n".join(file_lines[init_line - 1 :])
             else:
                 file_content = "\n".join(file_lines[init_line - 1 : final_line])
@@ -212,6 +277,35 @@ class StrReplaceEditor(BaseTool):
         old_str = old_str.expandtabs()
         new_str = new_str.expandtabs() if new_str is not None else ""
 
+        new_file_content, replacement_line = self._replace_unique(
+            path, file_content, old_str, new_str
+        )
+
+        # Write the new content to the file
+        self._write_atomic(path, new_file_content)
+
+        # Save the reverse diff to history
+        self._journal.record(path, file_content, new_file_content)
+
+        # Create a snippet of the edited section
+        start_line = max(0, replacement_line - SNIPPET_LINES)
+        end_line = replacement_line + SNIPPET_LINES + new_str.count("\n")
+        snippet = "\n".join(new_file_content.split("\n")[start_line : end_line + 1])
+
+        # Prepare the success message
+        success_msg = f"The file {path} has been edited. "
+        success_msg += self._make_output(
+            snippet, f"a snippet of {path}", start_line + 1
+        )
+        success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
+
+        return CLIResult(output=success_msg)
+
+    def _replace_unique(
+        self, path: Path, file_content: str, old_str: str, new_str: str
+    ) -> Tuple[str, int]:
+        """Replace the single occurrence of old_str in file_content, returning the
+        new content and the (0-based) line where the replacement starts."""
         # Check if old_str is unique in the file
         occurrences = file_content.count(old_str)
         if occurrences == 0:
@@ -231,57 +325,27 @@ class StrReplaceEditor(BaseTool):
 
         # Replace old_str with new_str
         new_file_content = file_content.replace(old_str, new_str)
-
-        # Write the new content to the file
-        self.write_file(path, new_file_content)
-
-        # Save the content to history
-        self._file_history[path].append(file_content)
-
-        # Create a snippet of the edited section
-        replacement_line = file_content.split(old_str)[0].count("\n")
-        start_line = max(0, replacement_line - SNIPPET_LINES)
-        end_line = replacement_line + SNIPPET_LINES + new_str.count("\n")
-        snippet = "\n".join(new_file_content.split("\n")[start_line : end_line + 1])
-
-        # Prepare the success message
-        success_msg = f"The file {path} has been edited. "
-        success_msg += self._make_output(
-            snippet, f"a snippet of {path}", start_line + 1
-        )
-        success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
-
-        return CLIResult(output=success_msg)
+        replacement_line = file_content.count("\n", 0, file_content.index(old_str))
+        return new_file_content, replacement_line
 
     def insert(self, path: Path, insert_line: int, new_str: str):
         """Implement the insert command, which inserts new_str at the specified line in the file content."""
         file_text = self.read_file(path).expandtabs()
         new_str = new_str.expandtabs()
         file_text_lines = file_text.split("\n")
-        n_lines_file = len(file_text_lines)
-
-        if insert_line < 0 or insert_line > n_lines_file:
-            raise ToolError(
-                f"Invalid `insert_line` parameter: {insert_line}. It should be within the range of lines of the file: {[0, n_lines_file]}"
-            )
+        new_file_text = self._insert_lines(file_text_lines, insert_line, new_str)
 
         new_str_lines = new_str.split("\n")
-        new_file_text_lines = (
-            file_text_lines[:insert_line]
-            + new_str_lines
-            + file_text_lines[insert_line:]
-        )
         snippet_lines = (
             file_text_lines[max(0, insert_line - SNIPPET_LINES) : insert_line]
             + new_str_lines
             + file_text_lines[insert_line : insert_line + SNIPPET_LINES]
         )
 
-        new_file_text = "\n".join(new_file_text_lines)
         snippet = "\n".join(snippet_lines)
 
-        self.write_file(path, new_file_text)
-        self._file_history[path].append(file_text)
+        self._write_atomic(path, new_file_text)
+        self._journal.record(path, file_text, new_file_text)
 
         success_msg = f"The file {path} has been edited. "
         success_msg += self._make_output(
@@ -292,13 +356,107 @@ class StrReplaceEditor(BaseTool):
         success_msg += "Review the changes and make sure they are as expected (correct indentation, no duplicate lines, etc). Edit the file again if necessary."
         return CLIResult(output=success_msg)
 
+    def _insert_lines(
+        self, file_text_lines: List[str], insert_line: int, new_str: str
+    ) -> str:
+        """Return the text of file_text_lines with new_str inserted after insert_line."""
+        n_lines_file = len(file_text_lines)
+        if insert_line < 0 or insert_line > n_lines_file:
+            raise ToolError(
+                f"Invalid `insert_line` parameter: {insert_line}. It should be within the range of lines of the file: {[0, n_lines_file]}"
+            )
+
+        new_file_text_lines = (
+            file_text_lines[:insert_line]
+            + new_str.split("\n")
+            + file_text_lines[insert_line:]
+        )
+        return "\n".join(new_file_text_lines)
+
+    def batch_edit(self, path: Path, edits: list[dict]):
+        """Implement the batch_edit command, which applies several str_replace and insert
+        edits to the file in memory and writes the result once, or not at all if any edit fails.
+        """
+        file_content = self.read_file(path).expandtabs()
+        new_file_content = file_content
+        # Line range (start, number of lines) of each edit in the current content
+        edited_ranges: List[List[int]] = []
+
+        for i, edit in enumerate(edits, start=1):
+            try:
+                if not isinstance(edit, dict):
+                    raise ToolError("Each edit must be an object.")
+                edit_command = edit.get("command")
+                new_str = edit.get("new_str")
+                new_str = new_str.expandtabs() if new_str is not None else ""
+                n_lines_before = new_file_content.count("\n")
+
+                if edit_command == "str_replace":
+                    if edit.get("old_str") is None:
+                        raise ToolError(
+                            "Parameter `old_str` is required for str_replace."
+                        )
+                    new_file_content, start = self._replace_unique(
+                        path, new_file_content, edit["old_str"].expandtabs(), new_str
+                    )
+                elif edit_command == "insert":
+                    insert_line = edit.get("insert_line")
+                    if not isinstance(insert_line, int):
+                        raise ToolError(
+                            "Parameter `insert_line` is required for insert."
+                        )
+                    if edit.get("new_str") is None:
+                        raise ToolError("Parameter `new_str` is required for insert.")
+                    new_file_content = self._insert_lines(
+                        new_file_content.split("\n"), insert_line, new_str
+                    )
+                    start = insert_line
+                else:
+                    raise ToolError(
+                        f"Unrecognized edit command {edit_command}. Allowed: str_replace, insert."
+                    )
+            except ToolError as e:
+                raise ToolError(
+                    f"Edit {i} of batch_edit failed, so no edits were applied to {path}: {e.message}"
+                ) from None
+
+            # Shift the ranges of earlier edits that lie after this one
+            line_delta = new_file_content.count("\n") - n_lines_before
+            for edited_range in edited_ranges:
+                if edited_range[0] > start:
+                    edited_range[0] += line_delta
+            edited_ranges.append([start, new_str.count("\n") + 1])
+
+        self._write_atomic(path, new_file_content)
+        self._journal.record(path, file_content, new_file_content)
+
+        # Show the edited regions, merging those whose snippets overlap
+        windows: List[List[int]] = []
+        for start, n_lines in sorted(edited_ranges):
+            window = [max(0, start - SNIPPET_LINES), start + n_lines + SNIPPET_LINES]
+            if windows and window[0] <= windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], window[1])
+            else:
+                windows.append(window)
+        new_file_lines = new_file_content.split("\n")
+
+        success_msg = f"The file {path} has been edited with {len(edits)} edits. "
+        for start_line, end_line in windows:
+            success_msg += self._make_output(
+                "\n".join(new_file_lines[start_line:end_line]),
+                f"a snippet of {path}",
+                start_line + 1,
+            )
+        success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
+        return CLIResult(output=maybe_truncate(success_msg))
+
     def undo_edit(self, path: Path):
         """Implement the undo_edit command."""
-        if not self._file_history[path]:
+        if path not in self._journal:
             raise ToolError(f"No edit history found for {path}.")
 
-        old_text = self._file_history[path].pop()
-        self.write_file(path, old_text)
+        old_text = self._journal.undo(path, self.read_file(path))
+        self._write_atomic(path, old_text)
 
         return CLIResult(
             output=f"Last edit to {path} undone successfully. {self._make_output(old_text, str(path))}"
@@ -311,10 +469,24 @@ class StrReplaceEditor(BaseTool):
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to read {path}") from None
 
-    def write_file(self, path: Path, file: str):
-        """Write the content of a file to a given path; raise a ToolError if an error occurs."""
+    def _write_atomic(self, path: Path, file: str):
+        """Write a file through a temporary file renamed over it, so readers never
+        see it half written; raise a ToolError if an error occurs."""
         try:
-            path.write_text(file)
+            # Replace the target of a symlink rather than the link itself
+            path = path.resolve()
+            fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(file)
+                if path.exists():
+                    shutil.copymode(path, temp_path)
+                else:
+                    os.chmod(temp_path, 0o666 & ~_UMASK)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to write to {path}") from None
 
@@ -3,6 +3,7 @@ from typing import Any, Dict, List
 
 from app.exceptions import ToolError
 from app.tool.base import BaseTool, ToolFailure, ToolResult
+from app.tracing import get_tracer
 
 
 class ToolCollection:
@@ -24,11 +25,21 @@ class ToolCollection:
         tool = self.tool_map.get(name)
         if not tool:
             return ToolFailure(error=f"Tool {name} is invalid")
-        try:
-            result = await tool(**tool_input)
+        with get_tracer().span("tool.execute", kind="tool", tool=name) as span:
+            try:
+                result = await tool(**tool_input)
+            except ToolError as e:
+                span.record_error(e.message)
+                return ToolFailure(error=e.message)
+            output = result
+            if isinstance(result, ToolResult):
+                output = result.output
+                if result.error:
+                    span.record_error(result.error)
+            span.set_attribute(
+                "output_chars", len(str(output)) if output is not None else 0
+            )
             return result
-        except ToolError as e:
-            return ToolFailure(error=e.message)
 
     async def execute_all(self) -> List[ToolResult]:
         """Execute all tools in the collection sequentially."""
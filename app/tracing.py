@@ -0,0 +1,305 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+from app.config import PROJECT_ROOT, TracingSettings, config
+from app.logger import logger
+
+
+class Span:
+    """A timed operation in an agent run, e.g. a step, an LLM call or a tool call."""
+
+    __slots__ = (
+        "name",
+        "kind",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start_time",
+        "end_time",
+        "attributes",
+        "status",
+        "error",
+        "_started",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        kind: str,
+        parent: Optional["Span"] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.name = name
+        self.kind = kind
+        self.span_id = os.urandom(8).hex()
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+
+    @property
+    def duration(self) -> float:
+        """Seconds elapsed since the span started, or its total once ended."""
+        if self.end_time is not None:
+            return self.end_time - self.start_time
+        return self.elapsed()
+
+    def elapsed(self) -> float:
+        """Seconds since the span started, measured with a monotonic clock."""
+        return time.perf_counter() - self._started
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def increment(self, key: str, amount: int = 1) -> None:
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def record_error(self, error: Union[BaseException, str]) -> None:
+        self.status = "error"
+        if isinstance(error, BaseException):
+            error = f"{type(error).__name__}: {error}"
+        self.error = error
+
+    def end(self) -> None:
+        if self.end_time is None:
+            self.end_time = self.start_time + self.elapsed()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": self.duration,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan(Span):
+    """Stand-in handed out while tracing is disabled; records nothing."""
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, **attributes: Any) -> None:
+        pass
+
+    def increment(self, key: str, amount: int = 1) -> None:
+        pass
+
+    def record_error(self, error: Union[BaseException, str]) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan("noop", "noop")
+
+
+class SpanExporter:
+    """Receives spans as they start and end."""
+
+    def on_start(self, span: Span) -> None:
+        """Called when a span starts. No-op by default."""
+
+    def on_end(self, span: Span) -> None:
+        """Called once a span has ended."""
+
+    def shutdown(self) -> None:
+        """Flush and release resources. No-op by default."""
+
+
+class JsonlExporter(SpanExporter):
+    """Appends every finished span as one JSON line to a local file."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = path.open("a", encoding="utf-8")
+
+    def on_end(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class OpenTelemetryExporter(SpanExporter):
+    """Mirrors spans into OpenTelemetry so any configured OTel backend receives them.
+
+    Requires the `opentelemetry-api` package; the SDK and exporter (e.g. OTLP)
+    are set up by the application through the global tracer provider.
+    """
+
+    def __init__(self, service_name: str = "openmanus"):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self._tracer = trace.get_tracer(service_name)
+        self._lock = threading.Lock()
+        self._spans: Dict[str, Any] = {}
+
+    def on_start(self, span: Span) -> None:
+        with self._lock:
+            parent = self._spans.get(span.parent_id)
+        context = self._trace.set_span_in_context(parent) if parent else None
+        otel_span = self._tracer.start_span(
+            span.name,
+            context=context,
+            start_time=int(span.start_time * 1e9),
+            attributes={"openmanus.kind": span.kind},
+        )
+        with self._lock:
+            self._spans[span.span_id] = otel_span
+
+    def on_end(self, span: Span) -> None:
+        with self._lock:
+            otel_span = self._spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        for key, value in span.attributes.items():
+            if isinstance(value, (str, bool, int, float)):
+                otel_span.set_attribute(key, value)
+        if span.status == "error":
+            otel_span.set_status(
+                self._trace.Status(self._trace.StatusCode.ERROR, span.error)
+            )
+        otel_span.end(end_time=int(span.end_time * 1e9))
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """Return the innermost active span of the current context."""
+    return _current_span.get()
+
+
+class Tracer:
+    """Creates spans and hands them to the configured exporters.
+
+    The active span is tracked per context, so concurrent agents and tool calls
+    running as separate tasks each build their own tree of spans.
+    """
+
+    def __init__(self, exporters: Optional[List[SpanExporter]] = None):
+        self.exporters: List[SpanExporter] = list(exporters or [])
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    @classmethod
+    def from_settings(cls, settings: TracingSettings) -> "Tracer":
+        """Create a tracer from the `[tracing]` configuration section."""
+        exporters: List[SpanExporter] = []
+        if not settings.enabled:
+            return cls(exporters)
+        if settings.jsonl_path:
+            path = Path(settings.jsonl_path)
+            if not path.is_absolute():
+                path = PROJECT_ROOT / path
+            exporters.append(JsonlExporter(path))
+        if settings.opentelemetry:
+            try:
+                exporters.append(OpenTelemetryExporter(settings.service_name))
+            except ImportError:
+                logger.warning(
+                    "OpenTelemetry tracing requested but opentelemetry-api is not installed"
+                )
+        return cls(exporters)
+
+    @contextmanager
+    def span(self, name: str, kind: str, **attributes: Any) -> Iterator[Span]:
+        """Record the enclosed block as a span nested in the current one."""
+        if not self.exporters:
+            yield _NOOP_SPAN
+            return
+        span = Span(name, kind, parent=_current_span.get(), attributes=attributes)
+        token = _current_span.set(span)
+        self._notify("on_start", span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+            self._notify("on_end", span)
+
+    def _notify(self, hook: str, span: Span) -> None:
+        for exporter in self.exporters:
+            try:
+                getattr(exporter, hook)(span)
+            except Exception as e:
+                logger.debug(f"Span exporter {type(exporter).__name__} failed: {e}")
+
+    def shutdown(self) -> None:
+        for exporter in self.exporters:
+            exporter.shutdown()
+
+
+def traced(name: str, kind: str) -> Callable:
+    """Decorate a coroutine function so each call is recorded as a span."""
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            tracer = get_tracer()
+            if not tracer.enabled:
+                return await func(*args, **kwargs)
+            with tracer.span(name, kind):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count_retry(retry_state) -> None:
+    """tenacity `before_sleep` hook that counts retries on the current span."""
+    span = _current_span.get()
+    if span is not None:
+        span.increment("retries")
+        outcome = retry_state.outcome
+        if outcome is not None and outcome.failed:
+            span.set_attribute("last_retry_error", str(outcome.exception()))
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Return the process-wide tracer, creating it on first use."""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer.from_settings(config.tracing)
+    return _tracer
@@ -0,0 +1,76 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from pydantic import BaseModel, PrivateAttr
+
+
+class TokenUsage(BaseModel):
+    """Running totals of LLM requests, tokens and cost."""
+
+    requests: int = 0
+    cached_requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+    # Ledger of the enclosing run, which receives every usage recorded here
+    _parent: Optional["TokenUsage"] = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(
+        self,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cost: float = 0.0,
+        cached: bool = False,
+    ) -> None:
+        """Record one request here and in every enclosing ledger."""
+        ledger = self
+        while ledger is not None:
+            with ledger._lock:
+                ledger.requests += 1
+                ledger.cached_requests += int(cached)
+                ledger.prompt_tokens += prompt_tokens
+                ledger.completion_tokens += completion_tokens
+                ledger.cost += cost
+            ledger = ledger._parent
+
+    def summary(self) -> str:
+        text = (
+            f"{self.requests} LLM requests ({self.cached_requests} cached), "
+            f"{self.prompt_tokens} prompt + {self.completion_tokens} completion "
+            f"= {self.total_tokens} tokens"
+        )
+        if self.cost:
+            text += f", cost {self.cost:.4f}"
+        return text
+
+
+_run_usage: ContextVar[Optional[TokenUsage]] = ContextVar("run_usage", default=None)
+
+
+def current_usage() -> Optional[TokenUsage]:
+    """Return the ledger of the run executing in the current context, if any."""
+    return _run_usage.get()
+
+
+@contextmanager
+def track_usage(nested: bool = True) -> Iterator[TokenUsage]:
+    """Collect the usage of LLM calls made in the enclosed block.
+
+    Ledgers nest: usage recorded inside an inner block (e.g. an agent run within
+    a flow) is also added to the outer one, unless nested is False.
+    """
+    usage = TokenUsage()
+    usage._parent = _run_usage.get() if nested else None
+    token = _run_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _run_usage.reset(token)
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import mimetypes
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from app.agent.manus import Manus
+from app.client_pool import client_pool
+from app.config import PROJECT_ROOT, config
+from app.logger import logger
+from app.tool.bash import aclose_session_pool
+from app.web.log_router import log_router
+from app.web.scheduler import QueueFullError, RunScheduler
+from app.web.store import RequestRecord, RequestStore
+
+
+FRONTEND_DIR = PROJECT_ROOT / "frontend"
+
+# Interval between SSE comments that keep idle connections open
+KEEPALIVE_INTERVAL = 15.0
+
+Scope = Dict
+Receive = Callable[[], Awaitable[Dict]]
+Send = Callable[[Dict], Awaitable[None]]
+
+
+class AgentRun:
+    """A request whose agent has not finished, and the listeners waiting on it."""
+
+    def __init__(self, record: RequestRecord, loop: asyncio.AbstractEventLoop):
+        self.record = record
+        self._loop = loop
+        self._changed = asyncio.Event()
+
+    def append(self, line: str) -> None:
+        """Add a log line; safe to call from any thread."""
+        self.record.append(line + "\n")
+        self.notify()
+
+    def notify(self) -> None:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wake()
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self, offset: int, timeout: float) -> None:
+        """Wait until there are logs past offset or the run completes."""
+        if offset < self.record.end_offset or self.record.completed:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class AgentServer:
+    """A dependency-free ASGI application that runs agents on the server loop.
+
+    Each `/api/execute` request is admitted by a `RunScheduler` and runs as a
+    task on the event loop uvicorn runs; `/api/metrics` reports its queue.
+    Log lines emitted inside that task are routed to its record in the
+    `RequestStore` by the shared `log_router`, and
+    `/api/stream/<id>` pushes them to the browser as Server-Sent Events, so each
+    client receives every line only once. `/api/status/<id>` keeps working for
+    polling clients and accepts an `offset` query parameter to fetch only the
+    logs it has not seen yet.
+    """
+
+    def __init__(self, agent_factory: Callable = Manus):
+        self.agent_factory = agent_factory
+        self.runs: Dict[str, AgentRun] = {}
+        self.scheduler: Optional[RunScheduler] = None
+        self.store: Optional[RequestStore] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._route(scope, receive, send)
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def startup(self) -> None:
+        self.scheduler = RunScheduler.from_settings(config.server)
+        self.store = RequestStore.from_settings(config.server)
+
+    async def shutdown(self) -> None:
+        if self.scheduler is not None:
+            await self.scheduler.shutdown()
+        for run in list(self.runs.values()):
+            self._finish(run, error="服务器已停止")
+        await client_pool.aclose_loop()
+        await aclose_session_pool()
+
+    async def _route(self, scope: Scope, receive: Receive, send: Send) -> None:
+        method, path = scope["method"], scope["path"]
+        query = parse_qs(scope.get("query_string", b"").decode())
+
+        if path == "/" and method == "GET":
+            await self._send_file(send, FRONTEND_DIR / "templates" / "index.html")
+        elif path.startswith("/static/") and method == "GET":
+            await self._send_static(send, path[len("/static/") :])
+        elif path == "/api/execute" and method == "POST":
+            await self._execute(receive, send)
+        elif path.startswith("/api/status/") and method == "GET":
+            record = self.store.get(path[len("/api/status/") :])
+            if record is None:
+                await self._send_json(send, {"error": "请求ID不存在"}, status=404)
+                return
+            offset = query.get("offset", [None])[0]
+            if offset is not None and not offset.isdigit():
+                await self._send_json(send, {"error": "offset无效"}, status=400)
+                return
+            await self._send_json(
+                send, record.status(int(offset) if offset is not None else None)
+            )
+        elif path == "/api/metrics" and method == "GET":
+            await self._send_json(send, self.scheduler.metrics())
+        elif path.startswith("/api/stream/") and method == "GET":
+            record = self.store.get(path[len("/api/stream/") :])
+            if record is None:
+                await self._send_json(send, {"error": "请求ID不存在"}, status=404)
+                return
+            await self._stream(scope, receive, send, record)
+        else:
+            await self._send_json(send, {"error": "Not found"}, status=404)
+
+    async def _execute(self, receive: Receive, send: Send) -> None:
+        try:
+            data = json.loads(await self._read_body(receive) or b"{}")
+        except ValueError:
+            await self._send_json(send, {"error": "请求体不是有效的JSON"}, status=400)
+            return
+        input_text = data.get("input", "") if isinstance(data, dict) else ""
+        if not input_text:
+            await self._send_json(send, {"error": "请提供输入内容"}, status=400)
+            return
+
+        record = self.store.create(str(uuid.uuid4()))
+        run = AgentRun(record, asyncio.get_running_loop())
+        priority = data.get("priority", "normal")
+        try:
+            self.scheduler.submit(lambda: self._run_agent(run, input_text), priority)
+        except ValueError:
+            self.store.discard(record.id)
+            await self._send_json(send, {"error": f"无效的优先级: {priority}"}, status=400)
+            return
+        except QueueFullError:
+            self.store.discard(record.id)
+            await self._send_json(send, {"error": "服务器繁忙，请稍后再试"}, status=429)
+            return
+        self.runs[record.id] = run
+        log_router.register(record.id, run.append)
+        await self._send_json(
+            send, {"request_id": record.id, "stream_url": f"/api/stream/{record.id}"}
+        )
+
+    async def _run_agent(self, run: AgentRun, input_text: str) -> None:
+        with logger.contextualize(request_id=run.record.id):
+            try:
+                logger.info(f"执行命令: {input_text}")
+                result = await self.agent_factory().run(input_text)
+            except asyncio.CancelledError:
+                self._finish(run, error="服务器已停止")
+                raise
+            except Exception as e:
+                logger.error(f"执行错误: {str(e)}")
+                self._finish(run, error=str(e))
+            else:
+                self._finish(run, result=result)
+
+    def _finish(
+        self, run: AgentRun, result: Optional[str] = None, error: Optional[str] = None
+    ) -> None:
+        if self.runs.pop(run.record.id, None) is None:
+            return
+        log_router.unregister(run.record.id)
+        self.store.finish(run.record.id, result=result, error=error)
+        run.notify()
+
+    async def _stream(
+        self, scope: Scope, receive: Receive, send: Send, record: RequestRecord
+    ) -> None:
+        headers = dict(scope.get("headers", []))
+        try:
+            offset = int(headers.get(b"last-event-id", b"0"))
+        except ValueError:
+            offset = 0
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        writer = asyncio.create_task(self._write_events(send, record, offset))
+        disconnect = asyncio.create_task(self._wait_for_disconnect(receive))
+        try:
+            await asyncio.wait(
+                {writer, disconnect}, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            for task in (writer, disconnect):
+                task.cancel()
+            await asyncio.gather(writer, disconnect, return_exceptions=True)
+        if writer.done() and not writer.cancelled() and writer.exception() is None:
+            await send({"type": "http.response.body", "body": b""})
+
+    async def _write_events(
+        self, send: Send, record: RequestRecord, offset: int
+    ) -> None:
+        """Send the logs after offset as they arrive, then the result."""
+        while True:
+            run = self.runs.get(record.id)
+            if run is not None:
+                await run.wait_for_change(offset, KEEPALIVE_INTERVAL)
+            completed = record.completed
+            logs, offset = record.read_logs(offset)
+            chunk = [self._event("log", logs, event_id=offset)] if logs else []
+            if completed:
+                chunk.append(self._event("result", record.outcome))
+                chunk.append(self._event("done", ""))
+            elif not chunk:
+                chunk.append(b": keepalive\n\n")
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": b"".join(chunk),
+                    "more_body": True,
+                }
+            )
+            if completed:
+                return
+
+    @staticmethod
+    def _event(name: str, data, event_id: Optional[int] = None) -> bytes:
+        event = f"event: {name}\n"
+        if event_id is not None:
+            event += f"id: {event_id}\n"
+        event += f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+        return event.encode("utf-8")
+
+    @staticmethod
+    async def _wait_for_disconnect(receive: Receive) -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    @staticmethod
+    async def _read_body(receive: Receive) -> bytes:
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return body
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return body
+
+    async def _send_static(self, send: Send, relative: str) -> None:
+        static_dir = (FRONTEND_DIR / "static").resolve()
+        path = (static_dir / relative).resolve()
+        if static_dir not in path.parents or not path.is_file():
+            await self._send_json(send, {"error": "Not found"}, status=404)
+            return
+        await self._send_file(send, path)
+
+    async def _send_file(self, send: Send, path: Path) -> None:
+        content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type.endswith("javascript"):
+            content_type += "; charset=utf-8"
+        body = await asyncio.to_thread(path.read_bytes)
+        await self._send(send, 200, body, [(b"content-type", content_type.encode())])
+
+    async def _send_json(self, send: Send, payload: Dict, status: int = 200) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await self._send(send, status, body, [(b"content-type", b"application/json")])
+
+    @staticmethod
+    async def _send(
+        send: Send, status: int, body: bytes, headers: List[Tuple[bytes, bytes]]
+    ) -> None:
+        headers = headers + [(b"content-length", str(len(body)).encode())]
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+app = AgentServer()
@@ -0,0 +1,70 @@
+import threading
+from typing import Callable, Dict, Optional
+
+from app.logger import logger
+
+
+LogTarget = Callable[[str], None]
+
+
+def format_log_record(record: Dict) -> str:
+    """Render a loguru record the way the web console shows it."""
+    time = record["time"].strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    return (
+        f"{time} | {record['level'].name:<8} | "
+        f"{record['name']}:{record['function']}:{record['line']} - {record['message']}"
+    )
+
+
+class LogRouter:
+    """Routes log records to the request that emitted them.
+
+    Code running on behalf of a request binds its id with
+    `logger.contextualize(request_id=...)`. The id lives in a context variable,
+    so it follows the context into tasks and `asyncio.to_thread` calls started
+    from there, but not into plain threads or `run_in_executor` calls, which
+    must run their work under `contextvars.copy_context().run` for its lines to
+    be routed. A single loguru sink looks that id up and hands the formatted
+    line to the target registered for it, so each line is formatted once and
+    delivered once however many requests are running. Records without a
+    registered request id are skipped before formatting.
+    """
+
+    def __init__(self, level: str = "INFO"):
+        self.level = level
+        self._lock = threading.Lock()
+        self._targets: Dict[str, LogTarget] = {}
+        self._sink_id: Optional[int] = None
+
+    def register(self, request_id: str, target: LogTarget) -> None:
+        """Send the log lines of request_id to target, installing the sink if needed."""
+        with self._lock:
+            self._targets[request_id] = target
+            if self._sink_id is None:
+                self._sink_id = logger.add(
+                    self._sink, level=self.level, filter=self._owned
+                )
+
+    def unregister(self, request_id: str) -> None:
+        with self._lock:
+            self._targets.pop(request_id, None)
+
+    def close(self) -> None:
+        """Remove the sink and forget every target."""
+        with self._lock:
+            self._targets.clear()
+            if self._sink_id is not None:
+                logger.remove(self._sink_id)
+                self._sink_id = None
+
+    def _owned(self, record: Dict) -> bool:
+        return record["extra"].get("request_id") in self._targets
+
+    def _sink(self, message) -> None:
+        record = message.record
+        target = self._targets.get(record["extra"].get("request_id"))
+        if target is not None:
+            target(format_log_record(record))
+
+
+log_router = LogRouter()
@@ -0,0 +1,195 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from app.client_pool import client_pool
+from app.config import ServerSettings
+from app.logger import logger
+
+
+# Priority classes accepted by the API; lower values are admitted first
+PRIORITIES: Dict[str, int] = {"high": 0, "normal": 1, "low": 2}
+
+Job = Callable[[], Awaitable]
+
+
+class QueueFullError(Exception):
+    """Raised when a run is submitted while the waiting queue is full."""
+
+
+class RunScheduler:
+    """Admission control for agent runs on one event loop.
+
+    At most `max_concurrent_runs` jobs execute at once. Further jobs wait in a
+    queue ordered by priority class and, within a class, by arrival, and
+    `submit` raises `QueueFullError` once `max_queue_size` jobs are waiting.
+    `submit` may be called from any thread; jobs always run on the scheduler's
+    loop.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        max_concurrent_runs: int = 4,
+        max_queue_size: int = 32,
+    ):
+        self.max_concurrent_runs = max_concurrent_runs
+        self.max_queue_size = max_queue_size
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[int, int, float, Job]] = []
+        self._sequence = itertools.count()
+        self._running: Set[asyncio.Task] = set()
+        self._closed = False
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self._waits: Deque[float] = deque(maxlen=1000)
+
+    @classmethod
+    def from_settings(
+        cls, settings: ServerSettings, loop: Optional[asyncio.AbstractEventLoop] = None
+    ) -> "RunScheduler":
+        """Create a scheduler from the `[server]` configuration section."""
+        return cls(
+            loop or asyncio.get_running_loop(),
+            max_concurrent_runs=settings.max_concurrent_runs,
+            max_queue_size=settings.max_queue_size,
+        )
+
+    def submit(self, job: Job, priority: str = "normal") -> int:
+        """Queue a coroutine function for execution and return its queue position."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        with self._lock:
+            if self._closed:
+                raise QueueFullError("Scheduler is shut down")
+            # Jobs not yet dispatched to a free slot do not count as waiting
+            free_slots = max(0, self.max_concurrent_runs - len(self._running))
+            waiting = len(self._queue) - free_slots
+            if waiting >= self.max_queue_size:
+                self.rejected += 1
+                raise QueueFullError(f"{waiting} runs are already waiting for a slot")
+            entry = (PRIORITIES[priority], next(self._sequence), time.monotonic(), job)
+            heapq.heappush(self._queue, entry)
+            self.submitted += 1
+            position = len(self._queue)
+        self._loop.call_soon_threadsafe(self._dispatch)
+        return position
+
+    def _dispatch(self) -> None:
+        """Start queued jobs while there are free slots; runs on the loop."""
+        while True:
+            with self._lock:
+                if (
+                    self._closed
+                    or not self._queue
+                    or len(self._running) >= self.max_concurrent_runs
+                ):
+                    return
+                _, _, enqueued_at, job = heapq.heappop(self._queue)
+                self._waits.append(time.monotonic() - enqueued_at)
+                task = self._loop.create_task(self._execute(job))
+                self._running.add(task)
+            task.add_done_callback(self._on_done)
+
+    @staticmethod
+    async def _execute(job: Job) -> None:
+        await job()
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        with self._lock:
+            self._running.discard(task)
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                self.failed += 1
+                logger.error(f"Scheduled run failed: {task.exception()}")
+            else:
+                self.completed += 1
+        self._dispatch()
+
+    async def shutdown(self) -> None:
+        """Drop waiting jobs and cancel the running ones."""
+        with self._lock:
+            self._closed = True
+            self._queue.clear()
+            running = list(self._running)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    def metrics(self) -> Dict:
+        """Queue depth, utilisation and wait times of recently admitted runs."""
+        with self._lock:
+            waits = sorted(self._waits)
+            depth_by_priority = {name: 0 for name in PRIORITIES}
+            names = {value: name for name, value in PRIORITIES.items()}
+            for priority, *_ in self._queue:
+                depth_by_priority[names[priority]] += 1
+            metrics = {
+                "running": len(self._running),
+                "max_concurrent_runs": self.max_concurrent_runs,
+                "queue_depth": len(self._queue),
+                "queue_depth_by_priority": depth_by_priority,
+                "max_queue_size": self.max_queue_size,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+        metrics["wait_seconds"] = {
+            "avg": sum(waits) / len(waits) if waits else 0.0,
+            "p50": self._percentile(waits, 0.5),
+            "p95": self._percentile(waits, 0.95),
+            "max": waits[-1] if waits else 0.0,
+        }
+        return metrics
+
+    @staticmethod
+    def _percentile(values: List[float], fraction: float) -> float:
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class BackgroundLoop:
+    """An event loop running forever in a daemon thread.
+
+    Lets threaded servers such as Flask hand coroutines to a single shared loop
+    instead of starting a new loop per request.
+    """
+
+    def __init__(self, name: str = "agent-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            try:
+                pending = asyncio.all_tasks(self.loop)
+                for task in pending:
+                    task.cancel()
+                self.loop.run_until_complete(
+                    asyncio.gather(*pending, return_exceptions=True)
+                )
+                self.loop.run_until_complete(client_pool.aclose_loop())
+                self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            finally:
+                self.loop.close()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the loop, cancel its remaining tasks and close its LLM clients."""
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
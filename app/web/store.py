@@ -0,0 +1,268 @@
+import bisect
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.config import PROJECT_ROOT, ServerSettings
+from app.logger import logger
+
+
+class RequestRecord:
+    """Logs and outcome of one request.
+
+    Logs are kept as chunks tagged with their character offset in the full log,
+    so a reader that remembers the offset it stopped at can fetch only what was
+    appended since. Once the logs outgrow `max_log_chars`, the oldest chunks are
+    dropped and `first_offset` moves forward.
+    """
+
+    def __init__(
+        self,
+        request_id: str,
+        max_log_chars: int,
+        created_at: Optional[float] = None,
+    ):
+        self.id = request_id
+        self.max_log_chars = max_log_chars
+        self.created_at = created_at or time.time()
+        self.completed_at: Optional[float] = None
+        self.result: Optional[str] = None
+        self.error: Optional[str] = None
+        self.first_offset = 0
+        self.end_offset = 0
+        self._starts: List[int] = []
+        self._chunks: List[str] = []
+        self._lock = threading.Lock()
+
+    @property
+    def completed(self) -> bool:
+        return self.completed_at is not None
+
+    @property
+    def size(self) -> int:
+        """Approximate memory held by the record, in characters."""
+        return (
+            self.end_offset
+            - self.first_offset
+            + len(self.result or "")
+            + len(self.error or "")
+        )
+
+    def append(self, text: str) -> None:
+        with self._lock:
+            self._starts.append(self.end_offset)
+            self._chunks.append(text)
+            self.end_offset += len(text)
+            if self.end_offset - self.first_offset > self.max_log_chars:
+                self._trim()
+
+    def _trim(self) -> None:
+        """Drop the oldest chunks until the logs use at most 3/4 of the limit."""
+        keep_from = self.end_offset - self.max_log_chars * 3 // 4
+        index = bisect.bisect_right(self._starts, keep_from) - 1
+        index = max(index, 1) if len(self._chunks) > 1 else 0
+        del self._starts[:index]
+        del self._chunks[:index]
+        self.first_offset = self._starts[0] if self._starts else self.end_offset
+
+    def finish(self, result: Optional[str] = None, error: Optional[str] = None):
+        self.result = result
+        self.error = error
+        self.completed_at = time.time()
+
+    def read_logs(self, offset: int = 0) -> Tuple[str, int]:
+        """Return the logs from offset on, or from the oldest kept chunk, and the
+        offset to continue reading from."""
+        with self._lock:
+            offset = max(offset, self.first_offset)
+            if offset >= self.end_offset:
+                return "", self.end_offset
+            index = bisect.bisect_right(self._starts, offset) - 1
+            text = "".join(self._chunks[index:])
+            return text[offset - self._starts[index] :], self.end_offset
+
+    def status(self, offset: Optional[int] = None) -> Dict:
+        """Status payload for clients; with offset, only the logs after it."""
+        logs, end_offset = self.read_logs(offset or 0)
+        payload = {"completed": self.completed, "logs": logs, "offset": end_offset}
+        if offset is not None and offset < self.first_offset:
+            payload["truncated"] = True
+        if self.completed:
+            payload["result"] = self.outcome
+        return payload
+
+    @property
+    def outcome(self) -> Optional[str]:
+        """The result shown to the user, or the error if the run failed."""
+        return f"执行错误: {self.error}" if self.error is not None else self.result
+
+
+class RequestStore:
+    """Bounded store of request records with optional SQLite persistence.
+
+    Completed records expire `ttl` seconds after they finish, and the least
+    recently used completed records are evicted once the store holds more than
+    `max_total_chars`. Running records are never evicted. With a `db_path`,
+    finished records are also written to SQLite so their results survive a
+    restart.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600.0,
+        max_log_chars: int = 1024 * 1024,
+        max_total_chars: int = 64 * 1024 * 1024,
+        db_path: Optional[Path] = None,
+    ):
+        self.ttl = ttl
+        self.max_log_chars = max_log_chars
+        self.max_total_chars = max_total_chars
+        self._lock = threading.Lock()
+        self._records: "OrderedDict[str, RequestRecord]" = OrderedDict()
+        self._last_sweep = time.time()
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._open_db(Path(db_path))
+
+    @classmethod
+    def from_settings(cls, settings: ServerSettings) -> "RequestStore":
+        """Create a store from the `[server]` configuration section."""
+        db_path = None
+        if settings.store_db_path:
+            db_path = Path(settings.store_db_path)
+            if not db_path.is_absolute():
+                db_path = PROJECT_ROOT / db_path
+        return cls(
+            ttl=settings.request_ttl,
+            max_log_chars=settings.max_request_log_chars,
+            max_total_chars=settings.max_store_chars,
+            db_path=db_path,
+        )
+
+    def _open_db(self, db_path: Path) -> None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS requests (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                completed_at REAL NOT NULL,
+                result TEXT,
+                error TEXT,
+                log_offset INTEGER NOT NULL,
+                logs TEXT NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            "DELETE FROM requests WHERE completed_at <= ?", (time.time() - self.ttl,)
+        )
+        self._db.commit()
+
+    def create(self, request_id: str) -> RequestRecord:
+        record = RequestRecord(request_id, self.max_log_chars)
+        with self._lock:
+            self._records[request_id] = record
+            self._sweep()
+        return record
+
+    def get(self, request_id: str) -> Optional[RequestRecord]:
+        """Return the record, loading it from disk if it is no longer in memory."""
+        with self._lock:
+            record = self._records.get(request_id)
+            if record is not None:
+                if record.completed and self._expired(record):
+                    del self._records[request_id]
+                    return None
+                self._records.move_to_end(request_id)
+                return record
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT created_at, completed_at, result, error, log_offset, logs "
+                "FROM requests WHERE id = ?",
+                (request_id,),
+            ).fetchone()
+            if row is None or row[1] <= time.time() - self.ttl:
+                return None
+            record = RequestRecord(request_id, self.max_log_chars, created_at=row[0])
+            record.first_offset = record.end_offset = row[4]
+            record.append(row[5])
+            record.result, record.error, record.completed_at = row[2], row[3], row[1]
+            self._records[request_id] = record
+            self._sweep()
+            return record
+
+    def discard(self, request_id: str) -> None:
+        with self._lock:
+            self._records.pop(request_id, None)
+
+    def finish(
+        self,
+        request_id: str,
+        result: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """Mark a request done and persist it when a database is configured."""
+        with self._lock:
+            record = self._records.get(request_id)
+            if record is None:
+                return
+            record.finish(result, error)
+            if self._db is not None:
+                self._persist(record)
+            self._sweep()
+
+    def _persist(self, record: RequestRecord) -> None:
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO requests "
+                "(id, created_at, completed_at, result, error, log_offset, logs) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record.id,
+                    record.created_at,
+                    record.completed_at,
+                    record.result,
+                    record.error,
+                    record.first_offset,
+                    record.read_logs(record.first_offset)[0],
+                ),
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to persist request {record.id}: {e}")
+
+    def _expired(self, record: RequestRecord) -> bool:
+        return record.completed_at <= time.time() - self.ttl
+
+    def _sweep(self) -> None:
+        """Evict expired records, then least recently used ones over budget."""
+        now = time.time()
+        if now - self._last_sweep >= min(self.ttl, 60.0):
+            self._last_sweep = now
+            for request_id in [
+                request_id
+                for request_id, record in self._records.items()
+                if record.completed and self._expired(record)
+            ]:
+                del self._records[request_id]
+            if self._db is not None:
+                self._db.execute(
+                    "DELETE FROM requests WHERE completed_at <= ?", (now - self.ttl,)
+                )
+                self._db.commit()
+
+        total = sum(record.size for record in self._records.values())
+        if total <= self.max_total_chars:
+            return
+        for request_id, record in list(self._records.items()):
+            if total <= self.max_total_chars:
+                break
+            if record.completed:
+                total -= record.size
+                del self._records[request_id]
@@ -13,6 +13,58 @@ document.addEventListener('DOMContentLoaded', function() {
     // 添加轮询状态的功能
     let pollingInterval = null;
     let requestId = null;
+    let eventSource = null;
+
+    // 请求结束后恢复界面
+    function finishRequest(resultText) {
+        if (resultText) {
+            result.textContent = resultText;
+            resultSection.style.display = 'block';
+        }
+
+        loading.style.display = 'none';
+        submitBtn.disabled = false;
+    }
+
+    // 通过SSE接收增量日志，服务器只推送新产生的日志行
+    function startStreaming(id, streamUrl) {
+        requestId = id;
+
+        // 显示处理中状态
+        loading.textContent = '正在处理您的请求，请稍候...';
+        loading.style.display = 'block';
+
+        // 初始显示日志区域
+        logSection.style.display = 'block';
+        logs.textContent = '开始处理请求...\n';
+
+        let finished = false;
+        eventSource = new EventSource(streamUrl);
+
+        eventSource.addEventListener('log', function(e) {
+            logs.textContent += JSON.parse(e.data);
+            // 自动滚动到底部
+            logs.scrollTop = logs.scrollHeight;
+        });
+
+        eventSource.addEventListener('result', function(e) {
+            finished = true;
+            finishRequest(JSON.parse(e.data));
+        });
+
+        eventSource.addEventListener('done', function() {
+            eventSource.close();
+            eventSource = null;
+        });
+
+        eventSource.onerror = function() {
+            // 连接被关闭且无法自动重连时，退回到轮询
+            if (!finished && eventSource.readyState === EventSource.CLOSED) {
+                eventSource = null;
+                startPolling(id);
+            }
+        };
+    }
 
     // 开始轮询状态
     function startPolling(id) {
@@ -26,18 +78,24 @@ document.addEventListener('DOMContentLoaded', function() {
         logSection.style.display = 'block';
         logs.textContent = '开始处理请求...\n';
         
+        // 只请求上次位置之后新增的日志
+        let offset = 0;
+        
         // 每秒轮询一次状态
         pollingInterval = setInterval(async function() {
             try {
-                const statusResponse = await fetch(`/api/status/${requestId}`);
+                const statusResponse = await fetch(`/api/status/${requestId}?offset=${offset}`);
                 const statusData = await statusResponse.json();
                 
-                // 更新日志
+                // 追加新日志
                 if (statusData.logs) {
-                    logs.textContent = statusData.logs;
+                    logs.textContent += statusData.logs;
                     // 自动滚动到底部
                     logs.scrollTop = logs.scrollHeight;
                 }
+                if (statusData.offset !== undefined) {
+                    offset = statusData.offset;
+                }
                 
                 // 如果处理完成，显示结果并停止轮询
                 if (statusData.completed) {
@@ -88,7 +146,10 @@ document.addEventListener('DOMContentLoaded', function() {
             const data = await response.json();
             
             if (response.ok) {
-                if (data.request_id) {
+                if (data.request_id && data.stream_url && window.EventSource) {
+                    // 服务器支持SSE时，实时接收日志
+                    startStreaming(data.request_id, data.stream_url);
+                } else if (data.request_id) {
                     // 如果返回了请求ID，开始轮询状态
                     startPolling(data.request_id);
                 } else {
@@ -1,13 +1,19 @@
 import asyncio
+import atexit
 import json
 from flask import Flask, request, jsonify, render_template, send_from_directory
 from flask_cors import CORS
 import os
 import sys
-from threading import Thread
+import threading
 
 from app.agent.manus import Manus
+from app.client_pool import client_pool
+from app.config import config
 from app.logger import logger
+from app.web.log_router import log_router
+from app.web.scheduler import BackgroundLoop, QueueFullError, RunScheduler
+from app.web.store import RequestStore
 
 # 创建Flask应用
 app = Flask(__name__, 
@@ -24,8 +30,23 @@ logs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
 if not os.path.exists(logs_dir):
     os.makedirs(logs_dir)
 
-# 存储请求状态的字典
-request_status = {}
+# 存储请求状态，已完成的请求按过期时间和容量上限淘汰
+request_store = RequestStore.from_settings(config.server)
+
+# 所有代理共享一个后台事件循环，由调度器限制同时运行的数量
+scheduler = None
+scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global scheduler
+    # Flask 的多线程服务器可能并发调用，加锁保证只创建一个调度器和事件循环
+    with scheduler_lock:
+        if scheduler is None:
+            agent_loop = BackgroundLoop()
+            # 进程退出时停止后台事件循环并关闭其上的LLM客户端连接
+            atexit.register(agent_loop.stop, 5.0)
+            scheduler = RunScheduler.from_settings(config.server, agent_loop.loop)
+    return scheduler
 
 # 前端页面
 @app.route('/')
@@ -37,46 +58,6 @@ def index():
 def serve_static(path):
     return send_from_directory('frontend/static', path)
 
-# 创建一个自定义的日志处理器类
-class LogCapture:
-    def __init__(self):
-        self.logs = []
-        self.handler_id = None
-        
-    def start_capture(self):
-        """开始捕获日志"""
-        self.logs = []
-        
-        # 使用loguru的sink函数来捕获日志
-        def sink(message):
-            # 保留完整的日志格式，包括时间戳、日志级别等
-            record = message.record
-            time = record["time"].strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-            level = record["level"].name
-            name = record["name"]
-            function = record["function"]
-            line = record["line"]
-            msg = record["message"]
-            
-            formatted_message = f"{time} | {level:<8} | {name}:{function}:{line} - {msg}"
-            self.logs.append(formatted_message)
-        
-        # 添加自定义处理器
-        self.handler_id = logger.add(sink, level="INFO")
-        
-    def stop_capture(self):
-        """停止捕获日志"""
-        if self.handler_id is not None:
-            logger.remove(self.handler_id)
-            self.handler_id = None
-            
-    def get_logs(self):
-        """获取捕获的日志"""
-        return '\n'.join(self.logs)
-
-# 创建日志捕获器实例
-log_capturer = LogCapture()
-
 # 生成唯一的请求ID
 def generate_request_id():
     import uuid
@@ -87,6 +68,7 @@ def generate_request_id():
 def execute_command():
     data = request.json
     input_text = data.get('input', '')
+    priority = data.get('priority', 'normal')
     
     if not input_text:
         return jsonify({'error': '请提供输入内容'}), 400
@@ -94,77 +76,50 @@ def execute_command():
     # 生成请求ID
     request_id = generate_request_id()
     
-    # 初始化请求状态
-    request_status[request_id] = {
-        'completed': False,
-        'logs': '开始处理请求...\n',
-        'result': None,
-        'error': None
-    }
+    # 初始化请求记录
+    request_store.create(request_id)
     
-    # 创建一个线程来处理请求
-    def process_request():
-        try:
-            # 创建日志捕获器
-            req_log_capturer = LogCapture()
-            req_log_capturer.start_capture()
-            
-            # 记录命令
-            logger.info(f"执行命令: {input_text}")
-            
-            # 创建一个线程来实时更新日志
-            def update_logs():
-                while not request_status[request_id]['completed']:
-                    # 获取当前日志
-                    current_logs = req_log_capturer.get_logs()
-                    
-                    # 更新请求状态中的日志
-                    request_status[request_id]['logs'] = current_logs
-                    
-                    # 每0.1秒更新一次
-                    import time
-                    time.sleep(0.1)
-            
-            # 启动日志更新线程
-            log_update_thread = Thread(target=update_logs)
-            log_update_thread.daemon = True  # 设置为守护线程，主线程结束时自动结束
-            log_update_thread.start()
-            
-            # 为每个请求创建一个新的代理实例
-            agent = create_agent()
-            
-            # 执行代理
-            result = asyncio.run(agent.run(input_text))
-            
-            # 获取最终日志
-            logs = req_log_capturer.get_logs()
-            
-            # 停止捕获
-            req_log_capturer.stop_capture()
-            
-            # 更新请求状态
-            request_status[request_id]['logs'] = logs
-            request_status[request_id]['result'] = result
-            request_status[request_id]['completed'] = True
-            
-        except Exception as e:
-            # 记录错误
-            logger.error(f"执行错误: {str(e)}")
-            
-            # 获取捕获的日志
-            logs = req_log_capturer.get_logs() if 'req_log_capturer' in locals() else '处理请求时发生错误'
-            
-            # 停止捕获
-            if 'req_log_capturer' in locals():
-                req_log_capturer.stop_capture()
-            
-            # 更新请求状态
-            request_status[request_id]['logs'] = logs
-            request_status[request_id]['error'] = str(e)
-            request_status[request_id]['completed'] = True
+    # 在调度器分配的槽位中处理请求
+    async def process_request():
+        record = request_store.get(request_id)
+        if record is None:
+            return
+        
+        # 只把带有本请求ID的日志路由到它的记录中
+        log_router.register(request_id, lambda line: record.append(line + '\n'))
+        with logger.contextualize(request_id=request_id):
+            try:
+                # 记录命令
+                logger.info(f"执行命令: {input_text}")
+                
+                # 为每个请求创建一个新的代理实例
+                agent = create_agent()
+                
+                # 执行代理
+                result = await agent.run(input_text)
+                
+                # 更新请求状态
+                request_store.finish(request_id, result=result)
+                
+            except Exception as e:
+                # 记录错误
+                logger.error(f"执行错误: {str(e)}")
+                
+                # 更新请求状态
+                request_store.finish(request_id, error=str(e))
+            finally:
+                # 停止路由日志
+                log_router.unregister(request_id)
     
-    # 启动处理线程
-    Thread(target=process_request).start()
+    # 提交到调度器，队列已满时返回429
+    try:
+        get_scheduler().submit(process_request, priority)
+    except ValueError:
+        request_store.discard(request_id)
+        return jsonify({'error': f'无效的优先级: {priority}'}), 400
+    except QueueFullError:
+        request_store.discard(request_id)
+        return jsonify({'error': '服务器繁忙，请稍后再试'}), 429
     
     # 返回请求ID
     return jsonify({
@@ -174,48 +129,39 @@ def execute_command():
 # API端点：获取请求状态
 @app.route('/api/status/<request_id>', methods=['GET'])
 def get_request_status(request_id):
-    if request_id not in request_status:
+    record = request_store.get(request_id)
+    if record is None:
         return jsonify({'error': '请求ID不存在'}), 404
     
-    status = request_status[request_id]
-    
-    # 如果请求已完成且没有错误，返回结果
-    if status['completed']:
-        if status['error']:
-            return jsonify({
-                'completed': True,
-                'logs': status['logs'],
-                'result': f"执行错误: {status['error']}"
-            })
-        else:
-            return jsonify({
-                'completed': True,
-                'logs': status['logs'],
-                'result': status['result']
-            })
-    
-    # 如果请求未完成，返回当前状态
-    return jsonify({
-        'completed': False,
-        'logs': status['logs']
-    })
+    # 带offset参数时只返回该位置之后新增的日志
+    offset = request.args.get('offset', type=int)
+    return jsonify(record.status(offset))
+
+# API端点：调度器指标
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify(get_scheduler().metrics())
 
 # 命令行接口
 async def cli_interface():
     # 创建代理实例
     agent = create_agent()
     
-    while True:
-        try:
-            prompt = input("Enter your prompt (or 'exit' to quit): ")
-            if prompt.lower() == "exit":
-                logger.info("Goodbye!")
+    try:
+        while True:
+            try:
+                prompt = input("Enter your prompt (or 'exit' to quit): ")
+                if prompt.lower() == "exit":
+                    logger.info("Goodbye!")
+                    break
+                logger.warning("Processing your request...")
+                await agent.run(prompt)
+            except KeyboardInterrupt:
+                logger.warning("Goodbye!")
                 break
-            logger.warning("Processing your request...")
-            await agent.run(prompt)
-        except KeyboardInterrupt:
-            logger.warning("Goodbye!")
-            break
+    finally:
+        # 退出前关闭本事件循环上的LLM客户端连接
+        await client_pool.aclose_loop()
 
 # 主函数
 def main():
@@ -425,6 +371,58 @@ document.addEventListener('DOMContentLoaded', function() {
     // 添加轮询状态的功能
     let pollingInterval = null;
     let requestId = null;
+    let eventSource = null;
+
+    // 请求结束后恢复界面
+    function finishRequest(resultText) {
+        if (resultText) {
+            result.textContent = resultText;
+            resultSection.style.display = 'block';
+        }
+
+        loading.style.display = 'none';
+        submitBtn.disabled = false;
+    }
+
+    // 通过SSE接收增量日志，服务器只推送新产生的日志行
+    function startStreaming(id, streamUrl) {
+        requestId = id;
+
+        // 显示处理中状态
+        loading.textContent = '正在处理您的请求，请稍候...';
+        loading.style.display = 'block';
+
+        // 初始显示日志区域
+        logSection.style.display = 'block';
+        logs.textContent = '开始处理请求...\\n';
+
+        let finished = false;
+        eventSource = new EventSource(streamUrl);
+
+        eventSource.addEventListener('log', function(e) {
+            logs.textContent += JSON.parse(e.data);
+            // 自动滚动到底部
+            logs.scrollTop = logs.scrollHeight;
+        });
+
+        eventSource.addEventListener('result', function(e) {
+            finished = true;
+            finishRequest(JSON.parse(e.data));
+        });
+
+        eventSource.addEventListener('done', function() {
+            eventSource.close();
+            eventSource = null;
+        });
+
+        eventSource.onerror = function() {
+            // 连接被关闭且无法自动重连时，退回到轮询
+            if (!finished && eventSource.readyState === EventSource.CLOSED) {
+                eventSource = null;
+                startPolling(id);
+            }
+        };
+    }
 
     // 开始轮询状态
     function startPolling(id) {
@@ -436,20 +434,26 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // 初始显示日志区域
         logSection.style.display = 'block';
-        logs.textContent = '开始处理请求...\n';
+        logs.textContent = '开始处理请求...\\n';
+        
+        // 只请求上次位置之后新增的日志
+        let offset = 0;
         
         // 每秒轮询一次状态
         pollingInterval = setInterval(async function() {
             try {
-                const statusResponse = await fetch(`/api/status/${requestId}`);
+                const statusResponse = await fetch(`/api/status/${requestId}?offset=${offset}`);
                 const statusData = await statusResponse.json();
                 
-                // 更新日志
+                // 追加新日志
                 if (statusData.logs) {
-                    logs.textContent = statusData.logs;
+                    logs.textContent += statusData.logs;
                     // 自动滚动到底部
                     logs.scrollTop = logs.scrollHeight;
                 }
+                if (statusData.offset !== undefined) {
+                    offset = statusData.offset;
+                }
                 
                 // 如果处理完成，显示结果并停止轮询
                 if (statusData.completed) {
@@ -500,7 +504,10 @@ document.addEventListener('DOMContentLoaded', function() {
             const data = await response.json();
             
             if (response.ok) {
-                if (data.request_id) {
+                if (data.request_id && data.stream_url && window.EventSource) {
+                    // 服务器支持SSE时，实时接收日志
+                    startStreaming(data.request_id, data.stream_url);
+                } else if (data.request_id) {
                     // 如果返回了请求ID，开始轮询状态
                     startPolling(data.request_id);
                 } else {
@@ -545,10 +552,17 @@ document.addEventListener('DOMContentLoaded', function() {
 });
                 ''')
         
-        # 启动Flask应用
-        print("启动Web服务器，访问 http://localhost:5001 使用前端界面")
-        print("使用 Ctrl+C 停止服务器")
-        app.run(debug=True, host='0.0.0.0', port=5001)
+        if len(sys.argv) > 1 and sys.argv[1] == '--asgi':
+            # ASGI模式：所有代理在同一个事件循环中运行，日志通过SSE实时推送
+            import uvicorn
+            print("启动ASGI服务器，访问 http://localhost:5001 使用前端界面")
+            print("使用 Ctrl+C 停止服务器")
+            uvicorn.run('app.web.asgi:app', host='0.0.0.0', port=5001)
+        else:
+            # 启动Flask应用
+            print("启动Web服务器，访问 http://localhost:5001 使用前端界面")
+            print("使用 Ctrl+C 停止服务器")
+            app.run(debug=True, host='0.0.0.0', port=5001)
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,7 @@
 import asyncio
 
 from app.agent.manus import Manus
+from app.client_pool import client_pool
 from app.flow.base import FlowType
 from app.flow.flow_factory import FlowFactory
 
@@ -8,25 +9,28 @@ from app.flow.flow_factory import FlowFactory
 async def run_flow():
     agent = Manus()
 
-    while True:
-        try:
-            prompt = input("Enter your prompt (or 'exit' to quit): ")
-            if prompt.lower() == "exit":
-                print("Goodbye!")
-                break
+    try:
+        while True:
+            try:
+                prompt = input("Enter your prompt (or 'exit' to quit): ")
+                if prompt.lower() == "exit":
+                    print("Goodbye!")
+                    break
 
-            flow = FlowFactory.create_flow(
-                flow_type=FlowType.PLANNING,
-                agents=agent,
-            )
+                flow = FlowFactory.create_flow(
+                    flow_type=FlowType.PLANNING,
+                    agents=agent,
+                )
 
-            print("Processing your request...")
-            result = await flow.execute(prompt)
-            print(result)
+                print("Processing your request...")
+                result = await flow.execute(prompt)
+                print(result)
 
-        except KeyboardInterrupt:
-            print("Goodbye!")
-            break
+            except KeyboardInterrupt:
+                print("Goodbye!")
+                break
+    finally:
+        await client_pool.aclose_loop()
 
 
 if __name__ == "__main__":
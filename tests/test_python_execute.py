@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# A host program without an `if __name__ == "__main__"` guard
+HOST_SCRIPT = """
+import asyncio
+from app.tool.python_execute import PythonExecute
+
+print("host started")
+result = asyncio.run(PythonExecute().execute("print(6 * 7)"))
+print(result["success"], result["observation"].strip())
+"""
+
+
+def _run_host(args, **kwargs) -> str:
+    env = dict(os.environ, PYTHONPATH=str(PROJECT_ROOT))
+    completed = subprocess.run(
+        [sys.executable, *args],
+        cwd=PROJECT_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=60,
+        **kwargs,
+    )
+    assert completed.returncode == 0, completed.stderr
+    return completed.stdout
+
+
+def test_runs_from_script_without_main_guard(tmp_path):
+    script = tmp_path / "host.py"
+    script.write_text(HOST_SCRIPT)
+
+    output = _run_host([str(script)])
+
+    # Workers must not re-run the host script
+    assert output.count("host started") == 1
+    assert "True 42" in output
+
+
+def test_runs_from_stdin():
+    output = _run_host(["-"], input=HOST_SCRIPT)
+
+    assert output.count("host started") == 1
+    assert "True 42" in output